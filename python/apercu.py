@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+# license : GPL 3.0
+# copyright : Franck Barbenoire (franck@barbenoi.re)
+
+"""
+Aperçu avant impression : les pages HTML du formulaire sont servies depuis
+la mémoire par un petit serveur HTTP local, au lieu d'être écrites dans un
+fichier temporaire à chaque impression.
+
+Le serveur n'écoute que sur 127.0.0.1, sur un port libre, et ne démarre
+qu'à la première page. Les adresses contiennent un jeton aléatoire : les
+autres utilisateurs de la machine ne peuvent pas les deviner. Les pages sont
+gardées dans un cache (LRU, de taille bornée) dont la clé décrit le résultat
+imprimé : réimprimer le même résultat ne refait pas le rendu.
+
+Si le serveur ne peut pas démarrer, les pages sont écrites dans un répertoire
+temporaire propre à l'utilisateur (Fichiers), dont les fichiers trop anciens
+ou trop nombreux sont supprimés à chaque écriture, y compris ceux laissés par
+une session précédente.
+
+>>> from urllib.request import urlopen
+>>> apercu = Apercu(taille=2)
+>>> apercu.serveur is None
+True
+>>> url = apercu.publier("a", lambda: "<p>a</p>")
+>>> urlopen(url).read()
+b'<p>a</p>'
+>>> apercu.publier("a", lambda: "<p>autre rendu</p>") == url, apercu.rendus
+(True, 1)
+>>> _ = apercu.publier("b", lambda: "b"); _ = apercu.publier("c", lambda: "c")
+>>> urlopen(url)  # doctest: +IGNORE_EXCEPTION_DETAIL
+Traceback (most recent call last):
+...
+urllib.error.HTTPError: HTTP Error 404: Not Found
+>>> apercu.arreter()
+"""
+
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import secrets
+import stat
+import sys
+import tempfile
+import threading
+import time
+
+# nombre de pages gardées en mémoire
+TAILLE = 32
+
+# fichiers de secours : durée de vie (secondes) et nombre maximal
+DUREE = 3600
+NOMBRE = 20
+
+
+class Apercu:
+    """Pages servies par un serveur HTTP local, démarré à la première page"""
+
+    def __init__(self, taille=TAILLE, fichiers=None):
+        self.taille = taille
+        # clé -> (chemin, page), chemin -> clé
+        self.pages = OrderedDict()
+        self.cles = {}
+        self.verrou = threading.Lock()
+        self.jeton = secrets.token_urlsafe(16)
+        self.serveur = None
+        self.fichiers = fichiers
+        # nombre de pages rendues (les autres viennent du cache)
+        self.rendus = 0
+        self.numero = 0
+
+    def _demarrer(self):
+        apercu = self
+
+        class Gestionnaire(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                with apercu.verrou:
+                    cle = apercu.cles.get(self.path)
+                    page = None if cle is None else apercu.pages[cle][1]
+                if page is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(page)))
+                self.end_headers()
+                self.wfile.write(page)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.serveur = ThreadingHTTPServer(("127.0.0.1", 0), Gestionnaire)
+        self.serveur.daemon_threads = True
+        threading.Thread(target=self.serveur.serve_forever, daemon=True).start()
+
+    def publier(self, cle, rendre):
+        """Renvoie l'adresse de la page de clé cle ; rendre() n'est appelé
+        que si la page n'est pas en cache
+        """
+        if self.serveur is None:
+            self._demarrer()
+        with self.verrou:
+            page = self.pages.get(cle)
+            if page is not None:
+                self.pages.move_to_end(cle)
+        if page is not None:
+            chemin = page[0]
+        else:
+            html = rendre().encode("utf-8")
+            self.rendus += 1
+            with self.verrou:
+                self.numero += 1
+                chemin = "/%s/%d.html" % (self.jeton, self.numero)
+                self.pages[cle] = (chemin, html)
+                self.cles[chemin] = cle
+                while len(self.pages) > self.taille:
+                    ancien, page = self.pages.popitem(last=False)
+                    del self.cles[page[0]]
+        return "http://127.0.0.1:%d%s" % (self.serveur.server_port, chemin)
+
+    def afficher(self, cle, rendre):
+        """Ouvre la page dans le navigateur, depuis un fichier si le serveur
+        ne peut pas démarrer
+        """
+        import webbrowser
+
+        try:
+            url = self.publier(cle, rendre)
+        except OSError as e:
+            sys.stderr.write("Serveur d'aperçu indisponible : %s\n" % e)
+            if self.fichiers is None:
+                self.fichiers = Fichiers()
+            url = "file://" + self.fichiers.ecrire(rendre())
+        webbrowser.open(url, new=2)
+
+    def arreter(self):
+        if self.serveur is not None:
+            self.serveur.shutdown()
+            self.serveur.server_close()
+            self.serveur = None
+
+
+def verifier(repertoire):
+    """Vérifie que le répertoire (pas un lien) appartient à l'utilisateur et
+    que lui seul y a accès, lève OSError sinon
+    >>> repertoire = tempfile.mkdtemp()
+    >>> verifier(repertoire)
+    >>> os.chmod(repertoire, 0o755)
+    >>> verifier(repertoire)  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    PermissionError: Répertoire des aperçus non protégé : ...
+    """
+    etat = os.lstat(repertoire)
+    if not stat.S_ISDIR(etat.st_mode) or etat.st_uid != os.getuid() or etat.st_mode & 0o077:
+        raise PermissionError("Répertoire des aperçus non protégé : %s" % repertoire)
+
+
+class Fichiers:
+    """Pages écrites dans un répertoire temporaire, supprimées après duree
+    secondes ou au-delà de nombre pages
+    >>> repertoire = tempfile.mkdtemp()
+    >>> fichiers = Fichiers(repertoire, duree=3600, nombre=2)
+    >>> for i in range(3):
+    ...     chemin = fichiers.ecrire("<p>%d</p>" % i)
+    >>> len(os.listdir(repertoire))
+    2
+    >>> fichiers.duree = 0
+    >>> fichiers.nettoyer()
+    >>> os.listdir(repertoire)
+    []
+
+    Si le répertoire par défaut n'est pas protégé, un autre est créé :
+
+    >>> tempfile.tempdir, ancien = tempfile.mkdtemp(), tempfile.tempdir
+    >>> defaut = os.path.join(tempfile.gettempdir(), "formulaires-%d" % os.getuid())
+    >>> os.mkdir(defaut, 0o777); os.chmod(defaut, 0o777)
+    >>> fichiers = Fichiers()
+    >>> fichiers.repertoire == defaut, oct(os.stat(fichiers.repertoire).st_mode & 0o777)
+    (False, '0o700')
+    >>> tempfile.tempdir = ancien
+    """
+
+    def __init__(self, repertoire=None, duree=DUREE, nombre=NOMBRE):
+        if repertoire is None:
+            repertoire = os.path.join(tempfile.gettempdir(), "formulaires-%d" % os.getuid())
+            try:
+                os.makedirs(repertoire, mode=0o700, exist_ok=True)
+                verifier(repertoire)
+            except OSError:
+                # nom prévisible, créé par un autre utilisateur (ou fichier
+                # quelconque) : répertoire propre à cette session
+                repertoire = tempfile.mkdtemp(prefix="formulaires-")
+        else:
+            os.makedirs(repertoire, mode=0o700, exist_ok=True)
+            verifier(repertoire)
+        self.repertoire = repertoire
+        self.duree = duree
+        self.nombre = nombre
+
+    def nettoyer(self, garder=0):
+        """Supprime les pages trop anciennes, puis les plus anciennes au-delà
+        de nombre - garder pages
+        """
+        pages = []
+        maintenant = time.time()
+        for nom in os.listdir(self.repertoire):
+            if not nom.endswith(".html"):
+                continue
+            chemin = os.path.join(self.repertoire, nom)
+            try:
+                date = os.stat(chemin).st_mtime
+                if maintenant - date >= self.duree:
+                    os.remove(chemin)
+                else:
+                    pages.append((date, chemin))
+            except OSError:
+                pass
+        pages.sort()
+        for date, chemin in pages[:max(0, len(pages) - (self.nombre - garder))]:
+            try:
+                os.remove(chemin)
+            except OSError:
+                pass
+
+    def ecrire(self, html):
+        """Écrit la page et renvoie son chemin"""
+        self.nettoyer(garder=1)
+        descripteur, chemin = tempfile.mkstemp(suffix=".html", dir=self.repertoire)
+        with os.fdopen(descripteur, "w", encoding="utf-8") as f:
+            f.write(html)
+        return chemin
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+# license : GPL 3.0
+# copyright : Franck Barbenoire (franck@barbenoi.re)
+
+"""
+Mesures de performance des calculs, des traitements par lots, du rendu HTML
+et de la mise à jour des onglets du formulaire.
+
+Chaque mesure donne la durée d'une opération (meilleure de plusieurs séries).
+Les résultats sont écrits en JSON et peuvent être comparés à une référence
+enregistrée précédemment : une mesure plus lente que la référence au-delà du
+seuil est signalée comme une régression et le programme sort en erreur.
+
+Exemples : ::
+
+    python bench.py --enregistrer            # crée bench_reference.json
+    python bench.py --comparer               # compare à bench_reference.json
+    python bench.py --sortie resultats.json  # écrit les mesures
+
+Les mesures qui demandent un module absent (numpy, jinja2) sont ignorées.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+
+import formules
+
+REFERENCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_reference.json")
+
+PARAMETRES = formules.Parametres(taux_sel=0.018)
+
+# anciens noms des mesures renommées : une référence enregistrée avant le
+# changement de nom reste comparable
+ANCIENS_NOMS = {
+    "TabPoidsPateImpose.update": "PateImposee.update",
+    "TabCommon.to_html": "PateImposee.to_html",
+}
+
+
+def enregistrements(n):
+    return [
+        {"calcul": "p", "ptp": 500 + i % 1500, "thp": 60 + i % 20, "thl": 100, "tlf": 10 + i % 40}
+        for i in range(n)
+    ]
+
+
+def mesures():
+    """Génère les mesures (nom, fonction à chronométrer, nombre d'opérations
+    par appel de la fonction)
+    """
+    p = PARAMETRES
+    yield ("calcul_eau_farine_sel",
+           lambda: formules.calcul_eau_farine_sel(0.6, 1.0, 0.3, 100.0, p), 1)
+    yield ("calcul_pate_imposee",
+           lambda: formules.calcul_pate_imposee(920, 0.6, 1.0, 0.3, p), 1)
+    yield ("calcul_levain_impose",
+           lambda: formules.calcul_levain_impose(200, 0.6, 1.0, 0.25, p), 1)
+    yield ("calcul_equivalence",
+           lambda: formules.calcul_equivalence(500, 300, 0.7, 0.4, p), 1)
+    yield ("calcul_pate_imposee_defaut",
+           lambda: formules.calcul_pate_imposee(920, 0.6, 1.0, 0.3), 1)
+
+    import lot
+    lignes = enregistrements(10000)
+    yield ("lot.traiter", lambda: sum(1 for _ in lot.traiter(lignes, p)), len(lignes))
+
+    from cache import Cache
+    cache = Cache(16)
+    yield ("cache.calcul_pate_imposee",
+           lambda: cache.calcul_pate_imposee(920, 0.6, 1.0, 0.3, p), 1)
+
+    try:
+        import numpy as np
+        import vectoriel
+    except ImportError:
+        yield "vectoriel", None, 0
+    else:
+        n = 100000
+        ptp = np.linspace(500, 2000, n)
+        thp = np.linspace(0.55, 0.8, n)
+        yield ("vectoriel.calcul_pate_imposee",
+               lambda: vectoriel.calcul_pate_imposee(ptp, thp, 1.0, 0.3, p), n)
+        yield ("vectoriel.calcul_levain_impose",
+               lambda: vectoriel.calcul_levain_impose(ptp / 5, thp, 1.0, 0.3, p), n)
+        yield ("vectoriel.calcul_equivalence",
+               lambda: vectoriel.calcul_equivalence(ptp, ptp * thp, 1.0, 0.3, p), n)
+
+    import modeles
+    modele = modeles.PateImposee()
+    modele.parametres = p
+
+    def mise_a_jour():
+        # recalcul complet à chaque appel, même si les entrées n'ont pas changé
+        modele.last_values = None
+        modele.update()
+
+    yield ("PateImposee.update", mise_a_jour, 1)
+    try:
+        import jinja2
+    except ImportError:
+        yield "PateImposee.to_html", None, 0
+    else:
+        yield ("PateImposee.to_html", modele.to_html, 1)
+
+
+def chronometrer(fonction, operations, repetitions=5, duree_min=0.2):
+    """Renvoie la durée d'une opération en microsecondes"""
+    chrono = timeit.Timer(fonction)
+    nombre, _ = chrono.autorange()
+    nombre = max(1, int(nombre * duree_min / 0.2))
+    meilleur = min(chrono.repeat(repeat=repetitions, number=nombre))
+    return meilleur / nombre / operations * 1e6
+
+
+def executer(filtre=None):
+    resultats = {}
+    ignores = []
+    for nom, fonction, operations in mesures():
+        if filtre and filtre not in nom:
+            continue
+        if fonction is None:
+            ignores.append(nom)
+            continue
+        resultats[nom] = round(chronometrer(fonction, operations), 4)
+    return {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "unite": "µs par opération",
+        "mesures": resultats,
+        "ignorees": ignores
+    }
+
+
+def comparer(actuel, reference, seuil):
+    """Renvoie les lignes du rapport de comparaison et la liste des régressions.
+    Les mesures de la référence sont renommées selon ANCIENS_NOMS ; celles
+    qui n'ont pas été mesurées sont signalées.
+    >>> lignes, regressions = comparer(
+    ...     {"a": 1.5, "b": 1.0, "c": 2.0, "PateImposee.update": 3.0},
+    ...     {"a": 1.0, "b": 1.0, "d": 1.0, "TabPoidsPateImpose.update": 3.0}, 1.3)
+    >>> regressions
+    ['a']
+    >>> print("\\n".join(lignes))
+    PateImposee.update                           3.0000     3.0000   x1.00
+    a                                            1.5000     1.0000   x1.50  RÉGRESSION
+    b                                            1.0000     1.0000   x1.00
+    c                                            2.0000          -       -  nouveau
+    d                                                 -     1.0000       -  absente
+    """
+    reference = dict((ANCIENS_NOMS.get(nom, nom), v) for nom, v in reference.items())
+    lignes = []
+    regressions = []
+    for nom, valeur in sorted(actuel.items()):
+        ancien = reference.get(nom)
+        if ancien is None:
+            lignes.append("%-40s %10.4f %10s %7s  nouveau" % (nom, valeur, "-", "-"))
+            continue
+        rapport = valeur / ancien if ancien else float("inf")
+        etat = ""
+        if rapport > seuil:
+            etat = "RÉGRESSION"
+            regressions.append(nom)
+        lignes.append(("%-40s %10.4f %10.4f   x%.2f  %s" % (nom, valeur, ancien, rapport, etat)).rstrip())
+    for nom, ancien in sorted(reference.items()):
+        if nom not in actuel:
+            lignes.append("%-40s %10s %10.4f %7s  absente" % (nom, "-", ancien, "-"))
+    return lignes, regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="mesures de performance")
+    parser.add_argument('-t', "--test", action="store_true", help="passer les tests")
+    parser.add_argument("--filtre", help="ne lancer que les mesures dont le nom contient ce texte")
+    parser.add_argument("--sortie", metavar="FICHIER", help="fichier JSON des résultats")
+    parser.add_argument("--reference", default=REFERENCE, metavar="FICHIER", help="fichier de référence")
+    parser.add_argument("--enregistrer", action="store_true", help="enregistrer les résultats comme référence")
+    parser.add_argument("--comparer", action="store_true", help="comparer les résultats à la référence")
+    parser.add_argument("--seuil", type=float, default=1.3, help="rapport signalé comme une régression")
+    args = parser.parse_args()
+
+    if args.test:
+        import doctest
+        doctest.testmod()
+        sys.exit(0)
+
+    resultats = executer(args.filtre)
+    texte = json.dumps(resultats, indent=2, ensure_ascii=False)
+    if args.sortie:
+        with open(args.sortie, "w", encoding="utf-8") as f:
+            f.write(texte + "\n")
+    elif not args.comparer:
+        print(texte)
+    if resultats["ignorees"]:
+        sys.stderr.write("Mesures ignorées : %s\n" % ", ".join(resultats["ignorees"]))
+
+    if args.enregistrer:
+        with open(args.reference, "w", encoding="utf-8") as f:
+            f.write(texte + "\n")
+
+    if args.comparer:
+        try:
+            with open(args.reference, encoding="utf-8") as f:
+                reference = json.load(f)["mesures"]
+        except (OSError, ValueError, KeyError):
+            sys.stderr.write("Référence illisible : %s\n" % args.reference)
+            sys.exit(2)
+        if args.filtre:
+            reference = dict(
+                (nom, v) for nom, v in reference.items()
+                if args.filtre in ANCIENS_NOMS.get(nom, nom)
+            )
+        lignes, regressions = comparer(resultats["mesures"], reference, args.seuil)
+        print("%-40s %10s %10s %7s" % ("mesure (µs)", "actuel", "référence", "rapport"))
+        print("\n".join(lignes))
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+# license : GPL 3.0
+# copyright : Franck Barbenoire (franck@barbenoi.re)
+
+"""
+Mémorisation (LRU, de taille bornée) des résultats des calculs de formules.py.
+
+Un objet Cache propose les mêmes fonctions calcul_* que formules.py et peut
+donc le remplacer là où les mêmes recettes sont calculées de nombreuses fois.
+La clé de chaque résultat comprend les paramètres (taux de sel, précision) :
+un changement de configuration ne peut pas renvoyer un résultat périmé.
+
+>>> cache = Cache(taille_max=2)
+>>> p = formules.Parametres(taux_sel=0.02)
+>>> cache.calcul_pate_imposee(920, 0.6, 1.0, 0.3, p)
+(442.3, 212.3, 265.4, 11.5)
+>>> cache.calcul_pate_imposee(920, 0.6, 1.0, 0.3, p)
+(442.3, 212.3, 265.4, 11.5)
+>>> cache.calcul_pate_imposee(920, 0.6, 1.0, 0.3, formules.Parametres(taux_sel=0.018))
+(442.3, 212.3, 265.4, 10.3)
+>>> cache.calcul_levain_impose(200, 0.6, 1.0, 0.25, p)
+(400.0, 200.0, 800.0, 10.0)
+>>> cache.statistiques()
+{'succes': 1, 'echecs': 3, 'evictions': 1, 'taille': 2, 'taille_max': 2}
+>>> cache.vider()
+>>> cache.statistiques()
+{'succes': 0, 'echecs': 0, 'evictions': 0, 'taille': 0, 'taille_max': 2}
+"""
+
+from collections import OrderedDict
+import threading
+
+import formules
+
+
+class Cache:
+
+    def __init__(self, taille_max=1024):
+        if taille_max < 1:
+            raise ValueError("La taille du cache doit être positive")
+        self.taille_max = taille_max
+        self.verrou = threading.Lock()
+        self.vider()
+
+    def vider(self):
+        """Vide le cache et remet les compteurs à zéro"""
+        with self.verrou:
+            self.resultats = OrderedDict()
+            self.succes = 0
+            self.echecs = 0
+            self.evictions = 0
+
+    def statistiques(self):
+        with self.verrou:
+            return {
+                "succes": self.succes,
+                "echecs": self.echecs,
+                "evictions": self.evictions,
+                "taille": len(self.resultats),
+                "taille_max": self.taille_max
+            }
+
+    @staticmethod
+    def cle(nom, valeurs, parametres=None):
+        if parametres is None:
+            parametres = formules.parametres_defaut()
+        return (nom, tuple(valeurs), parametres)
+
+    def obtenir(self, cle):
+        """Renvoie le résultat mémorisé pour la clé, None s'il est absent"""
+        with self.verrou:
+            resultat = self.resultats.get(cle)
+            if resultat is None:
+                self.echecs += 1
+            else:
+                self.succes += 1
+                self.resultats.move_to_end(cle)
+            return resultat
+
+    def ajouter(self, cle, resultat):
+        with self.verrou:
+            self.resultats[cle] = resultat
+            self.resultats.move_to_end(cle)
+            while len(self.resultats) > self.taille_max:
+                self.resultats.popitem(last=False)
+                self.evictions += 1
+
+    def calculer(self, fonction, valeurs, parametres=None):
+        cle = self.cle(fonction.__name__, valeurs, parametres)
+        resultat = self.obtenir(cle)
+        if resultat is None:
+            resultat = fonction(*valeurs, parametres=cle[2])
+            self.ajouter(cle, resultat)
+        return resultat
+
+    def calcul_pate_imposee(self, ptp, thp, thl, tlf, parametres=None):
+        return self.calculer(formules.calcul_pate_imposee, (ptp, thp, thl, tlf), parametres)
+
+    def calcul_levain_impose(self, pl, thp, thl, tlf, parametres=None):
+        return self.calculer(formules.calcul_levain_impose, (pl, thp, thl, tlf), parametres)
+
+    def calcul_equivalence(self, ptf, pte, thl, tlf, parametres=None):
+        return self.calculer(formules.calcul_equivalence, (ptf, pte, thl, tlf), parametres)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
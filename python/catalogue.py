@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+# license : GPL 3.0
+# copyright : Franck Barbenoire (franck@barbenoi.re)
+
+"""
+Catalogue de recettes dans une base SQLite locale.
+
+Une recette est un jeu de paramètres nommé, rangé dans une catégorie : taux
+d'hydratation de la pâte et du levain, taux levain farine, taux de sel et,
+facultativement, poids de la pâte. Comme dans les formulaires, les taux sont
+exprimés en pourcentage. Sans taux de sel, c'est celui de la configuration
+qui est utilisé.
+
+Les recettes s'importent et s'exportent aux formats de lot.py (CSV ou JSON
+Lines). Le nom et la catégorie sont indexés. Une sélection de recettes est
+évaluée en un seul appel des fonctions vectorisées de vectoriel.py, avec le
+taux de sel propre à chaque recette.
+
+>>> import io
+>>> catalogue = Catalogue()
+>>> catalogue.importer(lot.lire(io.StringIO(
+...     "nom,categorie,thp,thl,tlf,sel,ptp\\n"
+...     "campagne,pain,60,100,30,,920\\n"
+...     "seigle,pain,80,100,25,1.8,1000\\n"
+...     "brioche,viennoiserie,55,100,20,1.5,\\n")))
+3
+>>> catalogue.obtenir("seigle")
+Recette(nom='seigle', categorie='pain', thp=80.0, thl=100.0, tlf=25.0, sel=1.8, ptp=1000.0)
+>>> [r.nom for r in catalogue.recettes(categorie="pain")]
+['campagne', 'seigle']
+>>> e = catalogue.evaluer(parametres=formules.Parametres(0.02))
+>>> for i, nom in enumerate(e.noms):
+...     print(nom, e.pf[i], e.pe[i], e.pl[i], e.ps[i], e.faisable[i])
+brioche nan nan nan nan False
+campagne 442.3 212.3 265.4 11.5 True
+seigle 444.4 333.3 222.2 10.0 True
+>>> e = catalogue.evaluer(categorie="viennoiserie", ptp=500)
+>>> float(e.pf[0]), float(e.ps[0])
+(268.8, 4.8)
+>>> sortie = io.StringIO()
+>>> catalogue.exporter(sortie, "jsonl", categorie="viennoiserie")
+1
+>>> print(sortie.getvalue(), end="")
+{"nom": "brioche", "categorie": "viennoiserie", "thp": 55.0, "thl": 100.0, "tlf": 20.0, "sel": 1.5, "ptp": null}
+"""
+
+import argparse
+from collections import namedtuple
+import sqlite3
+import sys
+
+import formules
+import lot
+
+CHAMPS = ("nom", "categorie", "thp", "thl", "tlf", "sel", "ptp")
+# champs qui peuvent être absents
+FACULTATIFS = ("sel", "ptp")
+
+Recette = namedtuple("Recette", CHAMPS)
+
+Evaluation = namedtuple("Evaluation", ["noms", "ptp", "pf", "pe", "pl", "ps", "faisable"])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recettes (
+    nom TEXT NOT NULL,
+    categorie TEXT NOT NULL DEFAULT '',
+    thp REAL NOT NULL,
+    thl REAL NOT NULL,
+    tlf REAL NOT NULL,
+    sel REAL,
+    ptp REAL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS recettes_nom ON recettes (nom);
+CREATE INDEX IF NOT EXISTS recettes_categorie ON recettes (categorie, nom);
+"""
+
+
+def recette(enregistrement):
+    """Convertit un enregistrement lu par lot.lire() en Recette
+    >>> recette({"nom": "pain", "thp": "62,5", "thl": 100, "tlf": "20"})
+    Recette(nom='pain', categorie='', thp=62.5, thl=100.0, tlf=20.0, sel=None, ptp=None)
+    >>> recette({"nom": "pain", "thp": "-1", "thl": 100, "tlf": "20"})  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ...
+    lot.ErreurEnregistrement: thp incorrect
+    """
+    if isinstance(enregistrement, lot.Illisible):
+        raise lot.ErreurEnregistrement(enregistrement[lot.ERREUR])
+    nom = enregistrement.get("nom")
+    if not nom:
+        raise lot.ErreurEnregistrement("nom manquant")
+    valeurs = [nom, enregistrement.get("categorie") or ""]
+    for champ in CHAMPS[2:]:
+        v = enregistrement.get(champ)
+        if champ in FACULTATIFS and (v is None or v == ""):
+            valeurs.append(None)
+            continue
+        v = lot.lire_valeur(enregistrement, champ)
+        # lire_valeur convertit les taux en fractions
+        valeurs.append(round(v * 100, 12) if champ in lot.TAUX else v)
+    return Recette(*valeurs)
+
+
+class Catalogue:
+
+    def __init__(self, chemin=":memory:"):
+        self.connexion = sqlite3.connect(chemin)
+        self.connexion.executescript(SCHEMA)
+
+    def fermer(self):
+        self.connexion.close()
+
+    def selection(self, champs, categorie=None, motif=None):
+        """Exécute la requête des recettes de la catégorie, dont le nom
+        correspond au motif (syntaxe de LIKE), triées par nom
+        """
+        requete = "SELECT %s FROM recettes" % ", ".join(champs)
+        conditions, arguments = [], []
+        if categorie is not None:
+            conditions.append("categorie = ?")
+            arguments.append(categorie)
+        if motif is not None:
+            conditions.append("nom LIKE ?")
+            arguments.append(motif)
+        if conditions:
+            requete += " WHERE " + " AND ".join(conditions)
+        return self.connexion.execute(requete + " ORDER BY nom", arguments)
+
+    def ajouter(self, recette):
+        self.importer([recette._asdict()])
+
+    def importer(self, enregistrements):
+        """Ajoute ou remplace les recettes, en une seule transaction.
+        Renvoie le nombre de recettes importées.
+        """
+        recettes = [recette(e) for e in enregistrements]
+        with self.connexion:
+            self.connexion.executemany(
+                "INSERT INTO recettes (%s) VALUES (%s) "
+                "ON CONFLICT (nom) DO UPDATE SET %s" % (
+                    ", ".join(CHAMPS), ", ".join("?" * len(CHAMPS)),
+                    ", ".join("%s = excluded.%s" % (c, c) for c in CHAMPS[1:])
+                ),
+                recettes
+            )
+        return len(recettes)
+
+    def exporter(self, sortie, format="csv", categorie=None, motif=None):
+        """Écrit les recettes et renvoie leur nombre"""
+        ecrivain = lot.Ecrivain(sortie, format, CHAMPS)
+        n = 0
+        for ligne in self.selection(CHAMPS, categorie, motif):
+            ecrivain.ecrire(dict(zip(CHAMPS, ligne)))
+            n += 1
+        return n
+
+    def recettes(self, categorie=None, motif=None):
+        return [Recette(*ligne) for ligne in self.selection(CHAMPS, categorie, motif)]
+
+    def obtenir(self, nom):
+        """Renvoie la recette nom, None si elle n'existe pas"""
+        ligne = self.connexion.execute(
+            "SELECT %s FROM recettes WHERE nom = ?" % ", ".join(CHAMPS), (nom,)
+        ).fetchone()
+        return None if ligne is None else Recette(*ligne)
+
+    def categories(self):
+        return [c for c, in self.connexion.execute(
+            "SELECT DISTINCT categorie FROM recettes ORDER BY categorie"
+        )]
+
+    def evaluer(self, categorie=None, motif=None, ptp=None, parametres=None):
+        """Calcule les pâtes des recettes sélectionnées, en un seul appel de
+        vectoriel.calcul_pate_imposee. Le poids de la pâte est ptp s'il est
+        donné, celui de chaque recette sinon ; les recettes sans poids ont des
+        résultats NaN et ne sont pas faisables.
+        """
+        import numpy as np
+        import vectoriel
+
+        if parametres is None:
+            parametres = formules.parametres_defaut()
+        lignes = self.selection(
+            ("nom", "ptp", "thp", "thl", "tlf", "sel"), categorie, motif
+        ).fetchall()
+        noms = [ligne[0] for ligne in lignes]
+        # None -> NaN
+        valeurs = np.array([ligne[1:] for ligne in lignes], dtype=np.float64).reshape(-1, 5)
+        poids = valeurs[:, 0] if ptp is None else np.full(len(noms), float(ptp))
+        thp, thl, tlf = (valeurs[:, i] / 100 for i in (1, 2, 3))
+        sel = valeurs[:, 4]
+        taux_sel = np.where(np.isnan(sel), parametres.taux_sel, sel / 100)
+        pf, pe, pl, ps, faisable = vectoriel.calcul_pate_imposee(
+            poids, thp, thl, tlf, parametres, taux_sel
+        )
+        return Evaluation(noms, poids, pf, pe, pl, ps, faisable)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="catalogue de recettes")
+    parser.add_argument('-t', "--test", action="store_true", help="passer les tests")
+    parser.add_argument("base", nargs='?', help="fichier de la base SQLite")
+    parser.add_argument('-i', "--importer", metavar="FICHIER", help="importer les recettes du fichier ('-' : entrée standard)")
+    parser.add_argument('-e', "--exporter", action="store_true", help="exporter les recettes sur la sortie standard")
+    parser.add_argument("--evaluer", action="store_true", help="calculer les pâtes des recettes")
+    parser.add_argument('-p', "--ptp", type=float, help="poids de la pâte, pour toutes les recettes évaluées")
+    parser.add_argument('-c', "--categorie", help="ne traiter que les recettes de la catégorie")
+    parser.add_argument('-m', "--motif", help="ne traiter que les recettes dont le nom correspond au motif (LIKE)")
+    parser.add_argument('-f', "--format", choices=lot.FORMATS, default="csv", help="format des fichiers")
+    args = parser.parse_args()
+
+    if args.test:
+        import doctest
+        doctest.testmod()
+        sys.exit(0)
+    if not args.base:
+        parser.print_usage()
+        sys.exit(1)
+
+    catalogue = Catalogue(args.base)
+    try:
+        if args.importer:
+            fe = sys.stdin if args.importer == "-" else open(args.importer, encoding="utf-8", newline="")
+            try:
+                n = catalogue.importer(lot.lire(fe, args.format))
+            except lot.ErreurEnregistrement as e:
+                sys.stderr.write("Import annulé : %s\n" % e)
+                sys.exit(1)
+            finally:
+                if fe is not sys.stdin:
+                    fe.close()
+            sys.stderr.write("%d recettes importées\n" % n)
+        if args.exporter:
+            catalogue.exporter(sys.stdout, args.format, args.categorie, args.motif)
+        if args.evaluer:
+            formules.lire_taux_sel()
+            e = catalogue.evaluer(args.categorie, args.motif, args.ptp)
+            for i, nom in enumerate(e.noms):
+                print("\n%s (%.1f)" % (nom, e.ptp[i]))
+                if not e.faisable[i]:
+                    print("Incompatibilité des taux d'hydratation ou poids manquant")
+                    continue
+                print("Poids de farine : %.1f" % e.pf[i])
+                print("Poids d'eau : %.1f" % e.pe[i])
+                print("Poids du levain : %.1f" % e.pl[i])
+                print("Poids du sel : %.1f" % e.ps[i])
+    finally:
+        catalogue.fermer()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+# license : GPL 3.0
+# copyright : Franck Barbenoire (franck@barbenoi.re)
+
+"""
+Test de charge du service HTTP (service.py).
+
+Des clients simultanés, chacun sur une connexion persistante, envoient des
+requêtes de calcul tirées au hasard. Le programme affiche le nombre de
+requêtes par seconde et les latences médiane (p50) et p99.
+
+Exemple : ::
+
+    python service.py &
+    python charge.py --connexions 64 --requetes 20000
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+
+def requete_aleatoire(alea):
+    """Renvoie le chemin et le corps d'une requête de calcul au hasard"""
+    calcul = alea.choice(("pate", "levain", "equivalence"))
+    if calcul == "pate":
+        corps = {"ptp": alea.randint(300, 3000)}
+    elif calcul == "levain":
+        corps = {"pl": alea.randint(50, 500)}
+    else:
+        corps = {"ptf": alea.randint(300, 1500), "pte": alea.randint(200, 1000)}
+    if calcul != "equivalence":
+        corps["thp"] = alea.randint(55, 80)
+    corps["thl"] = alea.randint(50, 100)
+    corps["tlf"] = alea.randint(10, 60)
+    return "/" + calcul, json.dumps(corps).encode("utf-8")
+
+
+def centile(valeurs_triees, p):
+    """
+    >>> centile(list(range(1, 101)), 50), centile(list(range(1, 101)), 99)
+    (50, 99)
+    """
+    rang = max(0, int(round(p / 100 * len(valeurs_triees))) - 1)
+    return valeurs_triees[rang]
+
+
+async def client(hote, port, nombre, latences, graine):
+    alea = random.Random(graine)
+    lecteur, ecrivain = await asyncio.open_connection(hote, port)
+    try:
+        for i in range(nombre):
+            chemin, corps = requete_aleatoire(alea)
+            debut = time.perf_counter()
+            ecrivain.write((
+                "POST %s HTTP/1.1\r\n"
+                "Host: %s\r\n"
+                "Content-Type: application/json\r\n"
+                "Content-Length: %d\r\n\r\n" % (chemin, hote, len(corps))
+            ).encode("latin-1") + corps)
+            await ecrivain.drain()
+
+            await lecteur.readline()
+            longueur = 0
+            while True:
+                ligne = await lecteur.readline()
+                if ligne in (b"\r\n", b""):
+                    break
+                cle, _, valeur = ligne.decode("latin-1").partition(":")
+                if cle.strip().lower() == "content-length":
+                    longueur = int(valeur)
+            await lecteur.readexactly(longueur)
+            latences.append(time.perf_counter() - debut)
+    finally:
+        ecrivain.close()
+
+
+async def charger(hote, port, connexions, requetes):
+    latences = []
+    par_client = [requetes // connexions] * connexions
+    for i in range(requetes % connexions):
+        par_client[i] += 1
+    debut = time.perf_counter()
+    await asyncio.gather(*(
+        client(hote, port, n, latences, i) for i, n in enumerate(par_client)
+    ))
+    duree = time.perf_counter() - debut
+    return latences, duree
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="test de charge du service de calcul")
+    parser.add_argument('-t', "--test", action="store_true", help="passer les tests")
+    parser.add_argument("--hote", default="127.0.0.1", help="adresse du service")
+    parser.add_argument("--port", type=int, default=8080, help="port du service")
+    parser.add_argument("--connexions", type=int, default=32, help="clients simultanés")
+    parser.add_argument("--requetes", type=int, default=10000, help="nombre total de requêtes")
+    args = parser.parse_args()
+
+    if args.test:
+        import doctest
+        doctest.testmod()
+    else:
+        latences, duree = asyncio.run(
+            charger(args.hote, args.port, args.connexions, args.requetes)
+        )
+        latences.sort()
+        print("Requêtes : %d en %.2f s" % (len(latences), duree))
+        print("Requêtes par seconde : %.0f" % (len(latences) / duree))
+        print("Latence p50 : %.2f ms" % (centile(latences, 50) * 1000))
+        print("Latence p99 : %.2f ms" % (centile(latences, 99) * 1000))
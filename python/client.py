@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+# license : GPL 3.0
+# copyright : Franck Barbenoire (franck@barbenoi.re)
+
+"""
+Client du démon de calcul (voir service.py --socket).
+
+Le démon reste chargé et répond sur un socket Unix : une requête coûte un
+aller-retour sur le socket au lieu du lancement d'un interpréteur, de
+l'import des modules et de la lecture de la configuration. Ce client
+n'importe donc que le strict nécessaire.
+
+Le protocole est ligne à ligne, une réponse par requête, dans l'ordre :
+- en texte, le calcul et ses valeurs d'entrée séparés par des espaces (taux
+  en pourcentage), par exemple « pate 920 60 100 30 ». La réponse donne les
+  poids calculés séparés par des espaces, ou « erreur : message » ;
+- en JSON, un enregistrement comme ceux de lot.py, par exemple
+  {"calcul": "p", "ptp": 920, "thp": 60, "thl": 100, "tlf": 30}. La réponse
+  est un objet JSON, avec un champ "erreur" en cas d'échec.
+
+Exemples : ::
+
+    python client.py pate 920 60 100 30
+    python client.py < requetes.txt        # une requête par ligne
+
+Sans Python, « nc -U » ou « socat » suffisent.
+"""
+
+import argparse
+import os
+import socket
+import sys
+import threading
+
+SOCKET = os.path.join(
+    os.environ.get("XDG_RUNTIME_DIR") or os.environ.get("TMPDIR") or "/tmp",
+    "formules-%d.sock" % os.getuid()
+)
+
+# attente maximale de la fin de l'envoi quand la connexion se termine (s)
+ATTENTE = 5.0
+
+
+def connecter(chemin=SOCKET):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(chemin)
+    return client
+
+
+def interroger(requetes, chemin=SOCKET):
+    """Envoie les requêtes (lignes de texte) sur une seule connexion et
+    génère les réponses, dans l'ordre. Les requêtes sont envoyées par un fil
+    d'exécution séparé : le démon peut répondre pendant l'envoi.
+    """
+    client = connecter(chemin)
+
+    def envoyer():
+        try:
+            with client.makefile("w", encoding="utf-8") as f:
+                for requete in requetes:
+                    requete = requete.strip()
+                    if requete:
+                        f.write(requete + "\n")
+            client.shutdown(socket.SHUT_WR)
+        except OSError:
+            # connexion coupée : les réponses ne sont plus attendues
+            pass
+
+    envoi = threading.Thread(target=envoyer, daemon=True)
+    envoi.start()
+    try:
+        with client.makefile("r", encoding="utf-8") as f:
+            for reponse in f:
+                yield reponse.rstrip("\n")
+    finally:
+        # si les réponses sont abandonnées, l'envoi peut être bloqué sur un
+        # socket plein (ou sur la lecture des requêtes) : la connexion est
+        # coupée avant d'attendre le fil d'envoi, et l'attente est bornée
+        try:
+            client.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        envoi.join(ATTENTE)
+        client.close()
+
+
+def est_erreur(reponse):
+    return reponse.startswith("erreur") or '"erreur"' in reponse
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="client du démon de calcul")
+    parser.add_argument('-s', "--socket", default=SOCKET, help="chemin du socket du démon")
+    parser.add_argument("requete", nargs="*", help="calcul et valeurs (lues sur l'entrée standard si absents)")
+    args = parser.parse_args()
+
+    requetes = [" ".join(args.requete)] if args.requete else sys.stdin
+    erreurs = 0
+    try:
+        for reponse in interroger(requetes, args.socket):
+            print(reponse)
+            erreurs += est_erreur(reponse)
+    except OSError as e:
+        sys.stderr.write("Démon injoignable (%s) : %s\n" % (args.socket, e))
+        sys.exit(2)
+    sys.exit(1 if erreurs else 0)
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+
+# license : GPL 3.0
+# copyright : Franck Barbenoire (franck@barbenoi.re)
+
+"""
+Export des fiches imprimables des commandes : une page double-columns.html
+par commande, comme celle qu'imprime le formulaire, dans un répertoire.
+
+Les commandes sont les enregistrements d'un traitement par lots (voir lot.py)
+identifiés par le champ "commande". Le répertoire contient un manifeste
+(manifeste.json) qui associe à chaque commande son fichier et l'empreinte
+(SHA-256) de ce qui l'a produit : l'enregistrement, les paramètres de calcul
+et les modèles. À l'export suivant, une commande dont l'empreinte n'a pas
+changé et dont le fichier existe n'est ni recalculée ni rendue : le travail
+est proportionnel au nombre de commandes modifiées. Les fiches des commandes
+qui ont disparu de l'entrée sont supprimées.
+
+Les fiches à produire sont réparties, par paquets, entre plusieurs processus.
+
+>>> import io, os, tempfile
+>>> repertoire = tempfile.mkdtemp()
+>>> p = formules.Parametres(0.02)
+>>> texte = ("commande,calcul,ptp,thp,thl,tlf\\n"
+...          "A12,p,920,60,100,30\\n"
+...          "A13,p,1000,65,100,20\\n"
+...          "A14,p,920,60,900,30\\n")
+>>> exporter(lot.lire(io.StringIO(texte)), repertoire, parametres=p)
+Bilan(produites=2, inchangees=0, rejetees=1, supprimees=0)
+>>> sorted(os.listdir(repertoire))
+['A12.html', 'A13.html', 'manifeste.json']
+>>> "442,3" in open(os.path.join(repertoire, "A12.html"), encoding="utf-8").read()
+True
+>>> exporter(lot.lire(io.StringIO(texte)), repertoire, parametres=p)
+Bilan(produites=0, inchangees=2, rejetees=1, supprimees=0)
+>>> texte = texte.replace("A13,p,1000", "A13,p,1200").replace("A12,p,920,60,100,30\\n", "")
+>>> exporter(lot.lire(io.StringIO(texte)), repertoire, parametres=p, travailleurs=2)
+Bilan(produites=1, inchangees=0, rejetees=1, supprimees=1)
+>>> sorted(os.listdir(repertoire))
+['A13.html', 'manifeste.json']
+
+Deux commandes n'écrivent jamais le même fichier :
+
+>>> texte = ("commande,calcul,ptp,thp,thl,tlf\\n"
+...          "A_1,p,920,60,100,30\\n"
+...          "A/1,p,920,60,100,30\\n"
+...          "a_1,p,920,60,100,30\\n")
+>>> rejets = io.StringIO()
+>>> exporter(lot.lire(io.StringIO(texte)), repertoire, rejets, parametres=p)
+Bilan(produites=2, inchangees=0, rejetees=1, supprimees=1)
+>>> sorted(os.listdir(repertoire))
+['A_1-a5b3d27a.html', 'A_1.html', 'manifeste.json']
+>>> print(rejets.getvalue(), end="")
+commande,calcul,ptp,thp,thl,tlf,erreur
+a_1,p,920,60,100,30,même fichier que la commande A_1
+
+Les identifiants numériques (JSONL) sont acceptés, les autres sont rejetés :
+
+>>> texte = ('{"commande": 42, "calcul": "p", "ptp": 920, "thp": 60, "thl": 100, "tlf": 30}\\n'
+...          '{"commande": [1], "calcul": "p", "ptp": 920, "thp": 60, "thl": 100, "tlf": 30}\\n')
+>>> rejets = io.StringIO()
+>>> exporter(lot.lire(io.StringIO(texte), "jsonl"), repertoire, rejets, "jsonl", parametres=p)
+Bilan(produites=1, inchangees=0, rejetees=1, supprimees=2)
+>>> sorted(os.listdir(repertoire))
+['42.html', 'manifeste.json']
+>>> print(rejets.getvalue(), end="")
+{"commande": [1], "calcul": "p", "ptp": 920, "thp": 60, "thl": 100, "tlf": 30, "erreur": "commande incorrecte : [1]"}
+"""
+
+import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import os
+import re
+import sys
+
+import formules
+import lot
+import rendu
+
+MODELE = "double-columns.html"
+MANIFESTE = "manifeste.json"
+VERSION = 1
+
+# longueur maximale du nom d'une commande dans le nom de son fichier
+LONGUEUR = 100
+
+Bilan = namedtuple("Bilan", ["produites", "inchangees", "rejetees", "supprimees"])
+
+
+def nom_fichier(commande):
+    """Nom du fichier de la fiche d'une commande. Si le nom de la commande
+    doit être modifié (caractères remplacés, nom trop long ou vide), une
+    partie de son empreinte est ajoutée : deux commandes différentes n'ont
+    pas le même fichier.
+    >>> nom_fichier("A12")
+    'A12.html'
+    >>> nom_fichier("A_1"), nom_fichier("A/1"), nom_fichier("A 1")
+    ('A_1.html', 'A_1-a5b3d27a.html', 'A_1-937bb40e.html')
+    >>> nom_fichier("...")
+    'commande-ab5df625.html'
+    """
+    nom = re.sub(r"[^\w.-]", "_", commande).lstrip(".")[:LONGUEUR]
+    if nom != commande:
+        suffixe = hashlib.sha256(commande.encode("utf-8")).hexdigest()[:8]
+        nom = "%s-%s" % (nom or "commande", suffixe)
+    return nom + ".html"
+
+
+def empreinte_modeles():
+    """Empreinte des sources des modèles utilisés par les fiches"""
+    h = hashlib.sha256()
+    for nom in sorted(os.listdir(rendu.MODELES)):
+        if nom.endswith(".html"):
+            with open(os.path.join(rendu.MODELES, nom), "rb") as f:
+                h.update(nom.encode("utf-8") + b"\0" + f.read())
+    return h.hexdigest()
+
+
+def empreinte(enregistrement, contexte):
+    """Empreinte d'une commande : enregistrement, paramètres et modèles
+    (contexte)
+    """
+    texte = json.dumps(enregistrement, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256((contexte + "\0" + texte).encode("utf-8")).hexdigest()
+
+
+def lire_manifeste(repertoire):
+    try:
+        with open(os.path.join(repertoire, MANIFESTE), encoding="utf-8") as f:
+            manifeste = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifeste.get("version") != VERSION:
+        return {}
+    return manifeste.get("commandes", {})
+
+
+def ecrire_fichier(chemin, texte):
+    """Écrit le fichier d'un coup : un fichier n'est jamais à moitié écrit"""
+    temporaire = "%s.%d.tmp" % (chemin, os.getpid())
+    with open(temporaire, "w", encoding="utf-8") as f:
+        f.write(texte)
+    os.replace(temporaire, chemin)
+
+
+def _produire(paquet, repertoire, parametres):
+    """Calcule et écrit les fiches d'un paquet de commandes (dans un
+    processus travailleur). Renvoie, pour chaque commande, l'erreur ou None.
+    """
+    modele = rendu.modele(MODELE)
+    erreurs = []
+    for fichier, enregistrement in paquet:
+        accepte, enregistrement = next(lot.traiter([enregistrement], parametres))
+        if not accepte:
+            erreurs.append(enregistrement[lot.ERREUR])
+            continue
+        ecrire_fichier(os.path.join(repertoire, fichier), modele.render(rendu.fiche(enregistrement)))
+        erreurs.append(None)
+    return erreurs
+
+
+def exporter(enregistrements, repertoire, rejets=None, format="csv", parametres=None,
+             travailleurs=1, taille_paquet=200):
+    """Produit dans repertoire les fiches des commandes nouvelles ou modifiées
+    et renvoie le Bilan. Les commandes rejetées sont écrites dans rejets.
+    """
+    if parametres is None:
+        parametres = formules.parametres_defaut()
+    os.makedirs(repertoire, exist_ok=True)
+    ancien = lire_manifeste(repertoire)
+    contexte = json.dumps([VERSION, list(parametres), empreinte_modeles()])
+    ecrivain = None
+    if rejets is not None:
+        ecrivain = lot.Ecrivain(rejets, format, supplementaires=(lot.ERREUR,))
+
+    def rejeter(enregistrement, erreur):
+        if ecrivain is not None:
+            rejet = dict(enregistrement)
+            rejet[lot.ERREUR] = erreur
+            ecrivain.ecrire(rejet)
+
+    manifeste = {}
+    vues = set()
+    # fichier (en minuscules, pour les systèmes de fichiers qui ne
+    # distinguent pas la casse) -> commande
+    fichiers = {}
+    a_produire = []
+    inchangees = rejetees = 0
+    for enregistrement in enregistrements:
+        commande = enregistrement.get("commande")
+        if isinstance(commande, (int, float)) and not isinstance(commande, bool):
+            # identifiant numérique (JSONL)
+            commande = str(commande)
+        if isinstance(enregistrement, lot.Illisible):
+            rejeter(enregistrement, enregistrement[lot.ERREUR])
+        elif commande is None or commande == "":
+            rejeter(enregistrement, "commande manquante")
+        elif not isinstance(commande, str):
+            rejeter(enregistrement, "commande incorrecte : %s" % json.dumps(commande))
+        elif commande in vues:
+            rejeter(enregistrement, "commande en double : %s" % commande)
+        elif nom_fichier(commande).lower() in fichiers:
+            rejeter(enregistrement, "même fichier que la commande %s" % (
+                fichiers[nom_fichier(commande).lower()]
+            ))
+        else:
+            vues.add(commande)
+            fichier = nom_fichier(commande)
+            fichiers[fichier.lower()] = commande
+            entree = {
+                "fichier": fichier,
+                "empreinte": empreinte(enregistrement, contexte)
+            }
+            if ancien.get(commande) == entree and \
+                    os.path.exists(os.path.join(repertoire, entree["fichier"])):
+                manifeste[commande] = entree
+                inchangees += 1
+            else:
+                a_produire.append((commande, entree, enregistrement))
+            continue
+        rejetees += 1
+
+    paquets = [
+        a_produire[i:i + taille_paquet] for i in range(0, len(a_produire), taille_paquet)
+    ]
+    arguments = [[(e["fichier"], r) for _, e, r in paquet] for paquet in paquets]
+    if travailleurs > 1 and len(paquets) > 1:
+        with ProcessPoolExecutor(travailleurs) as executeur:
+            resultats = list(executeur.map(
+                _produire, arguments, [repertoire] * len(paquets), [parametres] * len(paquets)
+            ))
+    else:
+        resultats = [_produire(a, repertoire, parametres) for a in arguments]
+
+    produites = 0
+    for paquet, erreurs in zip(paquets, resultats):
+        for (commande, entree, enregistrement), erreur in zip(paquet, erreurs):
+            if erreur is None:
+                manifeste[commande] = entree
+                produites += 1
+            else:
+                rejeter(enregistrement, erreur)
+                rejetees += 1
+
+    # fiches des commandes disparues ou désormais rejetées
+    supprimees = 0
+    fichiers = set(e["fichier"] for e in manifeste.values())
+    for commande, entree in ancien.items():
+        if commande not in manifeste and entree["fichier"] not in fichiers:
+            try:
+                os.remove(os.path.join(repertoire, entree["fichier"]))
+                supprimees += 1
+            except OSError:
+                pass
+
+    ecrire_fichier(
+        os.path.join(repertoire, MANIFESTE),
+        json.dumps({"version": VERSION, "commandes": manifeste}, ensure_ascii=False, indent=1)
+    )
+    return Bilan(produites, inchangees, rejetees, supprimees)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="export des fiches des commandes")
+    parser.add_argument('-t', "--test", action="store_true", help="passer les tests")
+    parser.add_argument("entree", nargs='?', default='-', help="fichier des commandes")
+    parser.add_argument('-o', "--sortie", default="fiches", metavar="REPERTOIRE", help="répertoire des fiches")
+    parser.add_argument('-f', "--format", choices=lot.FORMATS, default="csv", help="format des commandes")
+    parser.add_argument('-r', "--rejets", metavar="FICHIER", help="fichier des commandes rejetées")
+    parser.add_argument('-w', "--workers", type=int, default=os.cpu_count() or 1, metavar="N", help="nombre de processus")
+    args = parser.parse_args()
+
+    if args.test:
+        import doctest
+        doctest.testmod()
+        sys.exit(0)
+
+    formules.lire_taux_sel()
+    fe = sys.stdin if args.entree == "-" else open(args.entree, encoding="utf-8", newline="")
+    fr = sys.stderr if args.rejets is None else open(args.rejets, "w", encoding="utf-8", newline="")
+    try:
+        bilan = exporter(
+            lot.lire(fe, args.format), args.sortie, fr, args.format,
+            travailleurs=args.workers
+        )
+    finally:
+        for f, std in ((fe, sys.stdin), (fr, sys.stderr)):
+            if f is not std:
+                f.close()
+    sys.stderr.write(
+        "%d fiches produites, %d inchangées, %d commandes rejetées, %d fiches supprimées\n" % bilan
+    )
@@ -3,96 +3,115 @@
 # license : GPL 3.0
 # copyright : Franck Barbenoire (franck@barbenoi.re)
 
-from jinja2 import Environment, FileSystemLoader
+import time
+
+# instant du lancement, pris avant les importations (wx, jinja2, modèles) :
+# le temps jusqu'au premier affichage comprend leur coût
+DEBUT = time.perf_counter()
+
+import argparse
 import os
-from tempfile import NamedTemporaryFile
-from textwrap import wrap
-import webbrowser
+import sys
+import threading
 import wx
-from wx.adv import AboutDialogInfo, AboutBox
 from wx.lib.pubsub import pub
 
 import formules
+import modeles
 
 wx.EmptyImage = wx.Image  # EmptyImage has been removed in phoenix
 
+# délai (ms) entre la dernière frappe dans un champ et le nouveau calcul
+DELAI_MISE_A_JOUR = 150
+
+# fonctions de calcul utilisées par les onglets : le module formules, un
+# cache ou un graphe de recalcul partiel qui proposent les mêmes fonctions
+calculs = formules
+
 
 class InputField:
+    """Champ de saisie d'une entrée du modèle"""
 
-    def __init__(self, parent, label, value, process, min_max=None):
-        self.static_text = wx.StaticText(parent, -1, label),
-        self.text_ctrl = wx.TextCtrl(parent, -1, str(value))
+    def __init__(self, parent, entree, process):
+        self.static_text = wx.StaticText(parent, -1, entree.get_label()),
+        self.text_ctrl = wx.TextCtrl(parent, -1, entree.text)
         self.text_ctrl.Bind(wx.EVT_TEXT, self.check_value)
-        self.label = label
+        self.entree = entree
         self.process = process
-        self.min_max = min_max
-        self.value = float(value)
         self.error = False
+        self.timer = None
 
     def get_widgets(self):
         return self.static_text, self.text_ctrl
 
     def check_value(self, ctrl):
-        try:
-            value = float(self.text_ctrl.GetValue())
-            if value <= 0:
-                raise ValueError("Negative or null value")
-            if self.min_max and not self.min_max[0] <= value <= self.min_max[1]:
-                raise ValueError("Out of range")
-            self.value = value
-        except:
-            self.error = True
-            self.text_ctrl.SetBackgroundColour("CORAL")
-            pub.sendMessage("change_statusbar", msg=self.label + " incorrect")
+        # les frappes rapprochées ne déclenchent qu'une seule vérification
+        if self.timer is None:
+            self.timer = wx.CallLater(DELAI_MISE_A_JOUR, self.validate)
         else:
-            if self.error:
-                self.text_ctrl.SetBackgroundColour("WHITE")
-                pub.sendMessage("change_statusbar", msg="")
-                self.error = False
-
-        if not self.error:
+            self.timer.Start(DELAI_MISE_A_JOUR)
+
+    def validate(self):
+        changed = self.entree.set_text(self.text_ctrl.GetValue())
+        if self.show_error():
+            pub.sendMessage(
+                "change_statusbar",
+                msg=self.entree.get_label() + " incorrect" if self.error else ""
+            )
+        if changed:
             self.process()
 
-    def get_label(self):
-        return self.label
+    def show_error(self):
+        """Colore le champ selon la validité de l'entrée. Renvoie vrai si
+        l'état a changé
+        """
+        if self.entree.error == self.error:
+            return False
+        self.error = self.entree.error
+        self.text_ctrl.SetBackgroundColour("CORAL" if self.error else "WHITE")
+        return True
 
-    def get_value(self):
-        return self.value if not self.error else -1
+    def refresh(self):
+        """Affiche la valeur de l'entrée, modifiée hors du champ"""
+        # pas d'évènement EVT_TEXT : l'entrée est déjà vérifiée
+        if self.timer is not None:
+            self.timer.Stop()
+        self.text_ctrl.ChangeValue(self.entree.text)
+        self.show_error()
 
 
 class OutputField:
+    """Affichage d'une sortie du modèle"""
 
-    def __init__(self, parent, label):
-        self.static_text_label = wx.StaticText(parent, -1, label)
+    def __init__(self, parent, sortie):
+        self.static_text_label = wx.StaticText(parent, -1, sortie.get_label())
         self.static_text_value = wx.StaticText(parent, -1)
-        self.label = label
-        self.value = -1
+        self.sortie = sortie
+        self.text = ""
 
     def get_widgets(self):
         return self.static_text_label, self.static_text_value
 
-    def set_value(self, value):
-        self.value = value
-        self.static_text_value.SetLabel(str(value))
-
-    def get_label(self):
-        return self.label
-
-    def get_value(self):
-        return self.value
+    def refresh(self):
+        text = str(self.sortie.get_value())
+        if text != self.text:
+            self.text = text
+            self.static_text_value.SetLabel(text)
 
 
 class TabCommon(wx.Panel):
+    """Onglet qui affiche un modèle (voir modeles.py)"""
 
-    def __init__(self, parent):
+    def __init__(self, parent, modele):
         wx.Panel.__init__(self, parent)
+        self.modele = modele
         self.init_ui(parent)
-        self.init_html()
 
     def init_ui(self, parent):
         font = wx.Font(12, wx.DEFAULT, wx.NORMAL, wx.BOLD)
 
-        self.set_fields()
+        self.inputs = [InputField(self, e, self.update) for e in self.modele.inputs]
+        self.outputs = [OutputField(self, s) for s in self.modele.outputs]
 
         # entrées
         label_entrees = wx.StaticText(self, -1, "Données")
@@ -134,178 +153,177 @@ class TabCommon(wx.Panel):
 
         self.SetSizerAndFit(sizer_top)
 
+        self.modele.last_values = None
         self.update()
 
-    def init_html(self):
-        path = os.path.dirname(os.path.abspath(__file__))
-        self.env = Environment(
-            autoescape=True,
-            loader=FileSystemLoader(os.path.join(path, 'templates'))
-        )
-
-    def to_html(self, title):
-        context = {
-            "title": title,
-            "fields": {
-                "inputs": self.inputs,
-                "outputs": self.outputs
-            }
-        }
-        return(self.env.get_template("double-columns.html").render(context))
-
-
-class TabPoidsPateImpose(TabCommon):
-
-    def __init__(self, parent):
-        self.result = False
-        super(TabPoidsPateImpose, self).__init__(parent)
-
-    def set_fields(self):
-        self.poids_pate = InputField(self, "Poids de la pâte", 1000, self.update)
-        self.th_pate = InputField(self, "Taux d'hydratation de la pâte", 60, self.update, min_max=(1, 100))
-        self.th_levain = InputField(self, "Taux d'hydratation du levain", 100, self.update, min_max=(1, 100))
-        self.taux_levain_farine = InputField(self, "Taux levain farine", 30, self.update, min_max=(1, 100))
-        self.inputs = [
-            self.poids_pate, self.th_pate, self.th_levain, self.taux_levain_farine
-        ]
-
-        self.poids_farine = OutputField(self, "Poids de la farine")
-        self.poids_eau = OutputField(self, "Poids de l'eau")
-        self.poids_levain = OutputField(self, "Poids de levain")
-        self.poids_sel = OutputField(self, "Poids du sel")
-        self.outputs = [
-            self.poids_farine, self.poids_eau, self.poids_levain, self.poids_sel
-        ]
-
     def update(self):
-        ptp = self.poids_pate.get_value()
-        thp = self.th_pate.get_value()
-        thl = self.th_levain.get_value()
-        tlf = self.taux_levain_farine.get_value()
-
-        if ptp != -1 and thp != -1 and thl != -1 and tlf != -1:
-            pf, pe, pl, ps = formules.calcul_pate_imposee(
-                ptp, thp / 100.0, thl / 100.0, tlf / 100.0
-            )
-            if pf > 0 and pe > 0:
-                self.poids_farine.set_value(pf)
-                self.poids_eau.set_value(pe)
-                self.poids_levain.set_value(pl)
-                self.poids_sel.set_value(ps)
-
-                self.result = True
-                pub.sendMessage("change_statusbar", msg="")
-            else:
-                self.poids_farine.set_value("")
-                self.poids_eau.set_value("")
-                self.poids_levain.set_value("")
-                self.poids_sel.set_value("")
-
-                self.result = False
-                pub.sendMessage("change_statusbar", msg="Données d'entrée incorrectes")
-
-
-class TabPoidsLevainImpose(TabCommon):
+        if self.modele.update():
+            for out in self.outputs:
+                out.refresh()
+            pub.sendMessage("change_statusbar", msg=self.modele.message)
+
+    def load_recipe(self, recette):
+        """Reprend les valeurs d'une recette du catalogue"""
+        self.modele.load_recipe(recette)
+        for inp in self.inputs:
+            inp.refresh()
+        self.update()
 
-    def __init__(self, parent):
-        self.result = False
-        super(TabPoidsLevainImpose, self).__init__(parent)
 
-    def set_fields(self):
-        self.poids_levain = InputField(self, "Poids du levain", 150, self.update)
-        self.th_pate = InputField(self, "Taux d'hydratation de la pâte", 60, self.update, min_max=(1, 100))
-        self.th_levain = InputField(self, "Taux d'hydratation du levain", 100, self.update, min_max=(1, 100))
-        self.taux_levain_farine = InputField(self, "Taux levain farine", 30, self.update, min_max=(1, 100))
-        self.inputs = [
-            self.poids_levain, self.th_pate, self.th_levain, self.taux_levain_farine
-        ]
+class PlanList(wx.ListCtrl):
+    """Liste virtuelle : aucune ligne n'est créée, les cellules visibles sont
+    demandées au modèle au moment de l'affichage
+    """
 
-        self.poids_farine = OutputField(self, "Poids de la farine")
-        self.poids_eau = OutputField(self, "Poids de l'eau")
-        self.poids_pate = OutputField(self, "Poids de la pâte")
-        self.poids_sel = OutputField(self, "Poids du sel")
-        self.outputs = [
-            self.poids_farine, self.poids_eau, self.poids_pate, self.poids_sel
-        ]
+    def __init__(self, parent, plan):
+        wx.ListCtrl.__init__(
+            self, parent,
+            style=wx.LC_REPORT | wx.LC_VIRTUAL | wx.LC_HRULES | wx.LC_VRULES
+        )
+        self.plan = plan
 
-    def update(self):
-        pl = self.poids_levain.get_value()
-        thp = self.th_pate.get_value()
-        thl = self.th_levain.get_value()
-        tlf = self.taux_levain_farine.get_value()
-
-        if pl != -1 and thp != -1 and thl != -1 and tlf != -1:
-            pf, pe, ptp, ps = formules.calcul_levain_impose(
-                pl, thp / 100.0, thl / 100.0, tlf / 100.0
-            )
-            if pf > 0 and pe > 0:
-                self.poids_farine.set_value(pf)
-                self.poids_eau.set_value(pe)
-                self.poids_pate.set_value(ptp)
-                self.poids_sel.set_value(ps)
-
-                self.result = True
-                pub.sendMessage("change_statusbar", msg="")
-            else:
-                self.poids_farine.set_value("")
-                self.poids_eau.set_value("")
-                self.poids_pate.set_value("")
-                self.poids_sel.set_value("")
+    def OnGetItemText(self, item, col):
+        return self.plan.texte(item, col)
 
-                self.result = False
-                pub.sendMessage("change_statusbar", msg="Données d'entrée incorrectes")
+    def refresh(self, columns=False):
+        if columns:
+            self.ClearAll()
+            for i, nom in enumerate(self.plan.colonnes):
+                format = wx.LIST_FORMAT_RIGHT if nom in self.plan.POIDS else wx.LIST_FORMAT_LEFT
+                self.InsertColumn(i, nom, format)
+        self.SetItemCount(len(self.plan))
+        self.Refresh()
 
 
-class TabEquivalence(TabCommon):
+class TabPlan(wx.Panel):
+    """Onglet « Plan de production » : commandes d'un fichier, calculées et
+    triées dans un fil d'exécution séparé, affichées dans une liste virtuelle
+    """
 
-    def __init__(self, parent):
-        self.result = False
-        super(TabEquivalence, self).__init__(parent)
+    def __init__(self, parent, modele):
+        wx.Panel.__init__(self, parent)
+        self.modele = modele
+        self.worker = None
+        self.stop = threading.Event()
+        # tri courant : (colonne, croissant)
+        self.sort = None
+
+        self.button = wx.Button(self, -1, "Charger des commandes...")
+        self.button.Bind(wx.EVT_BUTTON, self.on_load)
+        self.state = wx.StaticText(self, -1, "")
+        self.list = PlanList(self, modele)
+        self.list.Bind(wx.EVT_LIST_COL_CLICK, self.on_sort)
+        self.totals = wx.StaticText(self, -1, "")
+        self.Bind(wx.EVT_WINDOW_DESTROY, lambda evt: self.stop.set())
 
-    def set_fields(self):
-        self.poids_total_farine = InputField(self, "Poids de la farine", 500, self.update)
-        self.poids_total_eau = InputField(self, "Poids de l'eau", 300, self.update)
-        self.th_levain = InputField(self, "Taux d'hydratation du levain", 70, self.update, min_max=(1, 100))
-        self.taux_levain_farine = InputField(self, "Taux levain farine", 40, self.update, min_max=(1, 100))
-        self.inputs = [
-            self.poids_total_farine, self.poids_total_eau,
-            self.th_levain, self.taux_levain_farine
-        ]
+        sizer_top = wx.BoxSizer(wx.HORIZONTAL)
+        sizer_top.Add(self.button, 0, wx.ALL, 5)
+        sizer_top.Add(self.state, 1, wx.ALL | wx.ALIGN_CENTER_VERTICAL, 5)
+        sizer = wx.BoxSizer(wx.VERTICAL)
+        sizer.Add(sizer_top, 0, wx.EXPAND)
+        sizer.Add(self.list, 1, wx.EXPAND | wx.LEFT | wx.RIGHT, 5)
+        sizer.Add(self.totals, 0, wx.EXPAND | wx.ALL, 5)
+        self.SetSizer(sizer)
+
+    def busy(self):
+        return self.worker is not None and self.worker.is_alive()
+
+    def in_background(self, fonction, fin):
+        """Exécute fonction() dans un fil d'exécution, puis fin(résultat)
+        dans celui de l'interface
+        """
+        def run():
+            try:
+                resultat = fonction()
+            except (OSError, ValueError) as e:
+                wx.CallAfter(self.on_error, e)
+            else:
+                wx.CallAfter(fin, resultat)
 
-        self.poids_farine = OutputField(self, "Poids de la farine")
-        self.poids_eau = OutputField(self, "Poids de l'eau")
-        self.poids_levain = OutputField(self, "Poids de levain")
-        self.poids_sel = OutputField(self, "Poids du sel")
-        self.outputs = [
-            self.poids_farine, self.poids_eau, self.poids_levain, self.poids_sel
-        ]
+        self.button.Disable()
+        self.worker = threading.Thread(target=run, daemon=True)
+        self.worker.start()
 
-    def update(self):
-        ptf = self.poids_total_farine.get_value()
-        pte = self.poids_total_eau.get_value()
-        thl = self.th_levain.get_value()
-        tlf = self.taux_levain_farine.get_value()
-
-        if ptf != -1 and pte != -1 and thl != -1 and tlf != -1:
-            pf, pe, pl, ps = formules.calcul_equivalence(
-                ptf, pte, thl / 100.0, tlf / 100.0
-            )
-            if pf > 0 and pe > 0:
-                self.poids_farine.set_value(pf)
-                self.poids_eau.set_value(pe)
-                self.poids_levain.set_value(pl)
-                self.poids_sel.set_value(ps)
-
-                self.result = True
-                pub.sendMessage("change_statusbar", msg="")
-            else:
-                self.poids_farine.set_value("")
-                self.poids_eau.set_value("")
-                self.poids_levain.set_value("")
-                self.poids_sel.set_value("")
+    def on_load(self, evt):
+        dialog = wx.FileDialog(
+            self, "Charger des commandes",
+            wildcard="CSV (*.csv)|*.csv|JSON Lines (*.jsonl)|*.jsonl",
+            style=wx.FD_OPEN | wx.FD_FILE_MUST_EXIST
+        )
+        if dialog.ShowModal() != wx.ID_OK:
+            dialog.Destroy()
+            return
+        chemin = dialog.GetPath()
+        dialog.Destroy()
+        format = "jsonl" if chemin.endswith(".jsonl") else "csv"
+
+        def progress(n):
+            if not self.stop.is_set():
+                wx.CallAfter(self.state.SetLabel, "%d commandes calculées..." % n)
+
+        def load():
+            with open(chemin, encoding="utf-8", newline="") as f:
+                # les données affichées ne sont remplacées que dans on_loaded
+                return self.modele.lire(f, format, progression=progress, arret=self.stop)
+
+        self.state.SetLabel("Chargement de %s..." % os.path.basename(chemin))
+        self.in_background(load, self.on_loaded)
+
+    def on_loaded(self, donnees):
+        if not self or donnees is None:
+            return
+        self.button.Enable()
+        compteurs = self.modele.installer(donnees)
+        self.sort = None
+        self.list.refresh(columns=True)
+        self.state.SetLabel("%d commandes acceptées, %d rejetées" % compteurs)
+        self.totals.SetLabel("Totaux : " + ", ".join(
+            "%s %s" % (c, self.modele.totaux[c])
+            for c in self.modele.colonnes if c in self.modele.totaux
+        ))
+        self.Layout()
+
+    def on_sort(self, evt):
+        colonne = evt.GetColumn()
+        if colonne < 0 or self.busy():
+            return
+        croissant = self.sort != (colonne, True)
+        self.sort = (colonne, croissant)
+        self.in_background(lambda: self.modele.trier(colonne, croissant), self.on_sorted)
+
+    def on_sorted(self, resultat):
+        if not self:
+            return
+        self.button.Enable()
+        if hasattr(self.list, "ShowSortIndicator"):
+            self.list.ShowSortIndicator(*self.sort)
+        self.list.Refresh()
+
+    def on_error(self, erreur):
+        if not self:
+            return
+        self.button.Enable()
+        self.state.SetLabel("")
+        pub.sendMessage("change_statusbar", msg="Erreur : %s" % erreur)
+
+
+class LazyPage(wx.Panel):
+    """Page du classeur : l'onglet n'est construit qu'à sa première sélection"""
+
+    def __init__(self, parent, modele, tab_class=TabCommon):
+        wx.Panel.__init__(self, parent)
+        self.modele = modele
+        self.tab_class = tab_class
+        self.tab = None
 
-                self.result = False
-                pub.sendMessage("change_statusbar", msg="Données d'entrée incorrectes")
+    def build(self):
+        if self.tab is None:
+            self.tab = self.tab_class(self, self.modele)
+            sizer = wx.BoxSizer()
+            sizer.Add(self.tab, 1, wx.EXPAND)
+            self.SetSizer(sizer)
+            self.Layout()
+        return self.tab
 
 
 class Frame(wx.Frame):
@@ -316,13 +334,22 @@ class Frame(wx.Frame):
         panel = wx.Panel(self)
 
         self.notebook = wx.Notebook(panel)
-        tab1 = TabPoidsPateImpose(self.notebook)
-        self.notebook.AddPage(tab1, "Poids de la pâte imposé")
-        tab2 = TabPoidsLevainImpose(self.notebook)
-        self.notebook.AddPage(tab2, "Poids du levain imposé")
-        tab3 = TabEquivalence(self.notebook)
-        self.notebook.AddPage(tab3, "Équivalence")
-        self.tabs = [tab1, tab2, tab3]
+        # serveur d'aperçu, démarré à la première impression
+        self.apercu = None
+        self.pages = []
+        for classe in modeles.MODELES:
+            modele = classe(calculs)
+            page = LazyPage(self.notebook, modele)
+            self.notebook.AddPage(page, modele.titre)
+            self.pages.append(page)
+        # calculs de formules.py : le cache ou le graphe des onglets ne sont
+        # pas partagés avec le fil d'exécution du plan
+        plan = modeles.PlanProduction()
+        page = LazyPage(self.notebook, plan, TabPlan)
+        self.notebook.AddPage(page, plan.titre)
+        self.pages.append(page)
+        self.pages[0].build()
+        self.notebook.Bind(wx.EVT_NOTEBOOK_PAGE_CHANGED, self.on_page_changed)
 
         sizer = wx.BoxSizer()
         sizer.Add(self.notebook, 1, wx.EXPAND)
@@ -339,6 +366,8 @@ class Frame(wx.Frame):
         menubar = wx.MenuBar()
 
         fileMenu = wx.Menu()
+        fileMenu.Append(wx.ID_OPEN, "Charger une recette\tCtrl+O")
+        self.Bind(wx.EVT_MENU, self.on_load_recipe, id=wx.ID_OPEN)
         fileMenu.Append(wx.ID_PRINT, "Imprimer\tCtrl+I")
         self.Bind(wx.EVT_MENU, self.on_print, id=wx.ID_PRINT)
         fileMenu.Append(wx.ID_EXIT, "Quitter\tCtrl+Q")
@@ -354,21 +383,67 @@ class Frame(wx.Frame):
         ])
         self.SetMenuBar(menubar)
 
+    def on_page_changed(self, evt):
+        self.pages[evt.GetSelection()].build()
+        evt.Skip()
+
     def on_print(self, evt):
         idx = self.notebook.GetSelection()
-        if idx != wx.NOT_FOUND:
-            page = self.tabs[idx]
-            if page.result:
+        if idx != wx.NOT_FOUND and isinstance(self.pages[idx].modele, modeles.ModeleCommun):
+            modele = self.pages[idx].modele
+            modele.update()
+            if modele.result:
                 title = self.notebook.GetPageText(idx)
-                self.display(page.to_html(title))
+                # les sorties ne dépendent que du calcul, des entrées et des
+                # paramètres
+                cle = (modele.calcul, title, modele.last_values, modele.parametres)
+                self.display(cle, lambda: modele.to_html(title))
+
+    def on_load_recipe(self, evt):
+        idx = self.notebook.GetSelection()
+        if idx == wx.NOT_FOUND or not isinstance(self.pages[idx].modele, modeles.ModeleCommun):
+            return
+        # chemin relatif au répertoire du fichier de configuration
+        chemin = os.path.join(
+            os.path.dirname(formules.CONFIG),
+            formules.lire_option("formulaires", "catalogue", "recettes.sqlite")
+        )
+        if not os.path.exists(chemin):
+            self.change_statusbar("Catalogue de recettes introuvable : " + chemin)
+            return
+        from catalogue import Catalogue
 
-    def display(self, html):
-        with NamedTemporaryFile(delete=False, encoding="utf-8", mode="w") as f:
-            f.write(html)
-            url = "file://" + f.name
-        webbrowser.open(url, new=2)
+        catalogue = Catalogue(chemin)
+        try:
+            recettes = catalogue.recettes()
+        finally:
+            catalogue.fermer()
+        if not recettes:
+            self.change_statusbar("Catalogue de recettes vide")
+            return
+
+        choices = [
+            "%s (%s)" % (r.nom, r.categorie) if r.categorie else r.nom
+            for r in recettes
+        ]
+        dialog = wx.SingleChoiceDialog(self, "Recette", "Charger une recette", choices)
+        if dialog.ShowModal() == wx.ID_OK:
+            self.pages[idx].build().load_recipe(recettes[dialog.GetSelection()])
+        dialog.Destroy()
+
+    def display(self, cle, rendre):
+        """Affiche dans le navigateur la page rendue par rendre(), servie par
+        l'aperçu local qui la garde en cache sous la clé cle
+        """
+        if self.apercu is None:
+            from apercu import Apercu
+            self.apercu = Apercu()
+        self.apercu.afficher(cle, rendre)
 
     def on_show_about(self, evt):
+        from textwrap import wrap
+        from wx.adv import AboutDialogInfo, AboutBox
+
         info = AboutDialogInfo()
         info.SetDescription(
             '\n'.join(
@@ -388,17 +463,57 @@ class Frame(wx.Frame):
         AboutBox(info)
 
     def change_statusbar(self, msg):
-        self.statusbar.SetStatusText(msg)
+        if msg != self.statusbar.GetStatusText():
+            self.statusbar.SetStatusText(msg)
 
 
 class TestApp(wx.App):
+    def __init__(self, startup_time=False):
+        self.startup_time = startup_time
+        wx.App.__init__(self)
+
     def OnInit(self):
         frame = Frame()
         frame.Show()
         frame.Layout()
+        if self.startup_time:
+            # appelé quand la boucle d'évènements a traité le premier affichage
+            wx.CallAfter(self.report_startup_time)
         return True
 
+    def report_startup_time(self):
+        sys.stderr.write(
+            "Premier affichage : %.0f ms\n" % ((time.perf_counter() - DEBUT) * 1000)
+        )
+
 
 if __name__ == "__main__":
-    app = TestApp()
+    parser = argparse.ArgumentParser(description="formulaires de boulangerie")
+    parser.add_argument("--demarrage", action="store_true", help="afficher le temps jusqu'au premier affichage")
+    parser.add_argument("--stats", action="store_true", help="afficher à la fin les mesures des calculs et de l'affichage")
+    parser.add_argument("--stats-fichier", metavar="FICHIER", help="écrire régulièrement les mesures au format de Prometheus")
+    args = parser.parse_args()
+
+    if args.stats or args.stats_fichier:
+        import instrumentation
+        instrumentation.activer(sys.modules[__name__])
+        instrumentation.exporter_a_la_sortie(args.stats, args.stats_fichier)
+        if args.stats_fichier:
+            instrumentation.exporter_periodiquement(args.stats_fichier)
+
+    formules.lire_taux_sel()
+    try:
+        taille_cache = formules.lire_option("formulaires", "cache", 0, int)
+        incremental = formules.lire_option("formulaires", "incremental", 0, int)
+    except formules.ErreurConfiguration as e:
+        sys.stderr.write("%s\n" % e)
+        sys.exit(1)
+    if taille_cache > 0:
+        from cache import Cache
+        calculs = Cache(taille_cache)
+    elif incremental:
+        # seuls les nœuds qui dépendent du champ modifié sont recalculés
+        from graphe import Incremental
+        calculs = Incremental()
+    app = TestApp(args.demarrage)
     app.MainLoop()
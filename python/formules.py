@@ -18,63 +18,124 @@ départ :
 """
 
 import argparse
+from collections import namedtuple
 import configparser
 import os
 import sys
 
-# début des formules
+# paramètres des calculs : taux de sel et nombre de décimales des arrondis.
+# Un objet Parametres est immuable, il peut être passé à chaque calcul (ou à
+# chaque lot) et partagé sans précaution entre plusieurs fils d'exécution.
+Parametres = namedtuple("Parametres", ["taux_sel", "precision"])
+Parametres.__new__.__defaults__ = (0.02, 1)
+
+# paramètres par défaut, utilisés quand un calcul n'en reçoit pas : taux_sel
+# est lu dans le fichier de configuration à la première utilisation
+taux_sel = None
+precision = 1
+_defaut = None
+
+# fichier de configuration
+CONFIG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.ini")
+
+
+class ErreurConfiguration(Exception):
+    pass
+
 
-taux_sel = 0.02
+def lire_parametres(chemin=None):
+    """Lit les paramètres dans le fichier de configuration (config.ini à côté
+    de ce module par défaut), sans modifier les paramètres par défaut.
+    """
+    if chemin is None:
+        chemin = CONFIG
+    module = os.path.splitext(os.path.basename(__file__))[0]
+    config = configparser.ConfigParser()
+    try:
+        if not config.read(chemin, encoding="utf-8"):
+            raise ErreurConfiguration("Fichier de configuration non trouvé")
+        section = config[module]
+        return Parametres(
+            float(section.get("taux_sel", 0.02)),
+            int(section.get("precision", 1))
+        )
+    except (configparser.Error, KeyError, ValueError):
+        raise ErreurConfiguration("Erreur dans le fichier de configuration")
+
+
+def parametres_defaut():
+    """Renvoie les paramètres par défaut, formés des variables globales"""
+    global taux_sel, precision, _defaut
+    if taux_sel is None:
+        taux_sel, precision = lire_parametres()
+    if _defaut != (taux_sel, precision):
+        _defaut = Parametres(taux_sel, precision)
+    return _defaut
+
+# début des formules
 
 
-def calcul_eau_farine_sel(thp, thl, tlf, pfl):
+def calcul_eau_farine_sel(thp, thl, tlf, pfl, parametres=None):
     """Calcule le poids de l'eau et le poids de la farine en fonction :
         - du taux d'hydratation de la pâte
         - du taux d'hydratation du levain
         - du taux de levain par rapport à la farine
         - du poids de la farine contenue dans le levain
     """
-    global taux_sel
+    if parametres is None:
+        parametres = parametres_defaut()
     pf = pfl / tlf
     pe = ((1 / tlf + 1) * thp - thl) * pfl
-    ps = (pf + pfl) * taux_sel
+    ps = (pf + pfl) * parametres.taux_sel
     return pf, pe, ps
 
 
-def calcul_pate_imposee(ptp, thp, thl, tlf):
+def calcul_pate_imposee(ptp, thp, thl, tlf, parametres=None):
     """Calcule les poids de la farine, de l'eau et du levain
     >>> calcul_pate_imposee(920, 0.6, 1.0, 0.3)
     (442.3, 212.3, 265.4, 11.5)
+    >>> calcul_pate_imposee(920, 0.6, 1.0, 0.3, Parametres(taux_sel=0.02, precision=0))
+    (442.0, 212.0, 265.0, 12.0)
     """
+    if parametres is None:
+        parametres = parametres_defaut()
     pfl = (ptp * tlf) / (1 + tlf) / (1 + thp)
-    pf, pe, ps = calcul_eau_farine_sel(thp, thl, tlf, pfl)
+    pf, pe, ps = calcul_eau_farine_sel(thp, thl, tlf, pfl, parametres)
     pl = (1 + thl) * pfl
-    return round(pf, 1), round(pe, 1), round(pl, 1), round(ps, 1)
+    n = parametres.precision
+    return round(pf, n), round(pe, n), round(pl, n), round(ps, n)
 
 
-def calcul_levain_impose(pl, thp, thl, tlf):
+def calcul_levain_impose(pl, thp, thl, tlf, parametres=None):
     """Calcule les poids de la farine, de l'eau et de la pâte
     >>> calcul_levain_impose(200, 0.6, 1.0, 0.25)
     (400.0, 200.0, 800.0, 10.0)
+    >>> calcul_levain_impose(200, 0.6, 1.0, 0.25, Parametres(taux_sel=0.018))
+    (400.0, 200.0, 800.0, 9.0)
     """
+    if parametres is None:
+        parametres = parametres_defaut()
     pfl = pl / (1 + thl)
-    pf, pe, ps = calcul_eau_farine_sel(thp, thl, tlf, pfl)
+    pf, pe, ps = calcul_eau_farine_sel(thp, thl, tlf, pfl, parametres)
     ptp = pl + pf + pe
-    return round(pf, 1), round(pe, 1), round(ptp, 1), round(ps, 1)
+    n = parametres.precision
+    return round(pf, n), round(pe, n), round(ptp, n), round(ps, n)
 
 
-def calcul_equivalence(ptf, pte, thl, tlf):
+def calcul_equivalence(ptf, pte, thl, tlf, parametres=None):
     """Calcule les poids de la farine, de l'eau et du levain
     >>> calcul_equivalence(500, 300, 0.7, 0.4)
     (429.3, 199.0, 171.7, 10.0)
     """
-    global taux_sel
+    if parametres is None:
+        parametres = parametres_defaut()
     pf = ptf / (1 + tlf / (1 + 1 / thl))
     pe = pte - ptf * tlf / (1 + (1 + tlf) * thl)
     pl = pf * tlf
 
-    ps = ptf * taux_sel
-    return round(pf, 1), round(pe, 1), round(pl, 1), round(ps, 1)
+    ps = ptf * parametres.taux_sel
+    n = parametres.precision
+    return round(pf, n), round(pe, n), round(pl, n), round(ps, n)
 
 # fin des formules
 
@@ -200,23 +261,42 @@ def main():
 
 
 def lire_taux_sel():
-    global taux_sel
-    config = configparser.ConfigParser()
-    path = os.path.dirname(os.path.abspath(__file__))
-    module = os.path.splitext(os.path.basename(__file__))[0]
+    """Charge les paramètres par défaut, ou termine le programme en cas
+    d'erreur de configuration.
+    """
     try:
-        config.read(os.path.join(path, "config.ini"))
-        if "formules" in config:
-            taux_sel = float(config[module].get("taux_sel", 0.02))
-        else:
-            sys.stderr.write("Erreur dans le fichier de configuration\n")
-            sys.exit(1)
-    except:
-        sys.stderr.write("Fichier de configuration non trouvé\n")
+        parametres_defaut()
+    except ErreurConfiguration as e:
+        sys.stderr.write("%s\n" % e)
         sys.exit(1)
 
 
-lire_taux_sel()
+def lire_option(section, option, defaut, conversion=str, chemin=None):
+    """Lit une option du fichier de configuration (CONFIG par défaut) et la
+    convertit. Renvoie defaut si le fichier, la section ou l'option manque.
+    >>> import tempfile
+    >>> repertoire = tempfile.TemporaryDirectory()
+    >>> chemin = os.path.join(repertoire.name, "config.ini")
+    >>> with open(chemin, "w", encoding="utf-8") as f:
+    ...     _ = f.write("[formulaires]\\ncache = 32\\ncatalogue = x\\n")
+    >>> lire_option("formulaires", "cache", 0, int, chemin), lire_option("formulaires", "absente", 0, int, chemin)
+    (32, 0)
+    >>> lire_option("formulaires", "catalogue", 0, int, chemin)  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ...
+    formules.ErreurConfiguration: Erreur dans le fichier de configuration : formulaires.catalogue
+    >>> repertoire.cleanup()
+    """
+    config = configparser.ConfigParser()
+    try:
+        config.read(CONFIG if chemin is None else chemin, encoding="utf-8")
+        valeur = config.get(section, option, fallback=None)
+        return defaut if valeur is None else conversion(valeur)
+    except (configparser.Error, ValueError):
+        raise ErreurConfiguration(
+            "Erreur dans le fichier de configuration : %s.%s" % (section, option)
+        )
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="calculs sur le pain au levain")
@@ -225,11 +305,92 @@ if __name__ == "__main__":
     parser.add_argument('-l', "--levain", action="store_true", help="poids du levain imposé")
     parser.add_argument('-e', "--equivalence", action="store_true", help="équivalence")
     parser.add_argument('-i', "--iteratif", action="store_true", help="iteratif")
+    parser.add_argument(
+        '-P', "--plan", metavar="FICHIER",
+        help="planification des rafraîchis de levain (fichier JSON, voir planification.py)"
+    )
+    parser.add_argument(
+        '-b', "--lot", nargs='?', const='-', metavar="FICHIER",
+        help="traitement par lots du fichier (entrée standard par défaut)"
+    )
+    parser.add_argument(
+        '-f', "--format", choices=("csv", "jsonl"), default="csv",
+        help="format des enregistrements du traitement par lots"
+    )
+    parser.add_argument(
+        '-r', "--rejets", metavar="FICHIER",
+        help="fichier des enregistrements rejetés (sortie d'erreur par défaut)"
+    )
+    parser.add_argument(
+        '-w', "--workers", type=int, default=1, metavar="N",
+        help="nombre de processus du traitement par lots"
+    )
+    parser.add_argument(
+        '-c', "--colonnes", metavar="FICHIER",
+        help="écrire les résultats du traitement par lots dans un fichier binaire en colonnes (voir resultats.py)"
+    )
+    parser.add_argument(
+        "--incremental", action="store_true",
+        help="traitement par lots : ne recalculer que ce qui dépend des valeurs qui changent d'un enregistrement au suivant (voir graphe.py)"
+    )
+    parser.add_argument(
+        "--stats", action="store_true",
+        help="afficher à la fin les mesures des calculs (appels, durées, infaisables)"
+    )
+    parser.add_argument(
+        "--stats-fichier", metavar="FICHIER",
+        help="écrire à la fin les mesures des calculs au format de Prometheus"
+    )
     args = parser.parse_args()
+    if args.colonnes:
+        # le fichier en colonnes garde aussi les enregistrements rejetés, avec
+        # leur état ; le calcul est vectorisé, dans un seul processus
+        if not args.lot:
+            parser.error("l'option -c/--colonnes demande l'option -b/--lot")
+        if args.rejets:
+            parser.error("les options -c/--colonnes et -r/--rejets sont incompatibles")
+        if args.workers != 1:
+            parser.error("les options -c/--colonnes et -w/--workers sont incompatibles")
+        if args.incremental:
+            parser.error("les options -c/--colonnes et --incremental sont incompatibles")
+
+    if (args.stats or args.stats_fichier) and args.lot and args.workers != 1:
+        # les processus travailleurs ne renvoient pas leurs mesures
+        parser.error("les options --stats/--stats-fichier et -w/--workers sont incompatibles")
+
+    lire_taux_sel()
+
+    if args.stats or args.stats_fichier:
+        import instrumentation
+        # ce script est le module __main__ ; lot.py utilise le module formules
+        instrumentation.activer(sys.modules[__name__], "formules", "lot")
+        instrumentation.exporter_a_la_sortie(args.stats, args.stats_fichier)
 
     if args.test:
         import doctest
         doctest.testmod()
+    elif args.plan:
+        import planification
+        try:
+            with open(args.plan, encoding="utf-8") as f:
+                produits, etapes = planification.lire_plan(f)
+            planification.afficher(planification.planifier(produits, etapes))
+        except planification.ErreurPlan as e:
+            sys.stderr.write("%s\n" % e)
+            sys.exit(1)
+    elif args.lot and args.colonnes:
+        import lot
+        import resultats
+        fe = sys.stdin if args.lot == "-" else open(args.lot, encoding="utf-8", newline="")
+        with fe:
+            resultats.calculer(lot.lire(fe, args.format)).ecrire(args.colonnes)
+    elif args.lot:
+        import lot
+        calculs = None
+        if args.incremental:
+            import graphe
+            calculs = graphe.Incremental()
+        lot.lot(args.lot, args.format, args.rejets, args.workers, calculs=calculs)
     elif args.levain:
         levain_impose()
     elif args.pate:
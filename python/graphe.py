@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+
+# license : GPL 3.0
+# copyright : Franck Barbenoire (franck@barbenoi.re)
+
+"""
+Graphe des formules de formules.py, pour des recalculs partiels.
+
+Chaque formule est décrite par ses nœuds : un nom, une fonction et les noms
+des nœuds (ou des entrées) dont elle dépend. Les sous-expressions communes
+(poids de la farine du levain, (1 / tlf + 1) * thp...) sont des nœuds
+distincts. Une Evaluation mémorise la valeur de chaque nœud : quand une
+entrée change, seuls les nœuds qui en dépendent sont recalculés, et la
+propagation s'arrête aux nœuds dont la valeur n'a pas changé.
+
+Les calculs sont les mêmes, dans le même ordre, que ceux de formules.py : les
+résultats sont identiques. Les entrées peuvent aussi être des tableaux NumPy
+(l'arrondi est alors celui de vectoriel.py).
+
+Un objet Incremental propose les mêmes fonctions calcul_* que formules.py,
+comme le Cache de cache.py, et peut donc le remplacer dans les onglets du
+formulaire (modeles.py, option incremental de config.ini) ou dans le
+traitement par lots (formules.py --incremental). Pour un calcul isolé sur
+des scalaires, la tenue du graphe coûte plus cher que les opérations qu'elle
+évite : ces deux usages sont donc désactivés par défaut. Le graphe gagne
+quand une partie seulement des entrées change et que les nœuds sont
+coûteux : tableaux de valeurs, balayages d'un taux, recherches par
+dichotomie (inverse.py).
+
+>>> import numpy as np
+>>> p = formules.Parametres(taux_sel=0.02, precision=1)
+>>> evaluation = Evaluation(GRAPHES["calcul_pate_imposee"])
+>>> evaluation.fixer_tout((np.array([920.0, 1840.0]), 0.6, 1.0, 0.3), p)
+>>> [v.tolist() for v in evaluation.sorties()]
+[[442.3, 884.6], [212.3, 424.6], [265.4, 530.8], [11.5, 23.0]]
+>>> evaluation.calculs = 0
+>>> evaluation.fixer("thl", 0.8)  # seul thl change
+>>> [v.tolist() for v in evaluation.sorties()]
+[[442.3, 884.6], [238.8, 477.7], [238.8, 477.7], [11.5, 23.0]]
+>>> evaluation.calculs  # coef_eau, pf, ps et leurs arrondis ne sont pas recalculés
+4
+
+Balayage d'un taux, les autres entrées restant fixes :
+
+>>> for thl, resultat in balayer("calcul_levain_impose", (200, 0.6, 1.0, 0.25), "thl", (0.5, 1.0), p):
+...     print(thl, resultat)
+0.5 (533.3, 333.3, 1066.7, 13.3)
+1.0 (400.0, 200.0, 800.0, 10.0)
+"""
+
+import formules
+
+
+class Graphe:
+    """Nœuds d'une formule : entrees est la liste des noms des entrées,
+    noeuds la liste, dans l'ordre du calcul, des triplets (nom, fonction,
+    dépendances), sorties la liste des noms des nœuds renvoyés
+    >>> Graphe("g", ("a",), [("b", abs, ("c",))], ("b",))  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ...
+    ValueError: g : dépendance inconnue du nœud b : c
+    """
+
+    def __init__(self, nom, entrees, noeuds, sorties):
+        self.nom = nom
+        self.entrees = tuple(entrees)
+        self.noeuds = [(n, fonction, tuple(deps)) for n, fonction, deps in noeuds]
+        self.sorties = tuple(sorties)
+
+        # nœuds qui dépendent directement de chaque entrée ou nœud, et nœuds
+        # nécessaires au calcul de chaque nœud (lui compris)
+        self.dependants = {n: set() for n in self.entrees}
+        self.ancetres = {n: set((n,)) for n in self.entrees}
+        for n, fonction, deps in self.noeuds:
+            ancetres = set((n,))
+            for d in deps:
+                if d not in self.dependants:
+                    raise ValueError("%s : dépendance inconnue du nœud %s : %s" % (nom, n, d))
+                self.dependants[d].add(n)
+                ancetres |= self.ancetres[d]
+            self.dependants[n] = set()
+            self.ancetres[n] = ancetres
+        for n in self.sorties:
+            if n not in self.dependants:
+                raise ValueError("%s : sortie inconnue : %s" % (nom, n))
+
+    def __reduce__(self):
+        # les fonctions des nœuds ne se sérialisent pas : le graphe est
+        # retrouvé par son nom
+        return (_graphe, (self.nom,))
+
+
+def _graphe(nom):
+    return GRAPHES[nom]
+
+
+def _arrondi(x, n):
+    if isinstance(x, (int, float)):
+        return round(x, n)
+    import vectoriel
+    return vectoriel.arrondi(x, n)
+
+
+def _egal(a, b):
+    """Vrai si la valeur d'un nœud n'a certainement pas changé"""
+    return a is b or (
+        isinstance(a, (int, float)) and isinstance(b, (int, float)) and a == b
+    )
+
+
+_ABSENT = object()
+
+
+class Evaluation:
+    """Valeurs des nœuds d'un graphe, recalculées à la demande"""
+
+    def __init__(self, graphe):
+        self.graphe = graphe
+        self.valeurs = {}
+        self.sales = set(n for n, fonction, deps in graphe.noeuds)
+        # nombre de nœuds calculés
+        self.calculs = 0
+
+    def fixer(self, nom, valeur):
+        """Donne une valeur à l'entrée nom"""
+        if _egal(valeur, self.valeurs.get(nom, _ABSENT)):
+            return
+        if nom not in self.graphe.entrees:
+            raise KeyError("%s : entrée inconnue : %s" % (self.graphe.nom, nom))
+        self.valeurs[nom] = valeur
+        self.sales.update(self.graphe.dependants[nom])
+
+    def fixer_tout(self, valeurs, parametres=None):
+        """Donne leurs valeurs aux entrées du calcul, dans l'ordre des
+        arguments de la fonction de formules.py, et aux paramètres
+        """
+        if parametres is None:
+            parametres = formules.parametres_defaut()
+        for entree, valeur in zip(self.graphe.entrees, tuple(valeurs) + tuple(parametres)):
+            self.fixer(entree, valeur)
+
+    def calculer(self, noms=None):
+        """Recalcule les nœuds dont une dépendance a changé, seulement ceux
+        nécessaires aux nœuds noms s'ils sont donnés
+        """
+        if not self.sales:
+            return
+        valeurs = self.valeurs
+        sales = self.sales
+        utiles = None
+        if noms is not None:
+            utiles = set().union(*(self.graphe.ancetres[n] for n in noms))
+        for nom, fonction, deps in self.graphe.noeuds:
+            if nom not in sales or (utiles is not None and nom not in utiles):
+                continue
+            try:
+                valeur = fonction(*[valeurs[d] for d in deps])
+            except KeyError as e:
+                raise ValueError("%s : entrée manquante : %s" % (self.graphe.nom, e.args[0]))
+            self.calculs += 1
+            sales.discard(nom)
+            if not _egal(valeur, valeurs.get(nom, _ABSENT)):
+                valeurs[nom] = valeur
+                sales.update(self.graphe.dependants[nom])
+
+    def valeur(self, nom):
+        """Valeur du nœud nom, seuls les nœuds nécessaires sont calculés"""
+        self.calculer((nom,))
+        return self.valeurs[nom]
+
+    def sorties(self):
+        self.calculer()
+        return tuple(self.valeurs[n] for n in self.graphe.sorties)
+
+
+# nœuds communs de formules.calcul_eau_farine_sel, à partir du poids de la
+# farine du levain (pfl)
+EAU_FARINE_SEL = [
+    ("pf_exact", lambda pfl, tlf: pfl / tlf, ("pfl", "tlf")),
+    ("coef_eau", lambda tlf, thp: (1 / tlf + 1) * thp, ("tlf", "thp")),
+    ("pe_exact", lambda coef_eau, thl, pfl: (coef_eau - thl) * pfl, ("coef_eau", "thl", "pfl")),
+    ("ps_exact", lambda pf, pfl, taux_sel: (pf + pfl) * taux_sel, ("pf_exact", "pfl", "taux_sel")),
+]
+
+PARAMETRES = ("taux_sel", "precision")
+
+
+def _arrondis(*noms):
+    """Nœuds des poids arrondis renvoyés par les calculs"""
+    return [(n, _arrondi, (n + "_exact", "precision")) for n in noms]
+
+
+GRAPHES = {}
+for _g in (
+    Graphe(
+        "calcul_pate_imposee", ("ptp", "thp", "thl", "tlf") + PARAMETRES,
+        [
+            ("pfl", lambda ptp, tlf, thp: (ptp * tlf) / (1 + tlf) / (1 + thp), ("ptp", "tlf", "thp")),
+        ] + EAU_FARINE_SEL + [
+            ("pl_exact", lambda thl, pfl: (1 + thl) * pfl, ("thl", "pfl")),
+        ] + _arrondis("pf", "pe", "pl", "ps"),
+        ("pf", "pe", "pl", "ps")
+    ),
+    Graphe(
+        "calcul_levain_impose", ("pl", "thp", "thl", "tlf") + PARAMETRES,
+        [
+            ("pfl", lambda pl, thl: pl / (1 + thl), ("pl", "thl")),
+        ] + EAU_FARINE_SEL + [
+            ("ptp_exact", lambda pl, pf, pe: pl + pf + pe, ("pl", "pf_exact", "pe_exact")),
+        ] + _arrondis("pf", "pe", "ptp", "ps"),
+        ("pf", "pe", "ptp", "ps")
+    ),
+    Graphe(
+        "calcul_equivalence", ("ptf", "pte", "thl", "tlf") + PARAMETRES,
+        [
+            ("pf_exact", lambda ptf, tlf, thl: ptf / (1 + tlf / (1 + 1 / thl)), ("ptf", "tlf", "thl")),
+            ("eau_levain", lambda ptf, tlf, thl: ptf * tlf / (1 + (1 + tlf) * thl), ("ptf", "tlf", "thl")),
+            ("pe_exact", lambda pte, eau_levain: pte - eau_levain, ("pte", "eau_levain")),
+            ("pl_exact", lambda pf, tlf: pf * tlf, ("pf_exact", "tlf")),
+            ("ps_exact", lambda ptf, taux_sel: ptf * taux_sel, ("ptf", "taux_sel")),
+        ] + _arrondis("pf", "pe", "pl", "ps"),
+        ("pf", "pe", "pl", "ps")
+    ),
+):
+    GRAPHES[_g.nom] = _g
+del _g
+
+
+class Incremental:
+    """Fonctions calcul_* de formules.py, recalculées partiellement d'un appel
+    au suivant. Les résultats sont ceux de formules.py.
+    >>> import random
+    >>> calculs, p = Incremental(), formules.Parametres(0.018, 1)
+    >>> tirages = [(random.uniform(100, 2000), random.choice((0.6, 0.7)),
+    ...             random.uniform(0.5, 1), random.choice((0.2, 0.3))) for i in range(1000)]
+    >>> all(getattr(calculs, n)(*t, parametres=p) == getattr(formules, n)(*t, parametres=p)
+    ...     for t in tirages for n in GRAPHES)
+    True
+    >>> evaluation = calculs.evaluations["calcul_pate_imposee"]
+    >>> _ = calculs.calcul_pate_imposee(920, 0.6, 1.0, 0.3, p)
+    >>> evaluation.calculs = 0
+    >>> calculs.calcul_pate_imposee(920, 0.6, 0.8, 0.3, p), evaluation.calculs  # seul thl change
+    ((442.3, 238.8, 238.8, 10.3), 4)
+    """
+
+    def __init__(self):
+        self.evaluations = {nom: Evaluation(g) for nom, g in GRAPHES.items()}
+
+    def calculer(self, nom, valeurs, parametres=None):
+        evaluation = self.evaluations[nom]
+        evaluation.fixer_tout(valeurs, parametres)
+        return evaluation.sorties()
+
+    def calcul_pate_imposee(self, ptp, thp, thl, tlf, parametres=None):
+        return self.calculer("calcul_pate_imposee", (ptp, thp, thl, tlf), parametres)
+
+    def calcul_levain_impose(self, pl, thp, thl, tlf, parametres=None):
+        return self.calculer("calcul_levain_impose", (pl, thp, thl, tlf), parametres)
+
+    def calcul_equivalence(self, ptf, pte, thl, tlf, parametres=None):
+        return self.calculer("calcul_equivalence", (ptf, pte, thl, tlf), parametres)
+
+
+def balayer(nom, valeurs, variable, serie, parametres=None):
+    """Génère les couples (valeur, résultat) du calcul nom quand l'entrée
+    variable prend successivement les valeurs de serie, les autres entrées
+    gardant les valeurs données. Seuls les nœuds qui dépendent de la
+    variable sont recalculés. Les résultats sont ceux de formules.py :
+    >>> import random
+    >>> p = formules.Parametres(0.018, 1)
+    >>> valeurs = (random.uniform(100, 2000), random.choice((0.6, 0.7)),
+    ...            random.uniform(0.5, 1), random.choice((0.2, 0.3)))
+    >>> serie = [random.uniform(0.5, 1) for i in range(1000)]
+    >>> all(r == getattr(formules, n)(*(valeurs[:2] + (thl,) + valeurs[3:]), parametres=p)
+    ...     for n in GRAPHES for thl, r in balayer(n, valeurs, "thl", serie, p))
+    True
+    """
+    evaluation = Evaluation(GRAPHES[nom])
+    evaluation.fixer_tout(valeurs, parametres)
+    for valeur in serie:
+        evaluation.fixer(variable, valeur)
+        yield valeur, evaluation.sorties()
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+# license : GPL 3.0
+# copyright : Franck Barbenoire (franck@barbenoi.re)
+
+"""
+Instrumentation, à la demande, des calculs et de l'affichage.
+
+activer() remplace les fonctions de calcul de formules.py, les mises à jour
+et le rendu HTML des onglets (modeles.py, formulaires.py) et l'affichage
+(Frame.display) par des versions qui comptent les appels, classent leur
+durée dans un histogramme et comptent les résultats infaisables (pe < 0).
+Tant que l'instrumentation n'est pas activée, rien n'est remplacé : elle ne
+coûte rien.
+
+Les mesures s'affichent sous forme de résumé ou s'exportent au format texte
+de Prometheus, dans un fichier que la supervision locale peut relever (par
+exemple avec le collecteur « textfile » de node_exporter).
+
+Les calculs des processus travailleurs ne sont pas mesurés : formules.py
+refuse les mesures avec un traitement par lots réparti sur plusieurs
+processus. Les recalculs de l'évaluation incrémentale (graphe.Evaluation)
+sont mesurés comme les méthodes des onglets.
+
+>>> import formules
+>>> p = formules.Parametres(taux_sel=0.02)
+>>> stats = activer()
+>>> formules.calcul_pate_imposee(920, 0.6, 1.0, 0.3, p)
+(442.3, 212.3, 265.4, 11.5)
+>>> r = formules.calcul_pate_imposee(920, 0.6, 4.0, 0.3, p)
+>>> mesure = stats.mesures["calcul_pate_imposee"]
+>>> mesure.appels, mesure.infaisables, sum(mesure.histogramme)
+(2, 1, 2)
+>>> stats.mesures["calcul_eau_farine_sel"].appels
+2
+>>> texte = prometheus(stats)
+>>> print(texte.splitlines()[0])
+# HELP formules_duree_secondes Durée des appels
+>>> for ligne in texte.splitlines():
+...     if "pate_imposee" in ligne and ("Inf" in ligne or "infaisables" in ligne):
+...         print(ligne)
+formules_duree_secondes_bucket{fonction="calcul_pate_imposee",le="+Inf"} 2
+formules_infaisables_total{fonction="calcul_pate_imposee"} 1
+>>> import graphe
+>>> stats = activer("graphe")
+>>> e = graphe.Evaluation(graphe.GRAPHES["calcul_pate_imposee"])
+>>> e.fixer_tout((920, 0.6, 1.0, 0.3), p)
+>>> e.sorties()
+(442.3, 212.3, 265.4, 11.5)
+>>> stats.mesures["Evaluation.calculer"].appels
+1
+>>> desactiver()
+>>> formules.calcul_pate_imposee.__name__, hasattr(formules.calcul_pate_imposee, "__wrapped__")
+('calcul_pate_imposee', False)
+"""
+
+import atexit
+from bisect import bisect_left
+import functools
+import importlib
+import os
+import sys
+import threading
+import time
+
+# bornes supérieures des classes de l'histogramme des durées (secondes)
+BORNES = (
+    1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+    1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, float("inf")
+)
+
+# fonctions de calcul : le deuxième poids renvoyé est celui de l'eau
+FONCTIONS = (
+    "calcul_eau_farine_sel", "calcul_pate_imposee",
+    "calcul_levain_impose", "calcul_equivalence"
+)
+
+# méthodes mesurées : (classe, méthode)
+METHODES = (
+    ("ModeleCommun", "update"), ("ModeleCommun", "to_html"),
+    ("TabCommon", "update"), ("Frame", "display"),
+    ("Evaluation", "calculer"),
+)
+
+MODULES = ("formules", "modeles", "formulaires", "graphe")
+
+PREFIXE = "formules"
+
+
+class Mesure:
+
+    def __init__(self):
+        self.appels = 0
+        self.duree = 0.0
+        self.infaisables = 0
+        self.histogramme = [0] * len(BORNES)
+
+    def ajouter(self, duree):
+        self.appels += 1
+        self.duree += duree
+        self.histogramme[bisect_left(BORNES, duree)] += 1
+
+    def quantile(self, q):
+        """Borne supérieure de la classe qui contient le quantile q"""
+        rang = q * self.appels
+        cumul = 0
+        for borne, n in zip(BORNES, self.histogramme):
+            cumul += n
+            if cumul >= rang:
+                return borne
+        return BORNES[-1]
+
+
+class Statistiques:
+
+    def __init__(self):
+        self.mesures = {}
+
+    def mesure(self, nom):
+        try:
+            return self.mesures[nom]
+        except KeyError:
+            return self.mesures.setdefault(nom, Mesure())
+
+
+statistiques = Statistiques()
+
+# remplacements effectués : (objet, attribut, valeur d'origine)
+_remplacements = []
+
+
+def instrumenter(fonction, mesure, infaisable=False):
+    """Renvoie la fonction qui mesure les appels de fonction dans mesure"""
+    horloge = time.perf_counter
+
+    @functools.wraps(fonction)
+    def mesuree(*args, **kwargs):
+        debut = horloge()
+        try:
+            resultat = fonction(*args, **kwargs)
+        finally:
+            mesure.ajouter(horloge() - debut)
+        if infaisable and resultat[1] < 0:
+            mesure.infaisables += 1
+        return resultat
+
+    return mesuree
+
+
+def _remplacer(objet, attribut, nom, stats, infaisable=False):
+    fonction = objet.__dict__.get(attribut) if isinstance(objet, type) else getattr(objet, attribut, None)
+    if fonction is None or hasattr(fonction, "__wrapped__"):
+        return
+    setattr(objet, attribut, instrumenter(fonction, stats.mesure(nom), infaisable))
+    _remplacements.append((objet, attribut, fonction))
+
+
+def activer(*modules, stats=None):
+    """Instrumente les modules formules, modeles et formulaires déjà importés,
+    ainsi que les modules donnés, par nom (ils sont alors importés) ou
+    directement (un script lancé directement est le module __main__).
+    Renvoie les statistiques.
+    """
+    if stats is None:
+        stats = statistiques
+    cibles = [
+        importlib.import_module(m) if isinstance(m, str) else m for m in modules
+    ]
+    cibles.extend(sys.modules[m] for m in MODULES if m in sys.modules)
+    for module in cibles:
+        for nom in FONCTIONS:
+            _remplacer(module, nom, nom, stats, infaisable=True)
+        for classe, methode in METHODES:
+            if hasattr(module, classe):
+                _remplacer(getattr(module, classe), methode, "%s.%s" % (classe, methode), stats)
+
+    # les calculs du traitement par lots sont référencés dans lot.CALCULS
+    lot = sys.modules.get("lot")
+    formules = sys.modules.get("formules")
+    if lot is not None and formules is not None:
+        for nom, (fonction, entrees, sorties) in list(lot.CALCULS.items()):
+            mesuree = getattr(formules, fonction.__name__)
+            if mesuree is not fonction:
+                lot.CALCULS[nom] = (mesuree, entrees, sorties)
+                _remplacements.append((lot.CALCULS, nom, (fonction, entrees, sorties)))
+    return stats
+
+
+def desactiver():
+    """Rétablit les fonctions d'origine"""
+    while _remplacements:
+        objet, attribut, valeur = _remplacements.pop()
+        if isinstance(objet, dict):
+            objet[attribut] = valeur
+        else:
+            setattr(objet, attribut, valeur)
+
+
+def resume(stats=None):
+    """Renvoie le résumé des mesures, une ligne par fonction"""
+    if stats is None:
+        stats = statistiques
+    lignes = ["%-28s %9s %11s %11s %11s %11s" % (
+        "fonction", "appels", "total (ms)", "moy. (µs)", "p99 (µs) <=", "infaisables"
+    )]
+    for nom, mesure in sorted(stats.mesures.items()):
+        if not mesure.appels:
+            continue
+        lignes.append("%-28s %9d %11.3f %11.2f %11s %11d" % (
+            nom, mesure.appels, mesure.duree * 1e3, mesure.duree / mesure.appels * 1e6,
+            "%g" % (mesure.quantile(0.99) * 1e6), mesure.infaisables
+        ))
+    return "\n".join(lignes)
+
+
+def prometheus(stats=None):
+    """Renvoie les mesures au format texte de Prometheus"""
+    if stats is None:
+        stats = statistiques
+    mesures = sorted(stats.mesures.items())
+    lignes = [
+        "# HELP %s_duree_secondes Durée des appels" % PREFIXE,
+        "# TYPE %s_duree_secondes histogram" % PREFIXE,
+    ]
+    for nom, mesure in mesures:
+        cumul = 0
+        for borne, n in zip(BORNES, mesure.histogramme):
+            cumul += n
+            lignes.append('%s_duree_secondes_bucket{fonction="%s",le="%s"} %d' % (
+                PREFIXE, nom, "+Inf" if borne == float("inf") else "%g" % borne, cumul
+            ))
+        lignes.append('%s_duree_secondes_sum{fonction="%s"} %r' % (PREFIXE, nom, mesure.duree))
+        lignes.append('%s_duree_secondes_count{fonction="%s"} %d' % (PREFIXE, nom, mesure.appels))
+    lignes.extend([
+        "# HELP %s_infaisables_total Résultats infaisables (pe < 0)" % PREFIXE,
+        "# TYPE %s_infaisables_total counter" % PREFIXE,
+    ])
+    for nom, mesure in mesures:
+        if nom in FONCTIONS:
+            lignes.append('%s_infaisables_total{fonction="%s"} %d' % (PREFIXE, nom, mesure.infaisables))
+    return "\n".join(lignes)
+
+
+def ecrire_prometheus(chemin, stats=None):
+    """Écrit le fichier des mesures ; le fichier est remplacé d'un coup, il
+    n'est jamais relevé à moitié écrit
+    """
+    temporaire = "%s.%d.tmp" % (chemin, os.getpid())
+    with open(temporaire, "w", encoding="utf-8") as f:
+        f.write(prometheus(stats) + "\n")
+    os.replace(temporaire, chemin)
+
+
+def exporter_a_la_sortie(afficher=True, chemin=None, stats=None):
+    """À la fin du programme, affiche le résumé sur la sortie d'erreur et
+    écrit le fichier des mesures si chemin est donné
+    """
+    def exporter():
+        if afficher:
+            sys.stderr.write(resume(stats) + "\n")
+        if chemin:
+            ecrire_prometheus(chemin, stats)
+
+    atexit.register(exporter)
+
+
+def exporter_periodiquement(chemin, intervalle=15.0, stats=None):
+    """Réécrit le fichier des mesures toutes les intervalle secondes, depuis
+    un fil d'exécution en arrière-plan. Renvoie l'évènement qui l'arrête.
+    """
+    arret = threading.Event()
+
+    def exporter():
+        while not arret.wait(intervalle):
+            ecrire_prometheus(chemin, stats)
+
+    threading.Thread(target=exporter, daemon=True).start()
+    return arret
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
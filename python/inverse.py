@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+
+# license : GPL 3.0
+# copyright : Franck Barbenoire (franck@barbenoi.re)
+
+"""
+Calculs inverses : trouver le taux qui donne un poids voulu.
+
+Les fonctions de formules.py vont des taux aux poids. Ici, un des taux
+d'entrée d'un calcul (thp, thl ou tlf) est l'inconnue, et un des poids
+calculés est imposé (la cible). Par exemple : « j'ai 340 g de levain à 80 %
+et il me faut 1,2 kg de pâte à 68 %, quel taux levain farine choisir ? ».
+
+Les formules étant des fractions rationnelles simples des taux, la plupart
+des inverses s'écrivent directement (EXPLICITES). Les autres sont trouvés par
+dichotomie, sur les nœuds non arrondis du graphe des formules (graphe.py).
+Dans les deux cas, le calcul est vectorisé : les valeurs peuvent être des
+tableaux NumPy de milliers de contraintes.
+
+Un taux n'est retenu que s'il est compris dans BORNES, les limites des champs
+de taux du formulaire (de 1 à 100 %), et si la pâte obtenue est faisable
+(poids de l'eau positif ou nul). Sinon, le taux vaut NaN.
+
+Les taux sont des fractions, comme dans formules.py :
+
+>>> tlf, ok = resoudre("levain", "tlf", "ptp", 1200, pl=340, thl=0.8, thp=0.68)
+>>> round(float(tlf), 4), bool(ok)
+(0.3595, True)
+>>> formules.calcul_levain_impose(340, 0.68, 0.8, float(tlf))[2]
+1200.0
+>>> tlf, ok = resoudre("levain", "tlf", "ptp", [1200, 5000, 600], pl=340, thl=0.8, thp=0.68)
+>>> tlf.round(4).tolist(), ok.tolist()
+([0.3595, 0.0678, nan], [True, True, False])
+"""
+
+import argparse
+import sys
+
+import numpy as np
+
+import formules
+import graphe
+import lot
+
+# limites des taux (min_max=(1, 100) des champs du formulaire), en fractions
+BORNES = (0.01, 1.0)
+
+# itérations de la dichotomie : l'intervalle est alors inférieur à 1e-14
+ITERATIONS = 48
+
+
+def _tlf_levain_ptp(ptp, v):
+    # ptp = pfl (1 + thp) (1 + 1 / tlf), avec pfl = pl / (1 + thl)
+    pfl = v["pl"] / (1 + v["thl"])
+    return 1 / (ptp / (pfl * (1 + v["thp"])) - 1)
+
+
+def _thp_levain_ptp(ptp, v):
+    pfl = v["pl"] / (1 + v["thl"])
+    return ptp / (pfl * (1 + 1 / v["tlf"])) - 1
+
+
+def _thl_levain_ptp(ptp, v):
+    return v["pl"] * (1 + v["thp"]) * (1 + 1 / v["tlf"]) / ptp - 1
+
+
+def _tlf_pate_pl(pl, v):
+    # pl / ((1 + thl) ptp / (1 + thp)) = tlf / (1 + tlf)
+    r = pl * (1 + v["thp"]) / ((1 + v["thl"]) * v["ptp"])
+    return r / (1 - r)
+
+
+def _tlf_pate_pf(pf, v):
+    # pf = ptp / ((1 + tlf) (1 + thp))
+    return v["ptp"] / (pf * (1 + v["thp"])) - 1
+
+
+def _thl_equivalence_pl(pl, v):
+    # pl = ptf tlf / (1 + tlf thl / (1 + thl))
+    s = (v["ptf"] * v["tlf"] / pl - 1) / v["tlf"]
+    return s / (1 - s)
+
+
+# inverses explicites : (calcul, inconnue, cible) : fonction(cible, connues)
+EXPLICITES = {
+    ("levain", "tlf", "ptp"): _tlf_levain_ptp,
+    ("levain", "thp", "ptp"): _thp_levain_ptp,
+    ("levain", "thl", "ptp"): _thl_levain_ptp,
+    ("pate", "tlf", "pl"): _tlf_pate_pl,
+    ("pate", "tlf", "pf"): _tlf_pate_pf,
+    ("equivalence", "thl", "pl"): _thl_equivalence_pl,
+}
+
+
+def dichotomie(evaluation, inconnue, sortie, cible):
+    """Cherche, entre les BORNES, la valeur de l'entrée inconnue pour laquelle
+    le nœud sortie vaut cible (tableaux). La sortie doit être monotone dans
+    cet intervalle. Renvoie NaN là où la cible n'est pas atteinte.
+    """
+    bas = np.full(cible.shape, BORNES[0])
+    haut = np.full(cible.shape, BORNES[1])
+    evaluation.fixer(inconnue, bas)
+    ecart_bas = evaluation.valeur(sortie) - cible
+    evaluation.fixer(inconnue, haut)
+    ecart_haut = evaluation.valeur(sortie) - cible
+    atteinte = ((ecart_bas <= 0) & (ecart_haut >= 0)) | ((ecart_bas >= 0) & (ecart_haut <= 0))
+    croissante = ecart_bas <= 0
+    for i in range(ITERATIONS):
+        milieu = (bas + haut) / 2
+        evaluation.fixer(inconnue, milieu)
+        en_dessous = (evaluation.valeur(sortie) - cible <= 0) == croissante
+        bas = np.where(en_dessous, milieu, bas)
+        haut = np.where(en_dessous, haut, milieu)
+    return np.where(atteinte, (bas + haut) / 2, np.nan)
+
+
+def resoudre(calcul, inconnue, cible, valeur, parametres=None, explicite=True, **connues):
+    """Renvoie le taux inconnue (fraction) du calcul ("pate", "levain",
+    "equivalence" ou leurs abréviations) pour lequel le poids cible vaut
+    valeur, les autres entrées du calcul étant données par connues, et le
+    masque de faisabilité. Les valeurs peuvent être des scalaires ou des
+    tableaux. Avec explicite=False, la dichotomie est toujours utilisée.
+    >>> resoudre("pate", "ptp", "pf", 400, thp=0.6, thl=1.0, tlf=0.3)  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ...
+    lot.ErreurEnregistrement: inconnue incorrecte : ptp
+    >>> args = ("pate", "tlf", "pl", np.array([200.0, 265.4, 600]))
+    >>> a, ok = resoudre(*args, ptp=920, thp=0.6, thl=1.0)
+    >>> b, ok = resoudre(*args, ptp=920, thp=0.6, thl=1.0, explicite=False)
+    >>> a.round(4).tolist(), np.allclose(a, b, equal_nan=True), ok.tolist()
+    ([0.2105, 0.3, nan], True, [True, True, False])
+    >>> t, ok = resoudre("p", "tlf", "pe", 212.3, ptp=920, thp=0.6, thl=1.0)
+    >>> round(float(t), 3)
+    0.3
+    """
+    if parametres is None:
+        parametres = formules.parametres_defaut()
+    nom = lot.ABREVIATIONS.get(calcul, calcul)
+    if nom not in lot.CALCULS:
+        raise lot.ErreurEnregistrement("calcul inconnu : %s" % calcul)
+    fonction, entrees, sorties = lot.CALCULS[nom]
+    if inconnue not in lot.TAUX or inconnue not in entrees:
+        raise lot.ErreurEnregistrement("inconnue incorrecte : %s" % inconnue)
+    if cible not in sorties:
+        raise lot.ErreurEnregistrement("cible incorrecte : %s" % cible)
+    for champ in entrees:
+        if champ != inconnue and champ not in connues:
+            raise lot.ErreurEnregistrement("%s manquant" % champ)
+
+    champs = [c for c in entrees if c != inconnue]
+    valeurs = np.broadcast_arrays(
+        np.asarray(valeur, dtype=np.float64),
+        *(np.asarray(connues[c], dtype=np.float64) for c in champs)
+    )
+    valeur = valeurs[0]
+    connues = dict(zip(champs, valeurs[1:]))
+
+    evaluation = graphe.Evaluation(graphe.GRAPHES[fonction.__name__])
+    for champ, v in connues.items():
+        evaluation.fixer(champ, v)
+    evaluation.fixer("taux_sel", parametres.taux_sel)
+    evaluation.fixer("precision", parametres.precision)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        solution = EXPLICITES.get((nom, inconnue, cible)) if explicite else None
+        if solution is not None:
+            taux = np.asarray(solution(valeur, connues), dtype=np.float64)
+        else:
+            taux = dichotomie(evaluation, inconnue, cible + "_exact", valeur)
+        faisable = (taux >= BORNES[0]) & (taux <= BORNES[1])
+        evaluation.fixer(inconnue, np.where(faisable, taux, BORNES[0]))
+        faisable &= evaluation.valeur("pe_exact") >= 0
+    taux = np.where(faisable, taux, np.nan)
+    if taux.ndim == 0:
+        return taux[()], faisable[()]
+    return taux, faisable
+
+
+def resoudre_lot(enregistrements, parametres=None):
+    """Renvoie la liste des couples (accepté, enregistrement complété), comme
+    lot.traiter. Chaque enregistrement donne le calcul, l'inconnue, les
+    autres entrées du calcul et un seul des poids calculés, la cible (taux en
+    pourcentage). Les enregistrements sont regroupés par problème et chaque
+    groupe est résolu en un seul appel à resoudre().
+    >>> import io
+    >>> entree = io.StringIO(
+    ...     "commande,calcul,inconnue,pl,thl,thp,ptp\\n"
+    ...     "1,levain,tlf,340,80,68,1200\\n"
+    ...     "2,levain,tlf,340,80,68,600\\n"
+    ...     "3,levain,tlf,340,80,68,\\n")
+    >>> for accepte, e in resoudre_lot(lot.lire(entree)):
+    ...     print(accepte, e.get("tlf"), e.get("erreur"))
+    True 36.0 None
+    False None pas de solution entre 1 et 100 %
+    False None une seule cible attendue parmi pf, pe, ptp, ps
+    """
+    if parametres is None:
+        parametres = formules.parametres_defaut()
+    enregistrements = list(enregistrements)
+    resultats = [None] * len(enregistrements)
+    groupes = {}
+    for i, enregistrement in enumerate(enregistrements):
+        try:
+            if isinstance(enregistrement, lot.Illisible):
+                raise lot.ErreurEnregistrement(enregistrement[lot.ERREUR])
+            nom = enregistrement.get("calcul") or ""
+            nom = lot.ABREVIATIONS.get(nom, nom)
+            if nom not in lot.CALCULS:
+                raise lot.ErreurEnregistrement("calcul inconnu : %s" % nom)
+            fonction, entrees, sorties = lot.CALCULS[nom]
+            inconnue = enregistrement.get("inconnue") or ""
+            if inconnue not in lot.TAUX or inconnue not in entrees:
+                raise lot.ErreurEnregistrement("inconnue incorrecte : %s" % inconnue)
+            cibles = [s for s in sorties if enregistrement.get(s) not in (None, "")]
+            if len(cibles) != 1:
+                raise lot.ErreurEnregistrement(
+                    "une seule cible attendue parmi %s" % ", ".join(sorties)
+                )
+            champs = (cibles[0],) + tuple(c for c in entrees if c != inconnue)
+            valeurs = [lot.lire_valeur(enregistrement, c) for c in champs]
+        except lot.ErreurEnregistrement as e:
+            rejet = dict(enregistrement)
+            rejet[lot.ERREUR] = str(e)
+            resultats[i] = (False, rejet)
+            continue
+        groupes.setdefault((nom, inconnue, champs), []).append((i, valeurs))
+
+    for (nom, inconnue, champs), lignes in groupes.items():
+        colonnes = np.array([valeurs for i, valeurs in lignes]).T
+        taux, faisable = resoudre(
+            nom, inconnue, champs[0], colonnes[0], parametres,
+            **dict(zip(champs[1:], colonnes[1:]))
+        )
+        taux = np.round(taux * 100, parametres.precision)
+        for (i, valeurs), t, ok in zip(lignes, taux.tolist(), faisable.tolist()):
+            enregistrement = dict(enregistrements[i])
+            if ok:
+                enregistrement[inconnue] = t
+            else:
+                enregistrement[lot.ERREUR] = "pas de solution entre %g et %g %%" % (
+                    BORNES[0] * 100, BORNES[1] * 100
+                )
+            resultats[i] = (ok, enregistrement)
+    return resultats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="calculs inverses : taux qui donne un poids voulu")
+    parser.add_argument('-t', "--test", action="store_true", help="passer les tests")
+    parser.add_argument("entree", nargs='?', default='-', help="fichier des problèmes (calcul, inconnue, entrées connues et cible)")
+    parser.add_argument('-f', "--format", choices=lot.FORMATS, default="csv", help="format des enregistrements")
+    parser.add_argument('-r', "--rejets", metavar="FICHIER", help="fichier des enregistrements rejetés (sortie d'erreur par défaut)")
+    args = parser.parse_args()
+
+    if args.test:
+        import doctest
+        doctest.testmod()
+        sys.exit(0)
+
+    formules.lire_taux_sel()
+    fe = sys.stdin if args.entree == "-" else open(args.entree, encoding="utf-8", newline="")
+    fr = sys.stderr if args.rejets is None else open(args.rejets, "w", encoding="utf-8", newline="")
+    try:
+        enregistrements = list(lot.lire(fe, args.format))
+        champs = None
+        if args.format == "csv" and enregistrements:
+            champs = list(enregistrements[0])
+            for taux in lot.TAUX:
+                if taux not in champs:
+                    champs.append(taux)
+        ecrivains = {
+            True: lot.Ecrivain(sys.stdout, args.format, champs),
+            False: lot.Ecrivain(fr, args.format, champs, (lot.ERREUR,))
+        }
+        for accepte, enregistrement in resoudre_lot(enregistrements):
+            ecrivains[accepte].ecrire(enregistrement)
+    finally:
+        for f, std in ((fe, sys.stdin), (fr, sys.stderr)):
+            if f is not std:
+                f.close()
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+
+# license : GPL 3.0
+# copyright : Franck Barbenoire (franck@barbenoi.re)
+
+"""
+Traitement par lots, non interactif, des calculs de formules.py.
+
+Les enregistrements sont lus au format CSV ou JSON Lines, un par ligne, et
+traversent une chaîne de générateurs (lecture -> calcul -> écriture) : la
+mémoire utilisée ne dépend pas de la taille de l'entrée.
+
+Chaque enregistrement choisit son calcul avec le champ "calcul" :
+- "pate" (ou "p") : poids de la pâte imposé, champs ptp, thp, thl, tlf ;
+- "levain" (ou "l") : poids du levain imposé, champs pl, thp, thl, tlf ;
+- "equivalence" (ou "e") : équivalence, champs ptf, pte, thl, tlf.
+
+Les taux sont exprimés en pourcentage, comme dans les saisies interactives.
+Les autres champs (numéro de commande...) sont recopiés tels quels dans le
+résultat. Les enregistrements incorrects ou dont les taux d'hydratation sont
+incompatibles sont envoyés dans un flux de rejets, avec un champ "erreur".
+
+>>> import io
+>>> entree = io.StringIO(
+...     "commande,calcul,ptp,pl,thp,thl,tlf\\n"
+...     "1,p,920,,60,100,30\\n"
+...     "2,l,,200,60,400,25\\n")
+>>> sortie, rejets = io.StringIO(), io.StringIO()
+>>> ecrire(traiter(lire(entree)), sortie, rejets)
+(1, 1)
+>>> print(sortie.getvalue(), end="")  # doctest: +ELLIPSIS
+commande,calcul,ptp,pl,thp,thl,tlf,pf,pe,ps
+1,p,920,265.4,60,100,30,442.3,212.3,...
+>>> print(rejets.getvalue(), end="")
+commande,calcul,ptp,pl,thp,thl,tlf,erreur
+2,l,,200,60,400,25,Incompatibilité des taux d'hydratation
+"""
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import io
+from itertools import islice
+import json
+import math
+import sys
+
+import formules
+
+FORMATS = ("csv", "jsonl")
+
+# calcul : (fonction, champs d'entrée, champs de sortie)
+CALCULS = {
+    "pate": (
+        formules.calcul_pate_imposee,
+        ("ptp", "thp", "thl", "tlf"),
+        ("pf", "pe", "pl", "ps")
+    ),
+    "levain": (
+        formules.calcul_levain_impose,
+        ("pl", "thp", "thl", "tlf"),
+        ("pf", "pe", "ptp", "ps")
+    ),
+    "equivalence": (
+        formules.calcul_equivalence,
+        ("ptf", "pte", "thl", "tlf"),
+        ("pf", "pe", "pl", "ps")
+    ),
+}
+ABREVIATIONS = {"p": "pate", "l": "levain", "e": "equivalence"}
+
+TAUX = ("thp", "thl", "tlf")
+
+RESULTATS = ("pf", "pe", "pl", "ptp", "ps")
+ERREUR = "erreur"
+
+
+class ErreurEnregistrement(ValueError):
+    pass
+
+
+class Illisible(dict):
+    """Ligne qui n'a pas pu être lue, rejetée telle quelle."""
+
+
+def lire(flux, format="csv"):
+    """Génère les enregistrements (dictionnaires) lus dans le flux."""
+    if format == "csv":
+        yield from csv.DictReader(flux)
+    elif format == "jsonl":
+        for ligne in flux:
+            if ligne.strip():
+                try:
+                    enregistrement = json.loads(ligne)
+                except ValueError:
+                    enregistrement = None
+                if isinstance(enregistrement, dict):
+                    yield enregistrement
+                else:
+                    yield Illisible(ligne=ligne.rstrip("\r\n"), erreur="ligne illisible")
+    else:
+        raise ValueError("Format inconnu : %s" % format)
+
+
+def lire_valeur(enregistrement, champ):
+    """Valeur du champ, nombre fini et strictement positif ; les taux sont
+    convertis de pourcentages en fractions
+    >>> lire_valeur({"thp": "62,5"}, "thp")
+    0.625
+    >>> lire_valeur({"ptp": "nan"}, "ptp")  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ...
+    lot.ErreurEnregistrement: ptp incorrect
+    >>> lire_valeur({"ptp": "1e400"}, "ptp")  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ...
+    lot.ErreurEnregistrement: ptp incorrect
+    """
+    v = enregistrement.get(champ)
+    if v is None or v == "":
+        raise ErreurEnregistrement("%s manquant" % champ)
+    try:
+        if isinstance(v, str):
+            v = v.replace(",", ".")
+        v = float(v)
+    except (TypeError, ValueError):
+        raise ErreurEnregistrement("%s incorrect" % champ)
+    if not math.isfinite(v) or v <= 0:
+        raise ErreurEnregistrement("%s incorrect" % champ)
+    if champ in TAUX:
+        v /= 100
+    return v
+
+
+def calculer(enregistrement, parametres=None, calculs=None):
+    """Calcule un enregistrement et renvoie les poids obtenus. calculs est
+    un objet qui propose les fonctions calcul_* de formules.py (par exemple
+    le cache de cache.py ou graphe.Incremental), le module formules par
+    défaut.
+    >>> calculer({"calcul": "levain", "pl": "200", "thp": "60", "thl": "100", "tlf": "25"})["ptp"]
+    800.0
+    >>> calculer({"calcul": "x"})  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ...
+    lot.ErreurEnregistrement: calcul inconnu : x
+    """
+    nom = enregistrement.get("calcul") or ""
+    nom = ABREVIATIONS.get(nom, nom)
+    if nom not in CALCULS:
+        raise ErreurEnregistrement("calcul inconnu : %s" % nom)
+    fonction, entrees, sorties = CALCULS[nom]
+    if calculs is not None:
+        fonction = getattr(calculs, fonction.__name__)
+
+    valeurs = [lire_valeur(enregistrement, champ) for champ in entrees]
+    resultat = fonction(*valeurs, parametres=parametres)
+    if resultat[1] < 0:
+        raise ErreurEnregistrement("Incompatibilité des taux d'hydratation")
+    return dict(zip(sorties, resultat))
+
+
+def traiter(enregistrements, parametres=None, calculs=None):
+    """Génère des couples (accepté, enregistrement complété).
+
+    Un enregistrement accepté reçoit les poids calculés, un enregistrement
+    rejeté reçoit le message d'erreur dans le champ "erreur".
+    """
+    for enregistrement in enregistrements:
+        if isinstance(enregistrement, Illisible):
+            yield False, dict(enregistrement)
+            continue
+        try:
+            resultat = calculer(enregistrement, parametres, calculs)
+        except ErreurEnregistrement as e:
+            rejet = dict(enregistrement)
+            rejet[ERREUR] = str(e)
+            yield False, rejet
+        else:
+            accepte = dict(enregistrement)
+            accepte.update(resultat)
+            yield True, accepte
+
+
+class Ecrivain:
+    """Écrit des enregistrements dans un flux, au format CSV ou JSON Lines.
+
+    En CSV, l'entête est formé des champs d'entrée, complétés par les champs
+    supplémentaires qu'ils ne contiennent pas. Sans champs d'entrée, ce sont
+    ceux du premier enregistrement écrit. L'entête est écrit avant le premier
+    enregistrement, sauf si avec_entete est faux.
+    """
+
+    def __init__(self, flux, format="csv", champs=None, supplementaires=(), avec_entete=True):
+        if format not in FORMATS:
+            raise ValueError("Format inconnu : %s" % format)
+        self.flux = flux
+        self.format = format
+        self.champs = champs
+        self.supplementaires = supplementaires
+        self.entete_a_ecrire = avec_entete and format == "csv"
+        self.csv = None
+
+    def preparer(self, enregistrement=None):
+        if self.format != "csv":
+            return
+        if self.csv is None:
+            champs = list(self.champs if self.champs is not None else enregistrement)
+            champs.extend(c for c in self.supplementaires if c not in champs)
+            self.csv = csv.DictWriter(
+                self.flux, champs, restval="",
+                extrasaction="ignore", lineterminator="\n"
+            )
+        if self.entete_a_ecrire:
+            self.csv.writeheader()
+            self.entete_a_ecrire = False
+
+    def ecrire(self, enregistrement):
+        if self.format == "jsonl":
+            self.flux.write(json.dumps(enregistrement, ensure_ascii=False))
+            self.flux.write("\n")
+            return
+        self.preparer(enregistrement)
+        self.csv.writerow(enregistrement)
+
+    def ecrire_texte(self, texte):
+        """Écrit des enregistrements déjà mis en forme par un autre écrivain."""
+        if texte:
+            self.preparer()
+            self.flux.write(texte)
+
+
+def ecrire(resultats, sortie, rejets, format="csv", champs=None, avec_entete=True):
+    """Écrit les résultats de traiter() et renvoie (nb acceptés, nb rejetés)."""
+    ecrivains = {
+        True: Ecrivain(sortie, format, champs, RESULTATS, avec_entete),
+        False: Ecrivain(rejets, format, champs, (ERREUR,), avec_entete)
+    }
+    compteurs = {True: 0, False: 0}
+    for accepte, enregistrement in resultats:
+        ecrivains[accepte].ecrire(enregistrement)
+        compteurs[accepte] += 1
+    return compteurs[True], compteurs[False]
+
+
+def blocs(flux, format="csv", taille_bloc=1000):
+    """Découpe le flux en blocs de taille_bloc enregistrements, sous forme de
+    texte. En CSV, une ligne ne termine un enregistrement que si elle laisse
+    un nombre pair de guillemets, ce qui préserve les champs multilignes.
+    >>> list(blocs(io.StringIO('a,b\\n1,"x\\ny"\\n2,z\\n'), taille_bloc=2))
+    ['a,b\\n1,"x\\ny"\\n', '2,z\\n']
+    """
+    bloc = []
+    n = 0
+    guillemets = 0
+    for ligne in flux:
+        bloc.append(ligne)
+        if format == "csv":
+            guillemets += ligne.count('"')
+            if guillemets % 2:
+                continue
+        n += 1
+        if n == taille_bloc:
+            yield "".join(bloc)
+            bloc = []
+            n = 0
+    if bloc:
+        yield "".join(bloc)
+
+
+def _traiter_bloc(texte, format, champs, parametres, calculs=None):
+    """Lit, calcule et met en forme un bloc dans un processus travailleur."""
+    flux = io.StringIO(texte, newline="")
+    if format == "csv":
+        enregistrements = csv.DictReader(flux, champs)
+    else:
+        enregistrements = lire(flux, format)
+    sortie, rejets = io.StringIO(), io.StringIO()
+    compteurs = ecrire(
+        traiter(enregistrements, parametres, calculs), sortie, rejets, format, champs,
+        avec_entete=False
+    )
+    return sortie.getvalue(), rejets.getvalue(), compteurs
+
+
+def ecrire_parallele(flux, sortie, rejets, format="csv", champs=None,
+                     travailleurs=2, taille_bloc=1000, parametres=None, calculs=None):
+    """Comme ecrire(traiter(lire(flux))), mais les blocs d'enregistrements sont
+    lus, calculés et mis en forme par un ensemble de processus. Les blocs sont
+    écrits dans l'ordre de l'entrée, la sortie est donc identique octet pour
+    octet. Le nombre de blocs en cours est borné : la mémoire reste constante.
+    Les paramètres sont résolus ici et transmis aux travailleurs, qui n'ont
+    donc pas à lire la configuration.
+    >>> texte = "calcul,ptp,thp,thl,tlf\\n" + "".join(
+    ...     "p,%d,60,%d,30\\n" % (p, 100 + p % 300) for p in range(-5, 2000, 7))
+    >>> s1, r1, s2, r2 = (io.StringIO() for i in range(4))
+    >>> ecrire(traiter(lire(io.StringIO(texte))), s1, r1)
+    (161, 126)
+    >>> champs = ["calcul", "ptp", "thp", "thl", "tlf"]
+    >>> f = io.StringIO(texte); _ = f.readline()
+    >>> ecrire_parallele(f, s2, r2, "csv", champs, 3, taille_bloc=10)
+    (161, 126)
+    >>> s1.getvalue() == s2.getvalue() and r1.getvalue() == r2.getvalue()
+    True
+    """
+    ecrivains = {
+        True: Ecrivain(sortie, format, champs, RESULTATS),
+        False: Ecrivain(rejets, format, champs, (ERREUR,))
+    }
+    if parametres is None:
+        parametres = formules.parametres_defaut()
+    acceptes = rejetes = 0
+    textes = blocs(flux, format, taille_bloc)
+    with ProcessPoolExecutor(travailleurs) as executeur:
+        en_cours = deque()
+        while True:
+            for texte in islice(textes, 2 * travailleurs - len(en_cours)):
+                en_cours.append(executeur.submit(
+                    _traiter_bloc, texte, format, champs, parametres, calculs
+                ))
+            if not en_cours:
+                break
+            texte_acceptes, texte_rejets, compteurs = en_cours.popleft().result()
+            ecrivains[True].ecrire_texte(texte_acceptes)
+            ecrivains[False].ecrire_texte(texte_rejets)
+            acceptes += compteurs[0]
+            rejetes += compteurs[1]
+    return acceptes, rejetes
+
+
+def lot(entree="-", format="csv", rejets=None, travailleurs=1, parametres=None,
+        calculs=None):
+    """Traite le fichier entree ("-" pour l'entrée standard), écrit les
+    résultats sur la sortie standard et les rejets dans le fichier rejets
+    (la sortie d'erreur par défaut). Au-delà d'un travailleur, le calcul est
+    réparti sur plusieurs processus ; la sortie est identique.
+    """
+    fe = sys.stdin if entree == "-" else open(entree, encoding="utf-8", newline="")
+    fr = sys.stderr if rejets is None else open(rejets, "w", encoding="utf-8", newline="")
+    try:
+        champs = None
+        if format == "csv":
+            entete = next(blocs(fe, format, 1), None)
+            if entete is None:
+                return 0, 0
+            champs = next(csv.reader(io.StringIO(entete, newline="")))
+        if travailleurs > 1:
+            return ecrire_parallele(
+                fe, sys.stdout, fr, format, champs, travailleurs,
+                parametres=parametres, calculs=calculs
+            )
+        if format == "csv":
+            enregistrements = csv.DictReader(fe, champs)
+        else:
+            enregistrements = lire(fe, format)
+        return ecrire(
+            traiter(enregistrements, parametres, calculs), sys.stdout, fr, format, champs
+        )
+    finally:
+        if fe is not sys.stdin:
+            fe.close()
+        if fr is not sys.stderr:
+            fr.close()
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
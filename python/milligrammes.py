@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+# license : GPL 3.0
+# copyright : Franck Barbenoire (franck@barbenoi.re)
+
+"""
+Calculs en virgule fixe (milligrammes entiers) pour les cumuls.
+
+Les fonctions de formules.py arrondissent chaque poids au dixième de gramme.
+Pour cumuler des milliers de commandes, ces arrondis s'additionnent. Ici,
+les formules de formules.py sont évaluées en nombres rationnels (fractions) :
+les entrées sont prises pour leur valeur décimale (0.6 vaut 6/10), le seul
+arrondi est celui du poids exact au milligramme, puis les cumuls sont des
+sommes d'entiers, donc exactes. L'arrondi au dixième de gramme n'a lieu
+qu'à l'affichage.
+
+>>> p = formules.Parametres(taux_sel=0.02)
+>>> calcul_pate_imposee(920, 0.6, 1.0, 0.3, p)
+(442308, 212308, 265385, 11500)
+>>> total = Totaliseur()
+>>> for i in range(1000):
+...     total.ajouter(calcul_pate_imposee(920, 0.6, 1.0, 0.3, p))
+>>> total.grammes()
+(442308.0, 212308.0, 265385.0, 11500.0)
+>>> [round(1000 * v, 1) for v in formules.calcul_pate_imposee(920, 0.6, 1.0, 0.3, p)]
+[442300.0, 212300.0, 265400.0, 11500.0]
+
+Chaque ligne reste à moins de 0,1 g du calcul de formules.py :
+
+>>> import random
+>>> alea = random.Random(1)
+>>> ecarts = []
+>>> for i in range(10000):
+...     valeurs = (alea.uniform(100, 5000), alea.uniform(0.5, 0.9),
+...                alea.uniform(0.5, 1.2), alea.uniform(0.05, 0.5))
+...     mg = calcul_pate_imposee(*valeurs, parametres=p)
+...     g = formules.calcul_pate_imposee(*valeurs, parametres=p)
+...     ecarts.extend(abs(a / 1000 - b) for a, b in zip(mg, g))
+>>> max(ecarts) <= 0.1
+True
+"""
+
+from fractions import Fraction
+
+import formules
+
+MG = 1000
+
+# les poids sont calculés au milligramme
+PRECISION = 3
+
+
+def exact(valeur):
+    """Valeur décimale exacte d'un nombre
+    >>> exact(0.6), exact(920), exact(1e-05)
+    (Fraction(3, 5), Fraction(920, 1), Fraction(1, 100000))
+    """
+    return Fraction(str(valeur))
+
+
+def en_milligrammes(poids):
+    """Convertit des poids en grammes en milligrammes entiers
+    >>> en_milligrammes((442.308, 0.0005, Fraction(1, 3)))
+    (442308, 0, 333)
+    """
+    return tuple(round(exact(p) * MG) for p in poids)
+
+
+def parametres_mg(parametres):
+    """Renvoie les paramètres, ou ceux par défaut, avec la précision au mg"""
+    if parametres is None:
+        parametres = formules.parametres_defaut()
+    return parametres._replace(precision=PRECISION)
+
+
+def _parametres_exacts(parametres):
+    parametres = parametres_mg(parametres)
+    return parametres._replace(taux_sel=exact(parametres.taux_sel))
+
+
+def calcul_pate_imposee(ptp, thp, thl, tlf, parametres=None):
+    """Comme formules.calcul_pate_imposee, poids en milligrammes entiers"""
+    return en_milligrammes(formules.calcul_pate_imposee(
+        exact(ptp), exact(thp), exact(thl), exact(tlf), _parametres_exacts(parametres)
+    ))
+
+
+def calcul_levain_impose(pl, thp, thl, tlf, parametres=None):
+    """Comme formules.calcul_levain_impose, poids en milligrammes entiers"""
+    return en_milligrammes(formules.calcul_levain_impose(
+        exact(pl), exact(thp), exact(thl), exact(tlf), _parametres_exacts(parametres)
+    ))
+
+
+def calcul_equivalence(ptf, pte, thl, tlf, parametres=None):
+    """Comme formules.calcul_equivalence, poids en milligrammes entiers"""
+    return en_milligrammes(formules.calcul_equivalence(
+        exact(ptf), exact(pte), exact(thl), exact(tlf), _parametres_exacts(parametres)
+    ))
+
+
+def arrondi_affichage(mg, precision=1):
+    """Arrondit des milligrammes en grammes à precision décimales (au plus
+    proche, à égalité vers le chiffre pair), sans passer par un flottant
+    intermédiaire
+    >>> arrondi_affichage(12350), arrondi_affichage(12450), arrondi_affichage(-12351)
+    (12.4, 12.4, -12.4)
+    >>> arrondi_affichage(12345, 3), arrondi_affichage(12345, 5)
+    (12.345, 12.345)
+    """
+    if precision >= PRECISION:
+        # rien à arrondir : un seul quotient d'entiers, arrondi correctement
+        return mg / MG
+    pas = 10 ** (PRECISION - precision)
+    q, r = divmod(mg, pas)
+    if 2 * r > pas or (2 * r == pas and q % 2):
+        q += 1
+    return q / 10 ** precision
+
+
+class Totaliseur:
+    """Cumule des poids en milligrammes"""
+
+    def __init__(self, n=4):
+        self.totaux = [0] * n
+        self.lignes = 0
+
+    def ajouter(self, poids_mg):
+        for i, p in enumerate(poids_mg):
+            self.totaux[i] += p
+        self.lignes += 1
+
+    def ajouter_colonnes(self, colonnes_mg, lignes):
+        """Ajoute des totaux déjà calculés par colonne (voir sommer)"""
+        for i, p in enumerate(colonnes_mg):
+            self.totaux[i] += p
+        self.lignes += lignes
+
+    def grammes(self, precision=1):
+        return tuple(arrondi_affichage(t, precision) for t in self.totaux)
+
+
+def sommer(calcul, *colonnes, parametres=None):
+    """Voie rapide des cumuls : calcule des colonnes entières avec vectoriel.py
+    et renvoie les totaux en milligrammes des lignes faisables, et le nombre de
+    ces lignes.
+
+    calcul est l'une des fonctions de vectoriel.py. Les poids y sont calculés
+    en flottants puis arrondis au milligramme : un poids à égale distance de
+    deux milligrammes peut différer d'un milligramme de la voie exacte.
+
+    >>> import numpy as np, vectoriel
+    >>> p = formules.Parametres(taux_sel=0.02)
+    >>> ptp = np.full(1000, 920.0)
+    >>> sommer(vectoriel.calcul_pate_imposee, ptp, 0.6, 1.0, 0.3, parametres=p)
+    ((442308000, 212308000, 265385000, 11500000), 1000)
+    """
+    import numpy as np
+
+    *poids, faisable = calcul(*colonnes, parametres=parametres_mg(parametres))
+    totaux = tuple(
+        int(np.rint(p[faisable] * MG).astype(np.int64).sum()) for p in poids
+    )
+    return totaux, int(np.count_nonzero(faisable))
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+
+# license : GPL 3.0
+# copyright : Franck Barbenoire (franck@barbenoi.re)
+
+"""
+Modèles des onglets du formulaire, sans wx.
+
+Chaque modèle porte les entrées (valeur saisie, validité), les sorties et le
+calcul d'un onglet ; formulaires.py n'en fait que l'affichage. Les modèles
+s'utilisent donc sans écran, pour les tests et les mesures de performance.
+
+>>> modele = PateImposee()
+>>> modele.parametres = formules.Parametres(taux_sel=0.02)
+>>> modele.update()
+True
+>>> [o.get_value() for o in modele.outputs]
+[480.8, 230.8, 288.5, 12.5]
+>>> modele.update()  # entrées inchangées
+False
+>>> modele.poids_pate.set_text("920")
+True
+>>> modele.update(), modele.poids_farine.get_value(), modele.result
+(True, 442.3, True)
+>>> modele.th_levain.set_text("abc"), modele.th_levain.error
+(False, True)
+>>> modele.update()
+False
+>>> modele.th_levain.set_text("100"), modele.update(), modele.message
+(True, True, '')
+>>> modele.th_pate.set_text("10"), modele.update(), modele.result, modele.message
+(True, True, False, "Données d'entrée incorrectes")
+>>> modele.poids_farine.get_value()
+''
+"""
+
+from collections import namedtuple
+
+import formules
+
+
+class Entree:
+    """Valeur saisie d'un champ. get_value() renvoie -1 si la saisie est
+    incorrecte.
+    """
+
+    def __init__(self, label, value, min_max=None, taux=False):
+        self.label = label
+        self.min_max = min_max
+        # valeur en pourcentage, convertie en fraction pour le calcul
+        self.taux = taux
+        self.value = float(value)
+        self.text = "%g" % value
+        self.error = False
+
+    def set_text(self, text):
+        """Vérifie la saisie. Renvoie vrai si la valeur utilisable a changé"""
+        self.text = text
+        error = self.error
+        try:
+            value = float(text)
+            if value <= 0:
+                raise ValueError("Negative or null value")
+            if self.min_max and not self.min_max[0] <= value <= self.min_max[1]:
+                raise ValueError("Out of range")
+        except ValueError:
+            self.error = True
+            return False
+        self.error = False
+        if value == self.value:
+            return error
+        self.value = value
+        return True
+
+    def set_value(self, value):
+        return self.set_text("%g" % value)
+
+    def get_label(self):
+        return self.label
+
+    def get_value(self):
+        return self.value if not self.error else -1
+
+    def argument(self):
+        """Valeur transmise au calcul"""
+        return self.value / 100.0 if self.taux else self.value
+
+
+class Sortie:
+
+    def __init__(self, label):
+        self.label = label
+        self.value = -1
+
+    def set_value(self, value):
+        self.value = value
+
+    def get_label(self):
+        return self.label
+
+    def get_value(self):
+        return self.value
+
+
+class ModeleCommun:
+    """Entrées, sorties et calcul d'un onglet.
+
+    Les classes dérivées définissent le titre, le nom de la fonction de calcul
+    et, dans set_fields(), les entrées, les sorties et les champs repris d'une
+    recette du catalogue.
+    """
+
+    titre = ""
+    calcul = None
+
+    def __init__(self, calculs=None):
+        # module formules, ou cache (cache.py) ou graphe (graphe.py) qui
+        # proposent les mêmes fonctions
+        self.calculs = formules if calculs is None else calculs
+        self.last_values = None
+        # paramètres de la recette chargée, ceux par défaut sinon
+        self.parametres = None
+        self.result = False
+        self.message = ""
+        self.set_fields()
+
+    def inputs_changed(self):
+        values = tuple(inp.get_value() for inp in self.inputs)
+        if values == self.last_values:
+            return False
+        self.last_values = values
+        return True
+
+    def update(self):
+        """Recalcule les sorties si les entrées ont changé et sont correctes.
+        Renvoie vrai si les sorties (ou le message) ont été mises à jour.
+        """
+        if not self.inputs_changed():
+            return False
+        if any(inp.get_value() == -1 for inp in self.inputs):
+            return False
+
+        resultats = getattr(self.calculs, self.calcul)(
+            *[inp.argument() for inp in self.inputs], parametres=self.parametres
+        )
+        pf, pe = resultats[:2]
+        if pf > 0 and pe > 0:
+            for out, value in zip(self.outputs, resultats):
+                out.set_value(value)
+            self.result = True
+            self.message = ""
+        else:
+            for out in self.outputs:
+                out.set_value("")
+            self.result = False
+            self.message = "Données d'entrée incorrectes"
+        return True
+
+    def load_recipe(self, recette):
+        """Reprend les valeurs d'une recette du catalogue"""
+        if recette.sel is None:
+            self.parametres = None
+        else:
+            self.parametres = formules.parametres_defaut()._replace(taux_sel=recette.sel / 100.0)
+        self.last_values = None
+        for champ, inp in self.recipe_fields.items():
+            value = getattr(recette, champ)
+            if value is not None:
+                inp.set_value(value)
+
+    def to_html(self, title=None):
+        import rendu
+
+        context = {
+            "title": title or self.titre,
+            "fields": {
+                "inputs": self.inputs,
+                "outputs": self.outputs
+            }
+        }
+        return rendu.modele("double-columns.html").render(context)
+
+
+class PateImposee(ModeleCommun):
+
+    titre = "Poids de la pâte imposé"
+    calcul = "calcul_pate_imposee"
+
+    def set_fields(self):
+        self.poids_pate = Entree("Poids de la pâte", 1000)
+        self.th_pate = Entree("Taux d'hydratation de la pâte", 60, min_max=(1, 100), taux=True)
+        self.th_levain = Entree("Taux d'hydratation du levain", 100, min_max=(1, 100), taux=True)
+        self.taux_levain_farine = Entree("Taux levain farine", 30, min_max=(1, 100), taux=True)
+        self.inputs = [
+            self.poids_pate, self.th_pate, self.th_levain, self.taux_levain_farine
+        ]
+        self.recipe_fields = {
+            "ptp": self.poids_pate, "thp": self.th_pate,
+            "thl": self.th_levain, "tlf": self.taux_levain_farine
+        }
+
+        self.poids_farine = Sortie("Poids de la farine")
+        self.poids_eau = Sortie("Poids de l'eau")
+        self.poids_levain = Sortie("Poids de levain")
+        self.poids_sel = Sortie("Poids du sel")
+        self.outputs = [
+            self.poids_farine, self.poids_eau, self.poids_levain, self.poids_sel
+        ]
+
+
+class LevainImpose(ModeleCommun):
+
+    titre = "Poids du levain imposé"
+    calcul = "calcul_levain_impose"
+
+    def set_fields(self):
+        self.poids_levain = Entree("Poids du levain", 150)
+        self.th_pate = Entree("Taux d'hydratation de la pâte", 60, min_max=(1, 100), taux=True)
+        self.th_levain = Entree("Taux d'hydratation du levain", 100, min_max=(1, 100), taux=True)
+        self.taux_levain_farine = Entree("Taux levain farine", 30, min_max=(1, 100), taux=True)
+        self.inputs = [
+            self.poids_levain, self.th_pate, self.th_levain, self.taux_levain_farine
+        ]
+        self.recipe_fields = {
+            "thp": self.th_pate, "thl": self.th_levain, "tlf": self.taux_levain_farine
+        }
+
+        self.poids_farine = Sortie("Poids de la farine")
+        self.poids_eau = Sortie("Poids de l'eau")
+        self.poids_pate = Sortie("Poids de la pâte")
+        self.poids_sel = Sortie("Poids du sel")
+        self.outputs = [
+            self.poids_farine, self.poids_eau, self.poids_pate, self.poids_sel
+        ]
+
+
+class Equivalence(ModeleCommun):
+
+    titre = "Équivalence"
+    calcul = "calcul_equivalence"
+
+    def set_fields(self):
+        self.poids_total_farine = Entree("Poids de la farine", 500)
+        self.poids_total_eau = Entree("Poids de l'eau", 300)
+        self.th_levain = Entree("Taux d'hydratation du levain", 70, min_max=(1, 100), taux=True)
+        self.taux_levain_farine = Entree("Taux levain farine", 40, min_max=(1, 100), taux=True)
+        self.inputs = [
+            self.poids_total_farine, self.poids_total_eau,
+            self.th_levain, self.taux_levain_farine
+        ]
+        self.recipe_fields = {"thl": self.th_levain, "tlf": self.taux_levain_farine}
+
+        self.poids_farine = Sortie("Poids de la farine")
+        self.poids_eau = Sortie("Poids de l'eau")
+        self.poids_levain = Sortie("Poids de levain")
+        self.poids_sel = Sortie("Poids du sel")
+        self.outputs = [
+            self.poids_farine, self.poids_eau, self.poids_levain, self.poids_sel
+        ]
+
+
+# modèles des onglets, dans l'ordre d'affichage
+MODELES = [PateImposee, LevainImpose, Equivalence]
+
+
+# données d'un plan de production lu (voir PlanProduction.lire)
+DonneesPlan = namedtuple("DonneesPlan", ["colonnes", "positions", "lignes", "totaux", "acceptees"])
+
+
+def _cle_tri(valeur):
+    """Clé de tri d'une cellule : les nombres, puis les textes, puis les
+    cellules vides
+    """
+    if isinstance(valeur, (int, float)):
+        return (0, valeur, "")
+    if not valeur:
+        return (2, 0, "")
+    try:
+        return (0, float(valeur.replace(",", ".")), "")
+    except ValueError:
+        return (1, 0, valeur)
+
+
+class PlanProduction:
+    """Commandes d'un traitement par lots (voir lot.py) et leurs résultats,
+    pour l'onglet « Plan de production ».
+
+    Les colonnes sont les champs de toutes les commandes, dans l'ordre de
+    leur première apparition, puis les résultats et l'erreur. Les lignes sont
+    des tuples, dans l'ordre des champs rencontrés lors de la lecture (une
+    ligne lue avant l'apparition d'un champ est plus courte) ; ordre donne
+    les lignes dans l'ordre d'affichage. Les totaux des colonnes de poids
+    portent sur les commandes acceptées.
+
+    >>> import io
+    >>> plan = PlanProduction()
+    >>> plan.charger(io.StringIO(
+    ...     "commande,calcul,ptp,pl,thp,thl,tlf\\n"
+    ...     "1,p,920,,60,100,30\\n"
+    ...     "2,l,,200,60,400,25\\n"
+    ...     "3,p,1000,,60,100,30\\n"), parametres=formules.Parametres(0.02))
+    (2, 1)
+    >>> plan.colonnes
+    ['commande', 'calcul', 'ptp', 'pl', 'thp', 'thl', 'tlf', 'pf', 'pe', 'ps', 'erreur']
+    >>> plan.texte(0, 7), plan.texte(1, 10)
+    ('442.3', "Incompatibilité des taux d'hydratation")
+    >>> plan.totaux["pf"], plan.totaux["ptp"], "thp" in plan.totaux
+    (923.1, 1920.0, False)
+    >>> plan.trier(7, croissant=False)
+    >>> [plan.texte(i, 0) for i in range(len(plan))]
+    ['3', '1', '2']
+
+    Les champs qui n'apparaissent qu'après la première commande sont
+    gardés ; une ligne illisible ne donne que son erreur :
+
+    >>> plan.charger(io.StringIO(
+    ...     "pas du JSON\\n"
+    ...     '{"commande": 1, "calcul": "p", "ptp": 920, "thp": 60, "thl": 100, "tlf": 30}\\n'
+    ...     '{"commande": 2, "client": "halles", "calcul": "p", "ptp": 920, "thp": 60, "thl": 100, "tlf": 30}\\n'),
+    ...     "jsonl", parametres=formules.Parametres(0.02))
+    (2, 1)
+    >>> plan.colonnes
+    ['commande', 'calcul', 'ptp', 'thp', 'thl', 'tlf', 'client', 'pf', 'pe', 'pl', 'ps', 'erreur']
+    >>> [[plan.texte(i, c) for c in (0, 6, 11)] for i in range(len(plan))]
+    [['', '', 'ligne illisible'], ['1', '', ''], ['2', 'halles', '']]
+    >>> plan.totaux["pl"]
+    530.8
+
+    Les valeurs en trop d'une ligne CSV (sans nom de champ) sont ignorées :
+
+    >>> plan.charger(io.StringIO(
+    ...     "commande,calcul,ptp,thp,thl,tlf\\n"
+    ...     "1,p,920,60,100,30,en trop\\n"), parametres=formules.Parametres(0.02))
+    (1, 0)
+    >>> None in plan.colonnes
+    False
+    """
+
+    titre = "Plan de production"
+
+    # colonnes dont le total est calculé
+    POIDS = ("ptp", "pl", "ptf", "pte", "pf", "pe", "ps")
+
+    # nombre d'enregistrements entre deux appels de la progression
+    PAS = 10000
+
+    def __init__(self, calculs=None):
+        self.calculs = calculs
+        self.colonnes = []
+        # position de chaque colonne dans les tuples des lignes
+        self.positions = []
+        self.lignes = []
+        self.ordre = []
+        self.totaux = {}
+
+    def __len__(self):
+        return len(self.ordre)
+
+    def charger(self, flux, format="csv", parametres=None, progression=None, arret=None):
+        """Lit, calcule et installe les commandes du flux (voir lire et
+        installer). Renvoie (nb acceptées, nb rejetées), None si le
+        chargement est interrompu.
+        """
+        donnees = self.lire(flux, format, parametres, progression, arret)
+        return None if donnees is None else self.installer(donnees)
+
+    def installer(self, donnees):
+        """Remplace les données affichées par celles renvoyées par lire.
+        Renvoie (nb acceptées, nb rejetées).
+        """
+        self.colonnes = donnees.colonnes
+        self.positions = donnees.positions
+        self.lignes = donnees.lignes
+        self.ordre = list(range(len(donnees.lignes)))
+        self.totaux = donnees.totaux
+        return donnees.acceptees, len(donnees.lignes) - donnees.acceptees
+
+    def lire(self, flux, format="csv", parametres=None, progression=None, arret=None):
+        """Lit et calcule les commandes du flux, sans toucher aux données
+        affichées : la lecture peut se faire dans un autre fil d'exécution
+        pendant l'affichage, installer se fait dans celui de l'affichage.
+        progression(n) est appelée tous les PAS enregistrements ; la lecture
+        s'interrompt dès que l'évènement arret est positionné. Renvoie les
+        DonneesPlan, None si la lecture est interrompue.
+        """
+        import lot
+
+        # champs des commandes lues, et de leurs résultats, dans l'ordre de
+        # leur première apparition ; champs donne la position dans les tuples
+        # des lignes
+        entrees = {}
+        champs = {}
+
+        def lues():
+            for enregistrement in lot.lire(flux, format):
+                if isinstance(enregistrement, lot.Illisible):
+                    # ligne illisible : seule l'erreur est gardée
+                    enregistrement = lot.Illisible({lot.ERREUR: enregistrement[lot.ERREUR]})
+                elif not enregistrement.keys() <= entrees.keys():
+                    for c in enregistrement:
+                        if c is not None and c not in entrees:
+                            entrees[c] = True
+                yield enregistrement
+
+        lignes = []
+        totaux = {}
+        acceptees = 0
+        for n, (accepte, enregistrement) in enumerate(
+            lot.traiter(lues(), parametres, self.calculs), 1
+        ):
+            if not enregistrement.keys() <= champs.keys():
+                for c in enregistrement:
+                    if c is not None and c not in champs:
+                        champs[c] = len(champs)
+            lignes.append(tuple(enregistrement.get(c, "") for c in champs))
+            if accepte:
+                acceptees += 1
+                for c in self.POIDS:
+                    v = enregistrement.get(c)
+                    if v not in (None, ""):
+                        try:
+                            totaux[c] = totaux.get(c, 0.0) + float(str(v).replace(",", "."))
+                        except ValueError:
+                            pass
+            if n % self.PAS == 0:
+                if arret is not None and arret.is_set():
+                    return None
+                if progression is not None:
+                    progression(n)
+
+        if lignes:
+            colonnes = [c for c in entrees if c != lot.ERREUR]
+            colonnes.extend(c for c in lot.RESULTATS if c in champs and c not in entrees)
+            colonnes.append(lot.ERREUR)
+        else:
+            colonnes = []
+        n = parametres.precision if parametres is not None else formules.parametres_defaut().precision
+        return DonneesPlan(
+            colonnes, [champs.get(c, len(champs)) for c in colonnes], lignes,
+            dict((c, round(t, n)) for c, t in totaux.items()), acceptees
+        )
+
+    def valeur(self, ligne, colonne):
+        """Valeur de la cellule, ligne dans l'ordre de lecture"""
+        ligne = self.lignes[ligne]
+        position = self.positions[colonne]
+        return ligne[position] if position < len(ligne) else ""
+
+    def texte(self, ligne, colonne):
+        """Texte de la cellule, ligne dans l'ordre d'affichage"""
+        valeur = self.valeur(self.ordre[ligne], colonne)
+        return "" if valeur is None else str(valeur)
+
+    def trier(self, colonne, croissant=True):
+        """Trie les lignes selon la colonne, les cellules vides à la fin"""
+        cles = [_cle_tri(self.valeur(i, colonne)) for i in range(len(self.lignes))]
+        vides = [i for i in self.ordre if cles[i][0] == 2]
+        ordre = [i for i in self.ordre if cles[i][0] != 2]
+        ordre.sort(key=cles.__getitem__, reverse=not croissant)
+        self.ordre = ordre + vides
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()
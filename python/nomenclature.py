@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+# license : GPL 3.0
+# copyright : Franck Barbenoire (franck@barbenoi.re)
+
+"""
+Besoins en ingrédients (farine, eau, levain, sel) d'un flux de commandes,
+cumulés par groupe (jour, site, recette...) et au total.
+
+Les recettes sont des enregistrements de lot.py (calcul et champs d'entrée,
+taux en pourcentage) nommés par le champ "recette" : elles décrivent une
+pièce. Une commande nomme une recette et une quantité de pièces ; ses autres
+champs servent au regroupement.
+
+Les poids d'une pièce sont calculés une fois par recette, en milligrammes
+entiers (voir milligrammes.py), puis multipliés par la quantité de chaque
+commande. Les commandes sont lues au fil de l'eau et ne sont pas conservées :
+la mémoire ne dépend que du nombre de groupes, à raison d'un totaliseur par
+groupe. Les totaux sont exacts et arrondis au dixième de gramme à l'écriture.
+
+>>> import io
+>>> recettes = lire_recettes(io.StringIO(
+...     "recette,calcul,ptp,pl,thp,thl,tlf\\n"
+...     "campagne,p,920,,60,100,30\\n"
+...     "seigle,l,,200,80,100,25\\n"
+...     "mouillee,p,920,,60,900,30\\n"))
+>>> commandes = lot.lire(io.StringIO(
+...     "jour,site,recette,quantite\\n"
+...     "lundi,halles,campagne,10\\n"
+...     "lundi,gare,seigle,4\\n"
+...     "mardi,halles,campagne,3\\n"
+...     "mardi,gare,mouillee,1\\n"
+...     "mardi,gare,brioche,2\\n"
+...     "mardi,halles,campagne,0\\n"))
+>>> rejets = io.StringIO()
+>>> n = agreger(commandes, recettes, ("jour",), formules.Parametres(0.02), rejets)
+>>> sortie = io.StringIO()
+>>> ecrire(n, sortie)
+>>> print(sortie.getvalue(), end="")
+jour,commandes,pieces,farine,eau,levain,sel
+lundi,2,14,6023.1,3323.1,3453.8,155.0
+mardi,1,3,1326.9,636.9,796.2,34.5
+total,3,17,7350.0,3960.0,4250.0,189.5
+>>> print(rejets.getvalue(), end="")
+jour,site,recette,quantite,erreur
+mardi,gare,mouillee,1,Incompatibilité des taux d'hydratation
+mardi,gare,brioche,2,recette inconnue : brioche
+mardi,halles,campagne,0,quantite incorrect
+"""
+
+import argparse
+import sys
+
+import formules
+import lot
+import milligrammes
+
+INGREDIENTS = ("farine", "eau", "levain", "sel")
+COMPTEURS = ("commandes", "pieces")
+TOTAL = "total"
+
+
+def poids_piece(recette, parametres=None):
+    """Renvoie les poids d'une pièce (farine, eau, levain, sel) en milligrammes
+    >>> poids_piece({"calcul": "l", "pl": "200", "thp": "80", "thl": "100", "tlf": "25"},
+    ...             formules.Parametres(0.02))
+    (400000, 300000, 200000, 10000)
+    """
+    resultat = lot.calculer(recette, parametres, calculs=milligrammes)
+    if "pl" not in resultat:
+        resultat["pl"], = milligrammes.en_milligrammes((lot.lire_valeur(recette, "pl"),))
+    return resultat["pf"], resultat["pe"], resultat["pl"], resultat["ps"]
+
+
+def lire_recettes(flux, format="csv"):
+    """Lit les recettes, renvoie un dictionnaire nom -> enregistrement"""
+    recettes = {}
+    for recette in lot.lire(flux, format):
+        nom = recette.get("recette")
+        if not nom:
+            raise lot.ErreurEnregistrement("recette sans nom : %s" % dict(recette))
+        if nom in recettes:
+            raise lot.ErreurEnregistrement("recette en double : %s" % nom)
+        recettes[nom] = recette
+    return recettes
+
+
+class Nomenclature:
+    """Totaux des commandes par groupe et au total.
+
+    Chaque total est une liste d'entiers : nombre de commandes, nombre de
+    pièces, puis poids des ingrédients en milligrammes.
+    """
+
+    def __init__(self, recettes, par=(), parametres=None):
+        self.recettes = recettes
+        self.par = tuple(par)
+        self.parametres = parametres
+        self.pieces = {}
+        self.groupes = {}
+
+    def poids_piece(self, nom):
+        """Poids d'une pièce de la recette nom, calculés à la première commande.
+        Une recette incorrecte est mémorisée avec le message de son erreur :
+        une nouvelle exception est levée à chaque commande, sans garder la
+        trace des précédentes.
+        >>> import traceback
+        >>> n = Nomenclature({"r": {"calcul": "p", "ptp": "920"}})
+        >>> for i in range(3):
+        ...     try:
+        ...         n.poids_piece("r")
+        ...     except lot.ErreurEnregistrement as e:
+        ...         print(e, len(traceback.extract_tb(e.__traceback__)))
+        thp manquant 2
+        thp manquant 2
+        thp manquant 2
+        """
+        try:
+            poids = self.pieces[nom]
+        except KeyError:
+            if nom not in self.recettes:
+                raise lot.ErreurEnregistrement("recette inconnue : %s" % nom)
+            try:
+                poids = poids_piece(self.recettes[nom], self.parametres)
+            except lot.ErreurEnregistrement as e:
+                poids = str(e)
+            self.pieces[nom] = poids
+        if isinstance(poids, str):
+            raise lot.ErreurEnregistrement(poids)
+        return poids
+
+    def ajouter(self, commande):
+        farine, eau, levain, sel = self.poids_piece(commande.get("recette") or "")
+        quantite = lot.lire_valeur(commande, "quantite")
+        if quantite.is_integer():
+            # produits d'entiers : pas d'arrondi
+            quantite = int(quantite)
+            poids = (farine * quantite, eau * quantite, levain * quantite, sel * quantite)
+        else:
+            poids = (
+                int(round(farine * quantite)), int(round(eau * quantite)),
+                int(round(levain * quantite)), int(round(sel * quantite))
+            )
+        cle = tuple([commande.get(champ, "") for champ in self.par])
+        totaux = self.groupes.get(cle)
+        if totaux is None:
+            totaux = self.groupes[cle] = [0] * (len(COMPTEURS) + len(INGREDIENTS))
+        totaux[0] += 1
+        totaux[1] += quantite
+        totaux[2] += poids[0]
+        totaux[3] += poids[1]
+        totaux[4] += poids[2]
+        totaux[5] += poids[3]
+
+    def total(self):
+        """Somme des totaux des groupes"""
+        return [sum(t) for t in zip(*self.groupes.values())] or [0] * (
+            len(COMPTEURS) + len(INGREDIENTS)
+        )
+
+    def lignes(self, precision=1):
+        """Génère les lignes (dictionnaires) des groupes, triés, puis du total
+        >>> print(list(Nomenclature({}).lignes()))
+        [{'commandes': 0, 'pieces': 0, 'farine': 0.0, 'eau': 0.0, 'levain': 0.0, 'sel': 0.0}]
+        """
+        def ligne(valeurs, totaux):
+            resultat = dict(zip(self.par, valeurs))
+            resultat.update(zip(COMPTEURS, totaux))
+            resultat.update(
+                (ingredient, milligrammes.arrondi_affichage(t, precision))
+                for ingredient, t in zip(INGREDIENTS, totaux[len(COMPTEURS):])
+            )
+            return resultat
+
+        if self.par:
+            for cle in sorted(self.groupes):
+                yield ligne(cle, self.groupes[cle])
+        yield ligne((TOTAL,) + ("",) * (len(self.par) - 1), self.total())
+
+
+def agreger(commandes, recettes, par=(), parametres=None, rejets=None, format="csv"):
+    """Cumule les commandes et renvoie la Nomenclature. Les commandes
+    rejetées sont écrites dans rejets, avec leur erreur.
+    """
+    nomenclature = Nomenclature(recettes, par, parametres)
+    ecrivain = None
+    if rejets is not None:
+        ecrivain = lot.Ecrivain(rejets, format, supplementaires=(lot.ERREUR,))
+    for commande in commandes:
+        if isinstance(commande, lot.Illisible):
+            erreur = None
+        else:
+            try:
+                nomenclature.ajouter(commande)
+                continue
+            except lot.ErreurEnregistrement as e:
+                erreur = str(e)
+        if ecrivain is not None:
+            rejet = dict(commande)
+            if erreur is not None:
+                rejet[lot.ERREUR] = erreur
+            ecrivain.ecrire(rejet)
+    return nomenclature
+
+
+def ecrire(nomenclature, sortie, format="csv"):
+    champs = list(nomenclature.par) + list(COMPTEURS) + list(INGREDIENTS)
+    ecrivain = lot.Ecrivain(sortie, format, champs)
+    precision = (nomenclature.parametres or formules.parametres_defaut()).precision
+    for ligne in nomenclature.lignes(precision):
+        ecrivain.ecrire(ligne)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="besoins en ingrédients des commandes")
+    parser.add_argument('-t', "--test", action="store_true", help="passer les tests")
+    parser.add_argument("recettes", nargs='?', help="fichier des recettes")
+    parser.add_argument("commandes", nargs='?', default='-', help="fichier des commandes")
+    parser.add_argument("-g", "--par", default="", help="champs de regroupement, séparés par des virgules (jour,site,recette...)")
+    parser.add_argument('-f', "--format", choices=lot.FORMATS, default="csv", help="format des fichiers")
+    parser.add_argument('-r', "--rejets", metavar="FICHIER", help="fichier des commandes rejetées")
+    args = parser.parse_args()
+
+    if args.test:
+        import doctest
+        doctest.testmod()
+        sys.exit(0)
+    if not args.recettes:
+        parser.print_usage()
+        sys.exit(1)
+
+    formules.lire_taux_sel()
+    par = [champ.strip() for champ in args.par.split(",") if champ.strip()]
+    try:
+        with open(args.recettes, encoding="utf-8", newline="") as f:
+            recettes = lire_recettes(f, args.format)
+    except lot.ErreurEnregistrement as e:
+        sys.stderr.write("%s\n" % e)
+        sys.exit(1)
+    fe = sys.stdin if args.commandes == "-" else open(args.commandes, encoding="utf-8", newline="")
+    fr = sys.stderr if args.rejets is None else open(args.rejets, "w", encoding="utf-8", newline="")
+    try:
+        nomenclature = agreger(lot.lire(fe, args.format), recettes, par, rejets=fr, format=args.format)
+        ecrire(nomenclature, sys.stdout, args.format)
+    finally:
+        for f, std in ((fe, sys.stdin), (fr, sys.stderr)):
+            if f is not std:
+                f.close()
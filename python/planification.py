@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+
+# license : GPL 3.0
+# copyright : Franck Barbenoire (franck@barbenoi.re)
+
+"""
+Planification des rafraîchis de levain à partir des pâtes à produire.
+
+C'est la généralisation non interactive du calcul itératif de formules.py :
+les levains forment un graphe d'étapes de profondeur quelconque, chaque étape
+étant obtenue en rafraîchissant le levain de l'étape parente, et plusieurs
+produits (ou plusieurs étapes) peuvent partager la même étape.
+
+Le besoin en levain de chaque produit est calculé avec calcul_pate_imposee,
+puis les besoins sont cumulés par étape, des étapes finales vers le chef, en
+un seul passage dans l'ordre topologique du graphe.
+
+Comme dans les calculs de formules.py, les taux sont des fractions (0.6 pour
+60 %).
+
+>>> etapes = [
+...     Etape("chef", 1.0),
+...     Etape("premier", 1.0, 0.5, "chef"),
+...     Etape("tout-point", 0.6, 0.3, "premier"),
+...     Etape("liquide", 1.0, 0.3, "premier")]
+>>> produits = [
+...     Produit("campagne", 920, 0.6, 0.3, "tout-point"),
+...     Produit("seigle", 1000, 0.8, 0.4, "liquide"),
+...     Produit("baguette", 2000, 0.65, 0.2, "tout-point")]
+>>> plan = planifier(produits, etapes, formules.Parametres(taux_sel=0.02))
+>>> plan.produits["campagne"]
+(442.3, 265.4, 212.3, 11.5)
+>>> for nom, rafraichi in plan.etapes.items():
+...     print(nom, rafraichi)
+liquide Rafraichi(besoin=317.5, farine=122.1, eau=122.1, levain=73.3)
+tout-point Rafraichi(besoin=535.5, farine=257.5, eau=123.6, levain=154.5)
+premier Rafraichi(besoin=227.8, farine=75.9, eau=75.9, levain=75.9)
+chef Rafraichi(besoin=75.9, farine=None, eau=None, levain=None)
+>>> plan.incompatibles
+[]
+>>> planifier([Produit("seigle", 1000, 0.2, 0.4, "liquide")], etapes).incompatibles
+[('produit', 'seigle')]
+"""
+
+import argparse
+from collections import defaultdict, deque, namedtuple, OrderedDict
+import json
+import math
+import sys
+
+import formules
+
+
+# levain d'hydratation `hydratation`, obtenu en rafraîchissant le levain de
+# l'étape parent avec le taux de farine du levain par rapport à la farine
+# `taux`. Une étape sans parent est un chef : son levain est disponible.
+Etape = namedtuple("Etape", ["nom", "hydratation", "taux", "parent"])
+Etape.__new__.__defaults__ = (None, None)
+
+# pâte de poids ptp, d'hydratation thp, avec le taux levain farine tlf, faite
+# avec le levain de l'étape `etape`
+Produit = namedtuple("Produit", ["nom", "ptp", "thp", "tlf", "etape"])
+
+# besoin total en levain d'une étape et poids du rafraîchi qui le produit
+Rafraichi = namedtuple("Rafraichi", ["besoin", "farine", "eau", "levain"])
+
+Plan = namedtuple("Plan", ["produits", "etapes", "incompatibles"])
+
+
+class ErreurPlan(ValueError):
+    pass
+
+
+def ordonner(etapes):
+    """Renvoie les étapes, les parents avant leurs descendants
+    >>> [e.nom for e in ordonner([Etape("b", 1, 1, "a"), Etape("a", 1)])]
+    ['a', 'b']
+    >>> ordonner([Etape("a", 1, 1, "b"), Etape("b", 1, 1, "a")])  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ...
+    planification.ErreurPlan: Cycle entre les étapes : a, b
+    """
+    par_nom = OrderedDict()
+    for etape in etapes:
+        if etape.nom in par_nom:
+            raise ErreurPlan("Étape en double : %s" % etape.nom)
+        par_nom[etape.nom] = etape
+
+    enfants = defaultdict(list)
+    a_traiter = deque()
+    for etape in par_nom.values():
+        if etape.parent is None:
+            a_traiter.append(etape)
+        elif etape.parent not in par_nom:
+            raise ErreurPlan("Étape %s : étape parente inconnue %s" % (etape.nom, etape.parent))
+        else:
+            enfants[etape.parent].append(etape)
+
+    ordre = []
+    while a_traiter:
+        etape = a_traiter.popleft()
+        ordre.append(etape)
+        a_traiter.extend(enfants[etape.nom])
+
+    if len(ordre) != len(par_nom):
+        vus = set(e.nom for e in ordre)
+        raise ErreurPlan("Cycle entre les étapes : %s" % ", ".join(
+            nom for nom in par_nom if nom not in vus
+        ))
+    return ordre
+
+
+def planifier(produits, etapes, parametres=None):
+    """Calcule les pâtes des produits et les rafraîchis de toutes les étapes.
+
+    Renvoie un Plan : les poids (farine, eau, levain, sel) de chaque produit,
+    le rafraîchi de chaque étape (des étapes finales vers les chefs ; pour un
+    chef, seul le besoin est renseigné) et la liste des couples ("produit",
+    nom) ou ("etape", nom) dont les taux d'hydratation sont incompatibles.
+    Le levain d'un produit ou d'une étape incompatible n'est pas compté.
+    """
+    ordre = ordonner(etapes)
+    par_nom = {e.nom: e for e in ordre}
+    besoins = defaultdict(float)
+    incompatibles = []
+
+    resultats_produits = OrderedDict()
+    for produit in produits:
+        if produit.nom in resultats_produits:
+            raise ErreurPlan("Produit en double : %s" % produit.nom)
+        if produit.etape not in par_nom:
+            raise ErreurPlan("Produit %s : étape inconnue %s" % (produit.nom, produit.etape))
+        resultat = formules.calcul_pate_imposee(
+            produit.ptp, produit.thp, par_nom[produit.etape].hydratation, produit.tlf,
+            parametres
+        )
+        resultats_produits[produit.nom] = resultat
+        if resultat[1] < 0:
+            incompatibles.append(("produit", produit.nom))
+        else:
+            besoins[produit.etape] += resultat[2]
+
+    precision = (parametres or formules.parametres_defaut()).precision
+    resultats_etapes = OrderedDict()
+    for etape in reversed(ordre):
+        besoin = round(besoins[etape.nom], precision)
+        if etape.parent is None:
+            resultats_etapes[etape.nom] = Rafraichi(besoin, None, None, None)
+            continue
+        pf, pe, pl, _ = formules.calcul_pate_imposee(
+            besoin, etape.hydratation, par_nom[etape.parent].hydratation, etape.taux,
+            parametres
+        )
+        resultats_etapes[etape.nom] = Rafraichi(besoin, pf, pe, pl)
+        if pe < 0:
+            incompatibles.append(("etape", etape.nom))
+        else:
+            besoins[etape.parent] += pl
+
+    return Plan(resultats_produits, resultats_etapes, incompatibles)
+
+
+def _nom(objet, quoi):
+    nom = objet["nom"]
+    if not isinstance(nom, str) or not nom:
+        raise ErreurPlan("%s sans nom" % quoi)
+    return nom
+
+
+def _reference(objet, champ, quoi, facultative=False):
+    """Nom de l'étape donné par le champ, None s'il est facultatif et absent"""
+    nom = objet.get(champ) if facultative else objet[champ]
+    if nom is None and facultative:
+        return None
+    if not isinstance(nom, str) or not nom:
+        raise ErreurPlan("%s %s : %s incorrect" % (quoi, objet["nom"], champ))
+    return nom
+
+
+def _nombre(objet, champ, quoi):
+    """Valeur du champ, nombre fini et strictement positif"""
+    v = objet[champ]
+    if isinstance(v, int) and not isinstance(v, bool):
+        try:
+            v = float(v)
+        except OverflowError:
+            v = None
+    if not isinstance(v, float) or not math.isfinite(v) or v <= 0:
+        raise ErreurPlan("%s %s : %s incorrect" % (quoi, objet["nom"], champ))
+    return v
+
+
+def lire_plan(flux):
+    """Lit les étapes et les produits d'un plan au format JSON, taux en
+    pourcentage :
+
+    {"etapes": [{"nom": "chef", "hydratation": 100},
+                {"nom": "tout-point", "hydratation": 60, "taux": 30, "parent": "chef"}],
+     "produits": [{"nom": "campagne", "ptp": 920, "thp": 60, "tlf": 30, "etape": "tout-point"}]}
+
+    Les poids et les taux doivent être des nombres strictement positifs, les
+    noms des produits distincts et les étapes désignées par leur nom.
+    >>> import io
+    >>> lire_plan(io.StringIO('''{"etapes": [{"nom": "chef", "hydratation": 100}],
+    ...     "produits": [{"nom": "pain", "ptp": 920, "thp": 60, "tlf": 0, "etape": "chef"}]}'''))  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ...
+    planification.ErreurPlan: Produit pain : tlf incorrect
+    >>> lire_plan(io.StringIO('''{"etapes": [{"nom": "chef", "hydratation": 100}],
+    ...     "produits": [{"nom": "pain", "ptp": 920, "thp": 60, "tlf": 30, "etape": "chef"},
+    ...                  {"nom": "pain", "ptp": 500, "thp": 60, "tlf": 30, "etape": "chef"}]}'''))  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ...
+    planification.ErreurPlan: Produit en double : pain
+    >>> lire_plan(io.StringIO('''{"etapes": [{"nom": "chef", "hydratation": 100},
+    ...         {"nom": "tout-point", "hydratation": 60, "taux": 30, "parent": ["chef"]}],
+    ...     "produits": []}'''))  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ...
+    planification.ErreurPlan: Étape tout-point : parent incorrect
+    """
+    try:
+        donnees = json.load(flux)
+        etapes = []
+        for e in donnees["etapes"]:
+            nom = _nom(e, "Étape")
+            parent = _reference(e, "parent", "Étape", facultative=True)
+            etapes.append(Etape(
+                nom, _nombre(e, "hydratation", "Étape") / 100,
+                _nombre(e, "taux", "Étape") / 100 if parent is not None else None,
+                parent
+            ))
+        produits = []
+        noms = set()
+        for p in donnees["produits"]:
+            nom = _nom(p, "Produit")
+            if nom in noms:
+                raise ErreurPlan("Produit en double : %s" % nom)
+            noms.add(nom)
+            produits.append(Produit(
+                nom, _nombre(p, "ptp", "Produit"), _nombre(p, "thp", "Produit") / 100,
+                _nombre(p, "tlf", "Produit") / 100, _reference(p, "etape", "Produit")
+            ))
+    except (ValueError, KeyError, TypeError) as e:
+        if isinstance(e, ErreurPlan):
+            raise
+        raise ErreurPlan("Plan incorrect : %s" % e)
+    return produits, etapes
+
+
+def afficher(plan, sortie=sys.stdout):
+    for nom, (pf, pe, pl, ps) in plan.produits.items():
+        sortie.write("\n%s\n" % nom)
+        if pe < 0:
+            sortie.write("Incompatibilité des taux d'hydratation\n")
+            continue
+        sortie.write("Poids de farine : %.1f\n" % pf)
+        sortie.write("Poids d'eau : %.1f\n" % pe)
+        sortie.write("Poids du levain : %.1f\n" % pl)
+        sortie.write("Poids du sel : %.1f\n" % ps)
+    sortie.write("=====================================================\n")
+    for nom, rafraichi in plan.etapes.items():
+        sortie.write("\nÉtape %s : %.1f de levain\n" % (nom, rafraichi.besoin))
+        if rafraichi.levain is None:
+            continue
+        if rafraichi.eau < 0:
+            sortie.write("Incompatibilité des taux d'hydratation\n")
+        else:
+            sortie.write("Poids de farine : %.1f\n" % rafraichi.farine)
+            sortie.write("Poids d'eau : %.1f\n" % rafraichi.eau)
+            sortie.write("Poids du levain : %.1f\n" % rafraichi.levain)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="planification des rafraîchis de levain")
+    parser.add_argument('-t', "--test", action="store_true", help="passer les tests")
+    parser.add_argument("plan", nargs='?', default='-', help="fichier JSON du plan")
+    args = parser.parse_args()
+
+    if args.test:
+        import doctest
+        doctest.testmod()
+        sys.exit(0)
+
+    formules.lire_taux_sel()
+    try:
+        if args.plan == "-":
+            produits, etapes = lire_plan(sys.stdin)
+        else:
+            with open(args.plan, encoding="utf-8") as f:
+                produits, etapes = lire_plan(f)
+        afficher(planifier(produits, etapes))
+    except ErreurPlan as e:
+        sys.stderr.write("%s\n" % e)
+        sys.exit(1)
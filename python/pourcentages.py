@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+
+# license : GPL 3.0
+# copyright : Franck Barbenoire (franck@barbenoi.re)
+
+"""
+Recettes en pourcentages du boulanger : ingrédients en plus de la farine, de
+l'eau et du levain.
+
+Dans formules.py, le sel est le seul ingrédient en plus, au taux taux_sel.
+Une Definition donne, pour une recette, autant d'ingrédients que voulu (sel,
+levure, sucre, beurre, inclusions...), chacun en pourcentage du poids total
+de farine, levain compris. La farine, l'eau et le levain sont calculés comme
+dans formules.py ; les ingrédients ne changent pas le poids de la pâte. Le
+sel est un ingrédient comme les autres : une définition sans sel n'en met
+pas.
+
+Chaque définition est compilée une fois, pour un calcul, en une fonction
+Python dont les taux sont fixés : l'évaluation ne parcourt pas la
+liste des ingrédients. La version vectorisée (NumPy) calcule un tableau de
+valeurs en un appel ; ses arrondis sont ceux de vectoriel.py, identiques à
+ceux de round().
+
+>>> brioche = Definition("brioche", (("sel", 0.02), ("levure", 0.01), ("sucre", 0.12), ("beurre", 0.5)))
+>>> evaluer = compiler(brioche, "pate")
+>>> evaluer.noms
+('pf', 'pe', 'pl', 'sel', 'levure', 'sucre', 'beurre')
+>>> evaluer(920, 0.6, 1.0, 0.3)
+(442.3, 212.3, 265.4, 11.5, 5.8, 69.0, 287.5)
+>>> evaluer = compiler(brioche, "pate", vectorise=True)
+>>> [c.tolist() for c in evaluer(np.array([920, 1840]), 0.6, 1.0, 0.3)]
+[[442.3, 884.6], [212.3, 424.6], [265.4, 530.8], [11.5, 23.0], [5.8, 11.5], [69.0, 138.0], [287.5, 575.0], [True, True]]
+
+La définition qui ne contient que le sel au taux taux_sel donne les résultats
+de formules.py :
+
+>>> import random
+>>> p = formules.Parametres(taux_sel=0.018, precision=1)
+>>> tirages = [(random.uniform(100, 2000), random.choice((0.6, 0.7)),
+...             random.uniform(0.5, 1), random.choice((0.2, 0.3))) for i in range(1000)]
+>>> all(compiler(definition_defaut(p), nom)(*t) == fonction(*t, parametres=p)
+...     for t in tirages for nom, (fonction, entrees, sorties) in lot.CALCULS.items())
+True
+"""
+
+import argparse
+from collections import namedtuple
+import functools
+from itertools import islice
+import math
+import sys
+
+import numpy as np
+
+import formules
+import lot
+import vectoriel
+
+# ingredients : tuple de couples (nom, taux en fraction de la farine totale)
+Definition = namedtuple("Definition", ["nom", "ingredients"])
+
+# lignes communes aux évaluateurs de chaque calcul : les mêmes opérations que
+# formules.py, puis le poids total de la farine
+CORPS = {
+    "pate": (
+        "pfl = (ptp * tlf) / (1 + tlf) / (1 + thp)",
+        "pf = pfl / tlf",
+        "pe = ((1 / tlf + 1) * thp - thl) * pfl",
+        "pl = (1 + thl) * pfl",
+        "farine = pf + pfl",
+    ),
+    "levain": (
+        "pfl = pl / (1 + thl)",
+        "pf = pfl / tlf",
+        "pe = ((1 / tlf + 1) * thp - thl) * pfl",
+        "ptp = pl + pf + pe",
+        "farine = pf + pfl",
+    ),
+    "equivalence": (
+        "pf = ptf / (1 + tlf / (1 + 1 / thl))",
+        "pe = pte - ptf * tlf / (1 + (1 + tlf) * thl)",
+        "pl = pf * tlf",
+        "farine = ptf",
+    ),
+}
+
+TAILLE_BLOC = 10000
+
+# champs des calculs, qui ne peuvent pas nommer un ingrédient
+RESERVES = set(["calcul", "recette", lot.ERREUR]).union(
+    *((entrees + sorties) for fonction, entrees, sorties in lot.CALCULS.values())
+)
+
+
+def definition_defaut(parametres=None):
+    """Définition équivalente aux calculs de formules.py : le sel seul"""
+    if parametres is None:
+        parametres = formules.parametres_defaut()
+    return Definition("", (("sel", parametres.taux_sel),))
+
+
+class Evaluateur:
+    """Fonction compilée d'une définition. noms donne les poids renvoyés ;
+    la version vectorisée renvoie en plus le masque de faisabilité (pe >= 0).
+    """
+
+    __slots__ = ("definition", "calcul", "noms", "source", "fonction")
+
+    def __init__(self, definition, calcul, noms, source, fonction):
+        self.definition = definition
+        self.calcul = calcul
+        self.noms = noms
+        self.source = source
+        self.fonction = fonction
+
+    def __call__(self, *valeurs):
+        return self.fonction(*valeurs)
+
+
+@functools.lru_cache(maxsize=256)
+def compiler(definition, calcul="pate", precision=1, vectorise=False):
+    """Compile la définition pour le calcul ("pate", "levain",
+    "equivalence" ou leurs abréviations) et renvoie l'Evaluateur, qui prend
+    les entrées du calcul (taux en fractions)
+    >>> print(compiler(Definition("pain", (("sel", 0.02),)), "e").source)
+    def evaluer(ptf, pte, thl, tlf):
+        pf = ptf / (1 + tlf / (1 + 1 / thl))
+        pe = pte - ptf * tlf / (1 + (1 + tlf) * thl)
+        pl = pf * tlf
+        farine = ptf
+        return (round(pf, 1), round(pe, 1), round(pl, 1), round(farine * taux_0, 1))
+    >>> compiler(Definition("pain", (("sel", float("nan")),)))  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ...
+    lot.ErreurEnregistrement: pain : sel incorrect
+    """
+    nom = lot.ABREVIATIONS.get(calcul, calcul)
+    if nom not in CORPS:
+        raise lot.ErreurEnregistrement("calcul inconnu : %s" % calcul)
+    fonction, entrees, sorties = lot.CALCULS[nom]
+    # les taux sont des variables globales de la fonction, et non des
+    # nombres écrits dans sa source
+    taux = {}
+    for i, (ingredient, t) in enumerate(definition.ingredients):
+        if not math.isfinite(t) or t < 0:
+            raise lot.ErreurEnregistrement("%s : %s incorrect" % (definition.nom, ingredient))
+        taux["taux_%d" % i] = float(t)
+    poids = list(sorties[:3]) + ["farine * %s" % t for t in taux]
+    noms = tuple(sorties[:3]) + tuple(n for n, _ in definition.ingredients)
+
+    lignes = ["def evaluer(%s):" % ", ".join(entrees)]
+    if vectorise:
+        lignes.append("    %s, = broadcast_arrays(%s)" % (
+            ", ".join(entrees), ", ".join("asarray(%s, float64)" % e for e in entrees)
+        ))
+        lignes.append("    with errstate(divide='ignore', invalid='ignore'):")
+        lignes.extend("        " + ligne for ligne in CORPS[nom])
+        lignes.append("    pe = arrondi(pe, %d)" % precision)
+        lignes.append("    return (%s, pe >= 0)" % ", ".join(
+            "pe" if p == "pe" else "arrondi(%s, %d)" % (p, precision) for p in poids
+        ))
+    else:
+        lignes.extend("    " + ligne for ligne in CORPS[nom])
+        lignes.append("    return (%s)" % ", ".join("round(%s, %d)" % (p, precision) for p in poids))
+    source = "\n".join(lignes)
+
+    espace = {
+        "arrondi": vectoriel.arrondi, "asarray": np.asarray, "float64": np.float64,
+        "broadcast_arrays": np.broadcast_arrays, "errstate": np.errstate
+    }
+    espace.update(taux)
+    exec(compile(source, "<recette %s>" % definition.nom, "exec"), espace)
+    return Evaluateur(definition, nom, noms, source, espace["evaluer"])
+
+
+def lire_definitions(flux, format="csv"):
+    """Lit les définitions : le champ "recette" donne le nom, chaque autre
+    champ renseigné un ingrédient, en pourcentage. Renvoie un dictionnaire
+    nom -> Definition.
+    >>> import io
+    >>> d = lire_definitions(io.StringIO("recette,sel,beurre\\npain,2,\\nbrioche,2,50\\n"))
+    >>> d["pain"], d["brioche"].ingredients
+    (Definition(nom='pain', ingredients=(('sel', 0.02),)), (('sel', 0.02), ('beurre', 0.5)))
+    >>> lire_definitions(io.StringIO("recette,sel\\npain,inf\\n"))  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ...
+    lot.ErreurEnregistrement: pain : sel incorrect
+    """
+    definitions = {}
+    for enregistrement in lot.lire(flux, format):
+        nom = enregistrement.get("recette")
+        if not nom:
+            raise lot.ErreurEnregistrement("recette sans nom : %s" % dict(enregistrement))
+        if nom in definitions:
+            raise lot.ErreurEnregistrement("recette en double : %s" % nom)
+        ingredients = []
+        for champ, valeur in enregistrement.items():
+            if champ == "recette" or valeur is None or valeur == "":
+                continue
+            if champ in RESERVES:
+                raise lot.ErreurEnregistrement("%s : nom d'ingrédient réservé : %s" % (nom, champ))
+            try:
+                taux = float(str(valeur).replace(",", "."))
+            except ValueError:
+                taux = -1
+            if not math.isfinite(taux) or taux < 0:
+                raise lot.ErreurEnregistrement("%s : %s incorrect" % (nom, champ))
+            ingredients.append((champ, taux / 100))
+        definitions[nom] = Definition(nom, tuple(ingredients))
+    return definitions
+
+
+def _evaluer_bloc(enregistrements, definitions, parametres):
+    resultats = [None] * len(enregistrements)
+    groupes = {}
+    for i, enregistrement in enumerate(enregistrements):
+        try:
+            if isinstance(enregistrement, lot.Illisible):
+                raise lot.ErreurEnregistrement(enregistrement[lot.ERREUR])
+            recette = enregistrement.get("recette") or ""
+            if recette not in definitions:
+                raise lot.ErreurEnregistrement("recette inconnue : %s" % recette)
+            nom = enregistrement.get("calcul") or ""
+            nom = lot.ABREVIATIONS.get(nom, nom)
+            if nom not in lot.CALCULS:
+                raise lot.ErreurEnregistrement("calcul inconnu : %s" % nom)
+            valeurs = [lot.lire_valeur(enregistrement, c) for c in lot.CALCULS[nom][1]]
+        except lot.ErreurEnregistrement as e:
+            rejet = dict(enregistrement)
+            rejet[lot.ERREUR] = str(e)
+            resultats[i] = (False, rejet)
+            continue
+        groupes.setdefault((recette, nom), []).append((i, valeurs))
+
+    for (recette, nom), lignes in groupes.items():
+        evaluer = compiler(definitions[recette], nom, parametres.precision, vectorise=True)
+        *colonnes, faisable = evaluer(*np.array([v for i, v in lignes]).T)
+        colonnes = [c.tolist() for c in colonnes]
+        for j, (i, valeurs) in enumerate(lignes):
+            enregistrement = dict(enregistrements[i])
+            if faisable[j]:
+                enregistrement.update(zip(evaluer.noms, [c[j] for c in colonnes]))
+                resultats[i] = (True, enregistrement)
+            else:
+                enregistrement[lot.ERREUR] = "Incompatibilité des taux d'hydratation"
+                resultats[i] = (False, enregistrement)
+    return resultats
+
+
+def evaluer(enregistrements, definitions, parametres=None, taille_bloc=TAILLE_BLOC):
+    """Génère des couples (accepté, enregistrement complété), comme
+    lot.traiter. Chaque enregistrement nomme sa définition (champ "recette")
+    et donne les champs d'entrée de son calcul ; il reçoit les poids de la
+    farine, de l'eau, du levain (ou de la pâte) et de chaque ingrédient.
+    Les enregistrements sont traités par blocs, chaque recette et calcul
+    d'un bloc en un appel de l'évaluateur vectorisé.
+    >>> import io
+    >>> definitions = {"brioche": Definition("brioche", (("sel", 0.02), ("beurre", 0.5)))}
+    >>> entree = lot.lire(io.StringIO(
+    ...     "commande,recette,calcul,ptp,pl,thp,thl,tlf\\n"
+    ...     "1,brioche,p,920,,60,100,30\\n"
+    ...     "2,brioche,l,,200,60,400,25\\n"
+    ...     "3,pain,p,920,,60,100,30\\n"))
+    >>> for accepte, e in evaluer(entree, definitions, formules.Parametres(0.02, 1)):
+    ...     print(accepte, e.get("beurre"), e.get("erreur"))
+    True 287.5 None
+    False None Incompatibilité des taux d'hydratation
+    False None recette inconnue : pain
+    """
+    if parametres is None:
+        parametres = formules.parametres_defaut()
+    enregistrements = iter(enregistrements)
+    while True:
+        bloc = list(islice(enregistrements, taille_bloc))
+        if not bloc:
+            break
+        yield from _evaluer_bloc(bloc, definitions, parametres)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="recettes en pourcentages du boulanger")
+    parser.add_argument('-t', "--test", action="store_true", help="passer les tests")
+    parser.add_argument("definitions", nargs='?', help="fichier des définitions (recette et ingrédients en %%)")
+    parser.add_argument("entree", nargs='?', default='-', help="fichier des enregistrements à calculer (recette, calcul et entrées)")
+    parser.add_argument('-f', "--format", choices=lot.FORMATS, default="csv", help="format des fichiers")
+    parser.add_argument('-r', "--rejets", metavar="FICHIER", help="fichier des enregistrements rejetés (sortie d'erreur par défaut)")
+    args = parser.parse_args()
+
+    if args.test:
+        import doctest
+        doctest.testmod()
+        sys.exit(0)
+    if not args.definitions:
+        parser.print_usage()
+        sys.exit(1)
+
+    formules.lire_taux_sel()
+    try:
+        with open(args.definitions, encoding="utf-8", newline="") as f:
+            definitions = lire_definitions(f, args.format)
+    except lot.ErreurEnregistrement as e:
+        sys.stderr.write("%s\n" % e)
+        sys.exit(1)
+    supplementaires = list(lot.RESULTATS[:4])
+    for definition in definitions.values():
+        supplementaires.extend(
+            n for n, _ in definition.ingredients if n not in supplementaires
+        )
+
+    fe = sys.stdin if args.entree == "-" else open(args.entree, encoding="utf-8", newline="")
+    fr = sys.stderr if args.rejets is None else open(args.rejets, "w", encoding="utf-8", newline="")
+    try:
+        ecrivains = {
+            True: lot.Ecrivain(sys.stdout, args.format, supplementaires=supplementaires),
+            False: lot.Ecrivain(fr, args.format, supplementaires=(lot.ERREUR,))
+        }
+        for accepte, enregistrement in evaluer(lot.lire(fe, args.format), definitions):
+            ecrivains[accepte].ecrire(enregistrement)
+    finally:
+        for f, std in ((fe, sys.stdin), (fr, sys.stderr)):
+            if f is not std:
+                f.close()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+# license : GPL 3.0
+# copyright : Franck Barbenoire (franck@barbenoi.re)
+
+"""
+Rendu HTML des calculs : environnement Jinja partagé et rapport de production.
+
+L'environnement est créé une seule fois, à la première utilisation, et les
+modèles compilés sont conservés : un nouvel affichage ne relit ni ne recompile
+les fichiers du répertoire templates.
+
+Le rapport de production regroupe, dans un seul document, une fiche par
+enregistrement d'un traitement par lots (voir lot.py). Il est produit au fil
+de l'eau avec generate() : la mémoire utilisée ne dépend pas du nombre de
+recettes.
+
+>>> import io
+>>> entree = io.StringIO(
+...     "commande,calcul,ptp,thp,thl,tlf\\n"
+...     "A12,p,920,60,100,30\\n"
+...     "A13,p,920,60,900,30\\n")
+>>> sortie, rejets = io.StringIO(), io.StringIO()
+>>> rapport(lot.lire(entree), sortie, rejets, parametres=formules.Parametres(0.02))
+(1, 1)
+>>> html = sortie.getvalue()
+>>> html.count('class="recette"'), "Commande A12" in html, "442,3" in html
+(1, True, True)
+"""
+
+import argparse
+import os
+import sys
+
+from jinja2 import Environment, FileSystemLoader
+
+import formules
+import lot
+
+MODELES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+_environnement = None
+_modeles = {}
+
+TITRES = {
+    "pate": "Poids de la pâte imposé",
+    "levain": "Poids du levain imposé",
+    "equivalence": "Équivalence",
+}
+
+LIBELLES = {
+    "ptp": "Poids de la pâte",
+    "pl": "Poids de levain",
+    "ptf": "Poids de la farine",
+    "pte": "Poids de l'eau",
+    "thp": "Taux d'hydratation de la pâte",
+    "thl": "Taux d'hydratation du levain",
+    "tlf": "Taux levain farine",
+    "pf": "Poids de la farine",
+    "pe": "Poids de l'eau",
+    "ps": "Poids du sel",
+}
+
+
+class Champ:
+    """Libellé et valeur, présentés comme les champs des formulaires"""
+
+    def __init__(self, label, value):
+        self.label = label
+        self.value = value
+
+    def get_label(self):
+        return self.label
+
+    def get_value(self):
+        return self.value
+
+
+def environnement():
+    """Renvoie l'environnement Jinja partagé"""
+    global _environnement
+    if _environnement is None:
+        _environnement = Environment(
+            autoescape=True,
+            auto_reload=False,
+            loader=FileSystemLoader(MODELES)
+        )
+    return _environnement
+
+
+def modele(nom):
+    """Renvoie le modèle compilé nom"""
+    try:
+        return _modeles[nom]
+    except KeyError:
+        return _modeles.setdefault(nom, environnement().get_template(nom))
+
+
+def fiche(enregistrement):
+    """Renvoie le titre et les champs d'entrée et de sortie d'un
+    enregistrement complété par lot.traiter()
+    """
+    nom = lot.ABREVIATIONS.get(enregistrement["calcul"], enregistrement["calcul"])
+    _, entrees, sorties = lot.CALCULS[nom]
+    titre = TITRES[nom]
+    for cle in ("nom", "recette", "commande"):
+        if enregistrement.get(cle):
+            titre = "%s %s - %s" % (cle.capitalize(), enregistrement[cle], titre)
+            break
+    return {
+        "title": titre,
+        "fields": {
+            "inputs": [
+                Champ(LIBELLES[c], float(str(enregistrement[c]).replace(",", ".")))
+                for c in entrees
+            ],
+            "outputs": [Champ(LIBELLES[c], enregistrement[c]) for c in sorties]
+        }
+    }
+
+
+def rapport(enregistrements, sortie, rejets=None, format="csv", titre="Production",
+            parametres=None):
+    """Écrit dans sortie le rapport de production des enregistrements, et dans
+    rejets les enregistrements rejetés. Renvoie (nb acceptés, nb rejetés).
+    """
+    ecrivain = None
+    if rejets is not None:
+        ecrivain = lot.Ecrivain(rejets, format, supplementaires=(lot.ERREUR,))
+    compteurs = {True: 0, False: 0}
+
+    def recettes():
+        for accepte, enregistrement in lot.traiter(enregistrements, parametres):
+            compteurs[accepte] += 1
+            if accepte:
+                yield fiche(enregistrement)
+            elif ecrivain is not None:
+                ecrivain.ecrire(enregistrement)
+
+    for morceau in modele("production.html").generate(title=titre, recettes=recettes()):
+        sortie.write(morceau)
+    return compteurs[True], compteurs[False]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="rapport de production au format HTML")
+    parser.add_argument('-t', "--test", action="store_true", help="passer les tests")
+    parser.add_argument("entree", nargs='?', default='-', help="fichier des enregistrements")
+    parser.add_argument('-f', "--format", choices=lot.FORMATS, default="csv", help="format des enregistrements")
+    parser.add_argument('-o', "--sortie", metavar="FICHIER", help="fichier HTML (sortie standard par défaut)")
+    parser.add_argument('-r', "--rejets", metavar="FICHIER", help="fichier des enregistrements rejetés")
+    parser.add_argument("--titre", default="Production", help="titre du rapport")
+    args = parser.parse_args()
+
+    if args.test:
+        import doctest
+        doctest.testmod()
+        sys.exit(0)
+
+    formules.lire_taux_sel()
+    fe = sys.stdin if args.entree == "-" else open(args.entree, encoding="utf-8", newline="")
+    fs = sys.stdout if args.sortie is None else open(args.sortie, "w", encoding="utf-8")
+    fr = sys.stderr if args.rejets is None else open(args.rejets, "w", encoding="utf-8", newline="")
+    try:
+        rapport(lot.lire(fe, args.format), fs, fr, args.format, args.titre)
+    finally:
+        for f, std in ((fe, sys.stdin), (fs, sys.stdout), (fr, sys.stderr)):
+            if f is not std:
+                f.close()
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+
+# license : GPL 3.0
+# copyright : Franck Barbenoire (franck@barbenoi.re)
+
+"""
+Résultats des traitements par lots sous forme de colonnes, et fichier binaire
+qui les contient.
+
+Au lieu d'un dictionnaire et d'un tuple de flottants par enregistrement,
+Resultats range chaque champ dans un tableau NumPy : un enregistrement coûte
+quelques dizaines d'octets. Les enregistrements sont lus par blocs, et chaque
+calcul d'un bloc est fait d'un seul appel aux fonctions de vectoriel.py.
+
+Chaque ligne correspond à un enregistrement de l'entrée, dans l'ordre, y
+compris les rejetés : la colonne "etat" vaut ACCEPTE, INFAISABLE (pe < 0, les
+poids calculés sont conservés) ou INCORRECT (calcul inconnu, valeur manquante
+ou incorrecte, les poids valent NaN). La colonne "calcul" donne le rang du
+calcul dans lot.CALCULS. Les valeurs absentes valent NaN. Comme dans
+formules.py, les taux sont des fractions, pas des pourcentages.
+
+Les autres champs de l'entrée (numéro de commande, client...) sont gardés
+dans des colonnes de chaînes (type NumPy "U", de largeur fixe), pour
+rapprocher les résultats des enregistrements ; les valeurs absentes sont des
+chaînes vides.
+
+Le fichier commence par la signature SIGNATURE, suivie de la longueur de
+l'en-tête (entier de 8 octets, petit-boutiste) et de l'en-tête, en JSON, qui
+décrit les colonnes : nom, type NumPy et position dans la zone des données.
+La zone des données commence au premier multiple de ALIGNEMENT qui suit
+l'en-tête, chaque colonne est elle-même alignée. La lecture projette le
+fichier en mémoire : les colonnes sont des tableaux NumPy en lecture seule,
+sans copie ni analyse de texte.
+
+>>> import io, os, tempfile
+>>> entree = io.StringIO(
+...     "commande,calcul,ptp,pl,thp,thl,tlf\\n"
+...     "1,p,920,,60,100,30\\n"
+...     "2,l,,200,60,400,25\\n"
+...     "3,x,,,,,\\n")
+>>> r = calculer(lot.lire(entree), formules.Parametres(0.02))
+>>> len(r), r["etat"].tolist(), r["pf"].tolist()
+(3, [0, 1, 2], [442.3, 160.0, nan])
+>>> r.ligne(0)
+{'calcul': 'pate', 'etat': 'accepté', 'ptp': 920.0, 'pl': 265.4, 'thp': 0.6, 'thl': 1.0, 'tlf': 0.3, 'pf': 442.3, 'pe': 212.3, 'ps': 11.5, 'commande': '1'}
+>>> r["commande"].tolist()
+['1', '2', '3']
+>>> chemin = os.path.join(tempfile.mkdtemp(), "resultats.col")
+>>> r.ecrire(chemin)
+>>> r2 = lire(chemin)
+>>> r2["pf"].flags.writeable, r2.parametres["taux_sel"]
+(False, 0.02)
+>>> all(np.array_equal(r[c], r2[c], equal_nan=r[c].dtype.kind == "f") for c in r.noms())
+True
+>>> r2["commande"].dtype.str, r2.ligne(1)["commande"]
+('<U1', '2')
+"""
+
+import argparse
+from itertools import islice
+import json
+import mmap
+import struct
+import sys
+
+import numpy as np
+
+import formules
+import lot
+import vectoriel
+
+SIGNATURE = b"FORMCOL\x01"
+ALIGNEMENT = 64
+VERSION = 1
+
+# états des enregistrements
+ACCEPTE, INFAISABLE, INCORRECT = 0, 1, 2
+ETATS = ("accepté", "infaisable", "incorrect")
+
+NOMS_CALCULS = tuple(lot.CALCULS)
+INCONNU = 255
+
+# colonnes des valeurs : entrées et sorties de tous les calculs
+VALEURS = ("ptp", "pl", "ptf", "pte", "thp", "thl", "tlf", "pf", "pe", "ps")
+TYPES = dict([("calcul", "u1"), ("etat", "u1")] + [(c, "<f8") for c in VALEURS])
+
+TAILLE_BLOC = 1 << 16
+
+
+class Resultats:
+    """Colonnes (tableaux NumPy de même longueur) des résultats d'un lot"""
+
+    __slots__ = ("colonnes", "parametres")
+
+    def __init__(self, colonnes, parametres=None):
+        self.colonnes = colonnes
+        # paramètres du calcul (dictionnaire)
+        self.parametres = parametres or {}
+
+    def __len__(self):
+        return len(self.colonnes["etat"])
+
+    def __getitem__(self, nom):
+        return self.colonnes[nom]
+
+    def noms(self):
+        return list(self.colonnes)
+
+    def ligne(self, i):
+        """Enregistrement i, sans les valeurs absentes"""
+        ligne = {}
+        for nom, colonne in self.colonnes.items():
+            v = colonne[i].item()
+            if nom == "calcul":
+                v = NOMS_CALCULS[v] if v != INCONNU else ""
+            elif nom == "etat":
+                v = ETATS[v]
+            elif v != v or v == "":
+                continue
+            ligne[nom] = v
+        return ligne
+
+    @classmethod
+    def concatener(cls, liste, parametres=None):
+        """Met bout à bout les Resultats de liste ; une colonne de chaînes
+        absente de certains est complétée par des chaînes vides
+        """
+        if not liste:
+            return cls({n: np.empty(0, t) for n, t in TYPES.items()}, parametres)
+        noms = list(TYPES)
+        for r in liste:
+            noms.extend(n for n in r.colonnes if n not in noms)
+        return cls(
+            {n: np.concatenate([
+                r[n] if n in r.colonnes else np.full(len(r), "") for r in liste
+            ]) for n in noms},
+            parametres
+        )
+
+    def ecrire(self, chemin):
+        """Écrit le fichier binaire en colonnes"""
+        descriptions = []
+        position = 0
+        for nom, colonne in self.colonnes.items():
+            descriptions.append({
+                "nom": nom, "type": colonne.dtype.str, "decalage": position
+            })
+            position += _aligner(colonne.nbytes)
+        entete = json.dumps({
+            "version": VERSION,
+            "lignes": len(self),
+            "colonnes": descriptions,
+            "calculs": NOMS_CALCULS,
+            "etats": ETATS,
+            "parametres": self.parametres,
+        }).encode("utf-8")
+        debut = _aligner(len(SIGNATURE) + 8 + len(entete))
+        with open(chemin, "wb") as f:
+            f.write(SIGNATURE)
+            f.write(struct.pack("<Q", len(entete)))
+            f.write(entete)
+            f.write(b" " * (debut - f.tell()))
+            for colonne in self.colonnes.values():
+                f.write(np.ascontiguousarray(colonne).data)
+                f.write(b"\0" * (_aligner(colonne.nbytes) - colonne.nbytes))
+
+
+def _aligner(n):
+    return -(-n // ALIGNEMENT) * ALIGNEMENT
+
+
+def lire(chemin):
+    """Projette le fichier en mémoire et renvoie les Resultats dont les
+    colonnes sont des vues, en lecture seule, sur le fichier
+    """
+    with open(chemin, "rb") as f:
+        if f.read(len(SIGNATURE)) != SIGNATURE:
+            raise ValueError("%s n'est pas un fichier de résultats" % chemin)
+        taille, = struct.unpack("<Q", f.read(8))
+        entete = json.loads(f.read(taille).decode("utf-8"))
+        projection = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    debut = _aligner(len(SIGNATURE) + 8 + taille)
+    n = entete["lignes"]
+    colonnes = {}
+    for description in entete["colonnes"]:
+        colonnes[description["nom"]] = np.frombuffer(
+            projection, description["type"], n, debut + description["decalage"]
+        )
+    return Resultats(colonnes, entete["parametres"])
+
+
+def _calculer_bloc(enregistrements, parametres):
+    n = len(enregistrements)
+    colonnes = {nom: np.full(n, np.nan) for nom in VALEURS}
+    codes = np.full(n, INCONNU, "u1")
+    valeurs = {nom: [] for nom in NOMS_CALCULS}
+    lignes = {nom: [] for nom in NOMS_CALCULS}
+    # autres champs de l'entrée, dans l'ordre de leur première apparition
+    autres = {}
+    for i, enregistrement in enumerate(enregistrements):
+        if isinstance(enregistrement, lot.Illisible):
+            continue
+        for champ, v in enregistrement.items():
+            if champ is None or champ in TYPES or v is None or v == "":
+                continue
+            if champ not in autres:
+                autres[champ] = [""] * n
+            autres[champ][i] = str(v)
+        nom = enregistrement.get("calcul") or ""
+        nom = lot.ABREVIATIONS.get(nom, nom)
+        if nom not in lot.CALCULS:
+            continue
+        try:
+            v = [lot.lire_valeur(enregistrement, c) for c in lot.CALCULS[nom][1]]
+        except lot.ErreurEnregistrement:
+            continue
+        valeurs[nom].append(v)
+        lignes[nom].append(i)
+
+    etats = np.full(n, INCORRECT, "u1")
+    for code, nom in enumerate(NOMS_CALCULS):
+        if not lignes[nom]:
+            continue
+        fonction, entrees, sorties = lot.CALCULS[nom]
+        i = np.array(lignes[nom])
+        v = np.array(valeurs[nom])
+        codes[i] = code
+        for j, champ in enumerate(entrees):
+            colonnes[champ][i] = v[:, j]
+        *poids, faisable = getattr(vectoriel, fonction.__name__)(*v.T, parametres=parametres)
+        for champ, p in zip(sorties, poids):
+            colonnes[champ][i] = p
+        etats[i] = np.where(faisable, ACCEPTE, INFAISABLE)
+    colonnes["calcul"] = codes
+    colonnes["etat"] = etats
+    resultats = Resultats({nom: colonnes[nom] for nom in TYPES})
+    for champ, v in autres.items():
+        resultats.colonnes[champ] = np.array(v, dtype=str)
+    return resultats
+
+
+def calculer(enregistrements, parametres=None, taille_bloc=TAILLE_BLOC):
+    """Calcule les enregistrements (voir lot.py) par blocs et renvoie les
+    Resultats
+    """
+    if parametres is None:
+        parametres = formules.parametres_defaut()
+    enregistrements = iter(enregistrements)
+    blocs = []
+    while True:
+        bloc = list(islice(enregistrements, taille_bloc))
+        if not bloc:
+            break
+        blocs.append(_calculer_bloc(bloc, parametres))
+    return Resultats.concatener(blocs, parametres._asdict())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="résultats des traitements par lots en colonnes")
+    parser.add_argument('-t', "--test", action="store_true", help="passer les tests")
+    parser.add_argument("fichier", nargs='?', help="fichier binaire de résultats à afficher")
+    args = parser.parse_args()
+
+    if args.test:
+        import doctest
+        doctest.testmod()
+        sys.exit(0)
+    if not args.fichier:
+        parser.print_usage()
+        sys.exit(1)
+
+    resultats = lire(args.fichier)
+    etats = np.bincount(resultats["etat"], minlength=len(ETATS))
+    print("%d lignes : %s" % (len(resultats), ", ".join(
+        "%d %s" % (n, e) for n, e in zip(etats.tolist(), ETATS)
+    )))
+    print("paramètres : %s" % json.dumps(resultats.parametres, ensure_ascii=False))
+    for nom in resultats.noms():
+        colonne = resultats[nom]
+        print("%-7s %-4s %s" % (nom, colonne.dtype.str, colonne[:5].tolist()))
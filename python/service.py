@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+
+# license : GPL 3.0
+# copyright : Franck Barbenoire (franck@barbenoi.re)
+
+"""
+Service HTTP local (asyncio) qui expose les calculs de formules.py en JSON.
+
+Points d'accès (méthode POST, corps JSON, taux en pourcentage) :
+- /pate : {"ptp": ..., "thp": ..., "thl": ..., "tlf": ...}
+- /levain : {"pl": ..., "thp": ..., "thl": ..., "tlf": ...}
+- /equivalence : {"ptf": ..., "pte": ..., "thl": ..., "tlf": ...}
+- /lot : liste d'enregistrements comportant chacun un champ "calcul", comme
+  pour le traitement par lots (voir lot.py).
+
+GET /statistiques renvoie les compteurs du cache des résultats, s'il est
+activé (option --cache, voir cache.py).
+
+Les requêtes qui arrivent en même temps sont regroupées et calculées en une
+seule évaluation vectorisée (voir vectoriel.py). Une requête incorrecte ou dont
+les taux d'hydratation sont incompatibles reçoit une réponse 422 avec un champ
+"erreur" ; dans /lot, l'erreur figure à la place du résultat concerné.
+
+>>> import asyncio
+>>> async def essai():
+...     regroupeur = Regroupeur(formules.Parametres(taux_sel=0.02))
+...     reponses = await asyncio.gather(
+...         repondre(regroupeur, "POST", "/pate", b'{"ptp": 920, "thp": 60, "thl": 100, "tlf": 30}'),
+...         repondre(regroupeur, "POST", "/levain", b'{"pl": 200, "thp": 60, "thl": 400, "tlf": 25}'),
+...         repondre(regroupeur, "POST", "/lot", b'[{"calcul": "e", "ptf": 500, "pte": 300, "thl": 70, "tlf": 40}]'),
+...         repondre(regroupeur, "GET", "/pate", b''))
+...     return reponses, regroupeur.evaluations
+>>> reponses, evaluations = asyncio.run(essai())
+>>> for reponse in reponses:
+...     print(reponse)
+(200, {'pf': 442.3, 'pe': 212.3, 'pl': 265.4, 'ps': 11.5})
+(422, {'erreur': "Incompatibilité des taux d'hydratation"})
+(200, [{'pf': 429.3, 'pe': 199.0, 'pl': 171.7, 'ps': 10.0}])
+(405, {'erreur': 'méthode non autorisée'})
+>>> evaluations
+3
+
+Les valeurs qui ne sont pas des nombres finis sont refusées :
+
+>>> async def essai_limites():
+...     regroupeur = Regroupeur(formules.Parametres(taux_sel=0.02))
+...     return await asyncio.gather(
+...         repondre(regroupeur, "POST", "/pate", b'{"ptp": "1e400", "thp": 60, "thl": 100, "tlf": 30}'),
+...         repondre(regroupeur, "POST", "/pate", b'{"ptp": "nan", "thp": 60, "thl": 100, "tlf": 30}'),
+...         repondre(regroupeur, "POST", "/levain", b'{"pl": 1e308, "thp": 60, "thl": 100, "tlf": 30}'))
+>>> for reponse in asyncio.run(essai_limites()):
+...     print(reponse)
+(422, {'erreur': 'ptp incorrect'})
+(422, {'erreur': 'ptp incorrect'})
+(422, {'erreur': 'valeurs trop grandes'})
+
+Une requête HTTP dont l'en-tête Content-Length est incorrect reçoit une
+réponse 400 :
+
+>>> async def essai_http(requete):
+...     regroupeur = Regroupeur(formules.Parametres(taux_sel=0.02))
+...     serveur = await asyncio.start_server(
+...         lambda l, e: servir_client(regroupeur, l, e), "127.0.0.1", 0)
+...     async with serveur:
+...         lecteur, ecrivain = await asyncio.open_connection(*serveur.sockets[0].getsockname()[:2])
+...         ecrivain.write(requete)
+...         reponse = await lecteur.read()
+...         ecrivain.close()
+...     return reponse.split(b"\\r\\n")[0], reponse.split(b"\\r\\n\\r\\n")[1]
+>>> for longueur in (b"abc", b"-5"):
+...     print(asyncio.run(essai_http(b"POST /pate HTTP/1.1\\r\\nContent-Length: " + longueur + b"\\r\\n\\r\\n")))
+(b'HTTP/1.1 400 Bad Request', b'{"erreur": "Content-Length incorrect"}')
+(b'HTTP/1.1 400 Bad Request', b'{"erreur": "Content-Length incorrect"}')
+
+>>> async def essai_cache():
+...     regroupeur = Regroupeur(formules.Parametres(taux_sel=0.02), cache=Cache(10))
+...     for i in range(3):
+...         reponse = await repondre(regroupeur, "POST", "/levain", b'{"pl": 200, "thp": 60, "thl": 400, "tlf": 25}')
+...     return reponse, await repondre(regroupeur, "GET", "/statistiques", b'')
+>>> for reponse in asyncio.run(essai_cache()):
+...     print(reponse)
+(422, {'erreur': "Incompatibilité des taux d'hydratation"})
+(200, {'succes': 2, 'echecs': 1, 'evictions': 0, 'taille': 1, 'taille_max': 10})
+
+Avec l'option --socket, le service est un démon qui répond sur un socket Unix
+avec le protocole ligne à ligne décrit dans client.py :
+
+>>> import os, tempfile
+>>> async def essai_socket(chemin):
+...     regroupeur = Regroupeur(formules.Parametres(taux_sel=0.02))
+...     serveur = await ecouter_socket(chemin, regroupeur)
+...     async with serveur:
+...         return await asyncio.get_running_loop().run_in_executor(None, list, client.interroger([
+...             "pate 920 60 100 30",
+...             '{"calcul": "l", "pl": 200, "thp": 60, "thl": 400, "tlf": 25}',
+...             "e 500 300 70",
+...             "{pate}"], chemin))
+>>> for reponse in asyncio.run(essai_socket(os.path.join(tempfile.mkdtemp(), "s"))):
+...     print(reponse)
+442.3 212.3 265.4 11.5
+{"erreur": "Incompatibilité des taux d'hydratation"}
+erreur : 4 valeurs attendues
+{"erreur": "JSON incorrect"}
+"""
+
+import argparse
+import asyncio
+from collections import defaultdict
+import json
+import math
+import os
+import signal
+import stat
+import sys
+
+import numpy as np
+
+from cache import Cache
+import client
+import formules
+import lot
+import vectoriel
+
+FONCTIONS = {
+    "pate": vectoriel.calcul_pate_imposee,
+    "levain": vectoriel.calcul_levain_impose,
+    "equivalence": vectoriel.calcul_equivalence,
+}
+
+STATUTS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    422: "Unprocessable Entity",
+}
+
+TAILLE_MAX = 16 * 1024 * 1024
+
+
+class Regroupeur:
+    """Regroupe les calculs demandés pendant un court délai et les évalue en
+    une seule fois par type de calcul. Avec un cache, les calculs déjà
+    effectués sont servis sans attendre.
+    """
+
+    def __init__(self, parametres, delai=0.0005, lot_max=4096, cache=None):
+        self.parametres = parametres
+        self.delai = delai
+        self.lot_max = lot_max
+        self.cache = cache
+        self.en_attente = []
+        self.tache = None
+        self.evaluations = 0
+
+    def calculer(self, nom, valeurs):
+        """Renvoie un futur qui recevra le dictionnaire des poids calculés"""
+        futur = asyncio.get_running_loop().create_future()
+        if self.cache is not None:
+            resultat = self.cache.obtenir(self.cle(nom, valeurs))
+            if resultat is not None:
+                self.resoudre(futur, nom, resultat)
+                return futur
+        self.en_attente.append((nom, valeurs, futur))
+        if len(self.en_attente) >= self.lot_max:
+            self.evaluer()
+        elif self.tache is None:
+            self.tache = asyncio.get_running_loop().create_task(self.attendre())
+        return futur
+
+    async def attendre(self):
+        await asyncio.sleep(self.delai)
+        self.tache = None
+        self.evaluer()
+
+    def evaluer(self):
+        en_attente, self.en_attente = self.en_attente, []
+        groupes = defaultdict(list)
+        for demande in en_attente:
+            groupes[demande[0]].append(demande)
+
+        for nom, demandes in groupes.items():
+            colonnes = zip(*(valeurs for _, valeurs, _ in demandes))
+            # les dépassements donnent des valeurs infinies, refusées par
+            # resoudre()
+            with np.errstate(over="ignore", invalid="ignore"):
+                *poids, _ = FONCTIONS[nom](*colonnes, parametres=self.parametres)
+            resultats = zip(*(p.tolist() for p in poids))
+            for (_, valeurs, futur), resultat in zip(demandes, resultats):
+                if self.cache is not None:
+                    self.cache.ajouter(self.cle(nom, valeurs), resultat)
+                self.resoudre(futur, nom, resultat)
+            self.evaluations += 1
+
+    def cle(self, nom, valeurs):
+        # même clé que les fonctions de formules.py passées par le cache
+        return Cache.cle(FONCTIONS[nom].__name__, valeurs, self.parametres)
+
+    @staticmethod
+    def resoudre(futur, nom, resultat):
+        if futur.done():
+            return
+        if resultat[1] < 0:
+            futur.set_exception(lot.ErreurEnregistrement(
+                "Incompatibilité des taux d'hydratation"
+            ))
+        elif not all(math.isfinite(v) for v in resultat):
+            # pas de Infinity ni de NaN dans le JSON
+            futur.set_exception(lot.ErreurEnregistrement("valeurs trop grandes"))
+        else:
+            futur.set_result(dict(zip(lot.CALCULS[nom][2], resultat)))
+
+
+def valider(enregistrement, nom=None):
+    """Renvoie le nom du calcul et les valeurs d'entrée d'un enregistrement"""
+    if not isinstance(enregistrement, dict):
+        raise lot.ErreurEnregistrement("enregistrement incorrect")
+    if nom is None:
+        nom = enregistrement.get("calcul") or ""
+        nom = lot.ABREVIATIONS.get(nom, nom)
+        if nom not in lot.CALCULS:
+            raise lot.ErreurEnregistrement("calcul inconnu : %s" % nom)
+    entrees = lot.CALCULS[nom][1]
+    return nom, [lot.lire_valeur(enregistrement, champ) for champ in entrees]
+
+
+async def calculer(regroupeur, enregistrement, nom=None):
+    try:
+        return await regroupeur.calculer(*valider(enregistrement, nom))
+    except lot.ErreurEnregistrement as e:
+        return {lot.ERREUR: str(e)}
+
+
+async def repondre(regroupeur, methode, chemin, corps):
+    """Renvoie le statut et l'objet de la réponse à une requête"""
+    nom = chemin.strip("/")
+    if nom == "statistiques" and methode == "GET":
+        if regroupeur.cache is None:
+            return 404, {lot.ERREUR: "cache non activé"}
+        return 200, regroupeur.cache.statistiques()
+    if nom not in FONCTIONS and nom != "lot":
+        return 404, {lot.ERREUR: "calcul inconnu"}
+    if methode != "POST":
+        return 405, {lot.ERREUR: "méthode non autorisée"}
+    try:
+        donnees = json.loads(corps.decode("utf-8"))
+    except ValueError:
+        return 400, {lot.ERREUR: "JSON incorrect"}
+
+    if nom == "lot":
+        if not isinstance(donnees, list):
+            return 400, {lot.ERREUR: "liste d'enregistrements attendue"}
+        return 200, await asyncio.gather(
+            *(calculer(regroupeur, enregistrement) for enregistrement in donnees)
+        )
+    resultat = await calculer(regroupeur, donnees, nom)
+    return (422 if lot.ERREUR in resultat else 200), resultat
+
+
+async def servir_client(regroupeur, lecteur, ecrivain):
+    """Traite les requêtes HTTP/1.1 d'une connexion (persistante)"""
+    try:
+        while True:
+            ligne = await lecteur.readline()
+            if not ligne:
+                break
+            try:
+                methode, chemin, version = ligne.decode("latin-1").split()
+            except ValueError:
+                break
+            entetes = {}
+            while True:
+                ligne = await lecteur.readline()
+                if ligne in (b"\r\n", b"\n", b""):
+                    break
+                cle, _, valeur = ligne.decode("latin-1").partition(":")
+                entetes[cle.strip().lower()] = valeur.strip()
+
+            # la fin d'un corps de longueur incorrecte est inconnue : la
+            # connexion est fermée
+            longueur = entetes.get("content-length") or "0"
+            if not (longueur.isascii() and longueur.isdigit()):
+                statut, objet = 400, {lot.ERREUR: "Content-Length incorrect"}
+                fermer = True
+            elif int(longueur) > TAILLE_MAX:
+                statut, objet = 413, {lot.ERREUR: "requête trop grande"}
+                fermer = True
+            else:
+                corps = await lecteur.readexactly(int(longueur))
+                statut, objet = await repondre(regroupeur, methode, chemin, corps)
+                fermer = (
+                    entetes.get("connection", "").lower() == "close" or
+                    version == "HTTP/1.0"
+                )
+
+            reponse = json.dumps(objet, ensure_ascii=False).encode("utf-8")
+            ecrivain.write((
+                "HTTP/1.1 %d %s\r\n"
+                "Content-Type: application/json; charset=utf-8\r\n"
+                "Content-Length: %d\r\n"
+                "%s\r\n" % (
+                    statut, STATUTS[statut], len(reponse),
+                    "Connection: close\r\n" if fermer else ""
+                )
+            ).encode("latin-1") + reponse)
+            await ecrivain.drain()
+            if fermer:
+                break
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        ecrivain.close()
+
+
+def lire_ligne(ligne):
+    """Renvoie l'enregistrement d'une requête du protocole ligne à ligne
+    >>> lire_ligne("l 200 60 100 25")
+    {'pl': '200', 'thp': '60', 'thl': '100', 'tlf': '25', 'calcul': 'levain'}
+    """
+    if ligne.startswith("{"):
+        try:
+            return json.loads(ligne)
+        except ValueError:
+            raise lot.ErreurEnregistrement("JSON incorrect")
+    mots = ligne.split()
+    if not mots:
+        raise lot.ErreurEnregistrement("requête vide")
+    nom = lot.ABREVIATIONS.get(mots[0], mots[0])
+    if nom not in lot.CALCULS:
+        raise lot.ErreurEnregistrement("calcul inconnu : %s" % nom)
+    entrees = lot.CALCULS[nom][1]
+    if len(mots) != len(entrees) + 1:
+        raise lot.ErreurEnregistrement("%d valeurs attendues" % len(entrees))
+    enregistrement = dict(zip(entrees, mots[1:]))
+    enregistrement["calcul"] = nom
+    return enregistrement
+
+
+async def repondre_ligne(regroupeur, ligne):
+    """Renvoie la réponse à une requête du protocole ligne à ligne, dans le
+    format de la requête (texte ou JSON)
+    """
+    ligne = ligne.strip()
+    try:
+        resultat = await calculer(regroupeur, lire_ligne(ligne))
+    except lot.ErreurEnregistrement as e:
+        resultat = {lot.ERREUR: str(e)}
+    if ligne.startswith("{"):
+        return json.dumps(resultat, ensure_ascii=False)
+    if lot.ERREUR in resultat:
+        return "erreur : %s" % resultat[lot.ERREUR]
+    return " ".join(str(v) for v in resultat.values())
+
+
+async def servir_lignes(regroupeur, lecteur, ecrivain, en_cours_max=1024):
+    """Traite les requêtes ligne à ligne d'une connexion. Les requêtes
+    envoyées à la suite sont calculées ensemble (voir Regroupeur) ; les
+    réponses sont écrites dans l'ordre des requêtes.
+    """
+    file = asyncio.Queue(en_cours_max)
+
+    async def ecrire():
+        while True:
+            tache = await file.get()
+            if tache is None:
+                break
+            ecrivain.write((await tache).encode("utf-8") + b"\n")
+            await ecrivain.drain()
+
+    ecriture = asyncio.get_running_loop().create_task(ecrire())
+    try:
+        while True:
+            ligne = await lecteur.readline()
+            if not ligne:
+                break
+            ligne = ligne.decode("utf-8", "replace")
+            if ligne.strip():
+                await file.put(asyncio.get_running_loop().create_task(
+                    repondre_ligne(regroupeur, ligne)
+                ))
+        await file.put(None)
+        await ecriture
+    except (ConnectionError, ValueError):
+        # ValueError : ligne plus longue que la limite du lecteur
+        ecriture.cancel()
+    finally:
+        ecrivain.close()
+
+
+async def ecouter_socket(chemin, regroupeur):
+    """Crée le serveur du démon sur le socket Unix chemin, accessible au seul
+    utilisateur. Un socket laissé par un démon arrêté est remplacé.
+    """
+    if os.path.exists(chemin):
+        if not stat.S_ISSOCK(os.stat(chemin).st_mode):
+            raise OSError("%s existe et n'est pas un socket" % chemin)
+        try:
+            client.connecter(chemin).close()
+        except ConnectionRefusedError:
+            os.unlink(chemin)
+        else:
+            raise OSError("un démon écoute déjà sur %s" % chemin)
+    masque = os.umask(0o177)
+    try:
+        return await asyncio.start_unix_server(
+            lambda l, e: servir_lignes(regroupeur, l, e), chemin
+        )
+    finally:
+        os.umask(masque)
+
+
+async def servir_socket(chemin, parametres, delai, lot_max, cache=None):
+    regroupeur = Regroupeur(parametres, delai, lot_max, cache)
+    serveur = await ecouter_socket(chemin, regroupeur)
+    sys.stderr.write("Démon à l'écoute sur %s\n" % chemin)
+    # arrêt propre (suppression du socket) sur SIGTERM
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGTERM, asyncio.current_task().cancel
+    )
+    try:
+        async with serveur:
+            await serveur.serve_forever()
+    except asyncio.CancelledError:
+        pass
+    finally:
+        if os.path.exists(chemin):
+            os.unlink(chemin)
+
+
+async def servir(hote, port, parametres, delai, lot_max, cache=None):
+    regroupeur = Regroupeur(parametres, delai, lot_max, cache)
+    serveur = await asyncio.start_server(
+        lambda l, e: servir_client(regroupeur, l, e), hote, port
+    )
+    adresse = serveur.sockets[0].getsockname()
+    sys.stderr.write("Service à l'écoute sur http://%s:%d\n" % adresse[:2])
+    async with serveur:
+        await serveur.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="service HTTP des calculs sur le pain au levain")
+    parser.add_argument('-t', "--test", action="store_true", help="passer les tests")
+    parser.add_argument("--hote", default="127.0.0.1", help="adresse d'écoute")
+    parser.add_argument("--port", type=int, default=8080, help="port d'écoute")
+    parser.add_argument(
+        "--socket", nargs='?', const=client.SOCKET, metavar="CHEMIN",
+        help="démon sur un socket Unix, au lieu du service HTTP (%s par défaut)" % client.SOCKET
+    )
+    parser.add_argument(
+        "--delai", type=float, default=0.5,
+        help="délai de regroupement des requêtes (ms)"
+    )
+    parser.add_argument(
+        "--lot-max", type=int, default=4096,
+        help="nombre maximum de calculs regroupés"
+    )
+    parser.add_argument(
+        "--cache", type=int, default=0, metavar="TAILLE",
+        help="nombre de résultats mémorisés (0 : pas de cache)"
+    )
+    args = parser.parse_args()
+
+    if args.test:
+        import doctest
+        doctest.testmod()
+    else:
+        formules.lire_taux_sel()
+        cache = Cache(args.cache) if args.cache > 0 else None
+        try:
+            if args.socket:
+                asyncio.run(servir_socket(
+                    args.socket, formules.parametres_defaut(),
+                    args.delai / 1000, args.lot_max, cache
+                ))
+            else:
+                asyncio.run(servir(
+                    args.hote, args.port, formules.parametres_defaut(),
+                    args.delai / 1000, args.lot_max, cache
+                ))
+        except KeyboardInterrupt:
+            pass
+        except OSError as e:
+            sys.stderr.write("%s\n" % e)
+            sys.exit(1)
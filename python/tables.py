@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+
+# license : GPL 3.0
+# copyright : Franck Barbenoire (franck@barbenoi.re)
+
+"""
+Tables précalculées des formules, sur une grille de taux, à consulter en
+mémoire projetée (mmap).
+
+Les poids calculés par formules.py sont proportionnels au poids imposé (pâte,
+levain ou farine totale) : pour chaque point de la grille des taux, la table
+conserve les coefficients par gramme. Le taux de sel n'entre pas dans la
+table (seul le poids total de farine y figure) : une table sert pour tous les
+paramètres.
+
+Le fichier contient un entête JSON (axes de la grille, emplacement des
+tableaux) suivi des tableaux de coefficients (float64, petit-boutiste),
+alignés pour être projetés en mémoire. Une consultation ne lit que les
+quelques points voisins de la grille, pas la table entière.
+
+Les coefficients sont des fractions rationnelles des taux (en 1/tlf pour le
+levain imposé, par exemple) : interpolés tels quels, ils s'écarteraient de la
+formule entre les points de la grille, d'autant plus que tlf est petit. La
+table conserve donc, pour chaque calcul, les coefficients multipliés par leur
+dénominateur commun (l'échelle), et l'échelle elle-même : numérateurs et
+échelle sont linéaires en chacun des taux, leur interpolation linéaire est
+exacte et le quotient redonne la formule. En dehors de la grille, la formule
+exacte est utilisée.
+
+>>> import os, tempfile
+>>> chemin = os.path.join(tempfile.mkdtemp(), "tables.bin")
+>>> generer(chemin, thp=(50, 80, 1), thl=(50, 150, 10), tlf=(5, 50, 1))
+>>> tables = Tables(chemin)
+>>> p = formules.Parametres(taux_sel=0.02)
+>>> tables.calcul_pate_imposee(920, 0.6, 1.0, 0.3, p)
+(442.3, 212.3, 265.4, 11.5)
+>>> tables.calcul_levain_impose(200, 0.6, 1.0, 0.25, p)
+(400.0, 200.0, 800.0, 10.0)
+>>> tables.calcul_equivalence(500, 300, 0.7, 0.4, p)
+(429.3, 199.0, 171.7, 10.0)
+>>> tables.calcul_pate_imposee(1000, 0.655, 0.95, 0.205, p)  # entre les points
+(501.4, 298.1, 200.4, 12.1)
+>>> formules.calcul_pate_imposee(1000, 0.655, 0.95, 0.205, p)
+(501.4, 298.1, 200.4, 12.1)
+>>> tables.calcul_pate_imposee(1000, 0.9, 1.0, 0.3, p) == formules.calcul_pate_imposee(1000, 0.9, 1.0, 0.3, p)
+True
+>>> tables.calcul_levain_impose(1000, 0.725, 0.53, 0.104, p)  # entre les points
+(6284.6, 4683.8, 11968.3, 138.8)
+>>> formules.calcul_levain_impose(1000, 0.725, 0.53, 0.104, p)
+(6284.6, 4683.8, 11968.3, 138.8)
+
+Entre les points de la grille, les tables ne s'écartent pas des formules :
+
+>>> import random
+>>> alea = random.Random(1)
+>>> ecarts = []
+>>> for i in range(1000):
+...     thp, thl, tlf = alea.uniform(0.5, 0.8), alea.uniform(0.5, 1.5), alea.uniform(0.05, 0.5)
+...     for calcul, valeurs in (("calcul_pate_imposee", (1000, thp, thl, tlf)),
+...                             ("calcul_levain_impose", (1000, thp, thl, tlf)),
+...                             ("calcul_equivalence", (1000, 700, thl, tlf))):
+...         t = getattr(tables, calcul)(*valeurs, parametres=p)
+...         f = getattr(formules, calcul)(*valeurs, parametres=p)
+...         ecarts.extend(abs(a - b) for a, b in zip(t, f))
+>>> max(ecarts) <= 0.1
+True
+"""
+
+import argparse
+import json
+import math
+import struct
+import sys
+
+import numpy as np
+
+import formules
+import vectoriel
+
+MAGIQUE = b"FBTABLE1"
+VERSION = 2
+ALIGNEMENT = 64
+
+# coefficients par gramme de pâte, de levain ou de farine totale, multipliés
+# par l'échelle (dernière valeur)
+COEFFICIENTS = {
+    "pate": ("pf", "pe", "pl", "farine", "echelle"),
+    "levain": ("pf", "pe", "ptp", "farine", "echelle"),
+    "equivalence": ("pf", "eau_levain", "pl", "echelle"),
+}
+AXES = {
+    "pate": ("thp", "thl", "tlf"),
+    "levain": ("thp", "thl", "tlf"),
+    "equivalence": ("thl", "tlf"),
+}
+
+
+def axe(debut, fin, pas):
+    """Axe de la grille, en pourcentages -> (début, pas, nombre de points) en
+    fractions
+    >>> axe(50, 80, 1)
+    (0.5, 0.01, 31)
+    """
+    if not pas > 0:
+        raise ValueError("Axe incorrect : %s:%s:%s" % (debut, fin, pas))
+    n = int(round((fin - debut) / pas)) + 1
+    if n < 1:
+        raise ValueError("Axe incorrect : %s:%s:%s" % (debut, fin, pas))
+    return debut / 100, pas / 100, n
+
+
+def valeurs_axe(debut, pas, n):
+    return debut + pas * np.arange(n)
+
+
+def _mise_a_l_echelle(coefficients, echelle):
+    return np.stack([c * echelle for c in coefficients] + [echelle], axis=-1)
+
+
+def coefficients(thp, thl, tlf):
+    """Calcule les coefficients par gramme sur la grille (tableaux diffusés),
+    multipliés par leur échelle
+    """
+    unite = formules.Parametres(taux_sel=1.0)
+    tableaux = {}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t_thp, t_thl, t_tlf = np.meshgrid(thp, thl, tlf, indexing="ij")
+
+        pfl = t_tlf / (1 + t_tlf) / (1 + t_thp)
+        pf, pe, farine = vectoriel.calcul_eau_farine_sel(t_thp, t_thl, t_tlf, pfl, unite)
+        tableaux["pate"] = _mise_a_l_echelle(
+            [pf, pe, (1 + t_thl) * pfl, farine], (1 + t_tlf) * (1 + t_thp)
+        )
+
+        pfl = 1 / (1 + t_thl)
+        pf, pe, farine = vectoriel.calcul_eau_farine_sel(t_thp, t_thl, t_tlf, pfl, unite)
+        tableaux["levain"] = _mise_a_l_echelle(
+            [pf, pe, 1 + pf + pe, farine], t_tlf * (1 + t_thl)
+        )
+
+        e_thl, e_tlf = np.meshgrid(thl, tlf, indexing="ij")
+        pf = 1 / (1 + e_tlf / (1 + 1 / e_thl))
+        eau_levain = e_tlf / (1 + (1 + e_tlf) * e_thl)
+        tableaux["equivalence"] = _mise_a_l_echelle(
+            [pf, eau_levain, pf * e_tlf], 1 + (1 + e_tlf) * e_thl
+        )
+    return tableaux
+
+
+def generer(chemin, thp=(50, 100, 1), thl=(50, 150, 5), tlf=(1, 100, 1)):
+    """Écrit les tables de la grille (axes en pourcentage : début, fin, pas)"""
+    axes = {"thp": axe(*thp), "thl": axe(*thl), "tlf": axe(*tlf)}
+    tableaux = coefficients(*(valeurs_axe(*axes[a]) for a in ("thp", "thl", "tlf")))
+
+    entete = {"version": VERSION, "axes": axes, "tableaux": {}}
+    # l'entête contient les positions des tableaux, qui dépendent de sa taille :
+    # on réserve une taille fixe, arrondie à l'alignement
+    taille_entete = ALIGNEMENT * 16
+    position = len(MAGIQUE) + 4 + taille_entete
+    for nom in ("pate", "levain", "equivalence"):
+        tableau = tableaux[nom]
+        entete["tableaux"][nom] = {"position": position, "forme": list(tableau.shape)}
+        position += tableau.nbytes
+        position += -position % ALIGNEMENT
+
+    texte = json.dumps(entete).encode("utf-8")
+    if len(texte) > taille_entete:
+        raise ValueError("Entête trop grand")
+    with open(chemin, "wb") as f:
+        f.write(MAGIQUE)
+        f.write(struct.pack("<I", taille_entete))
+        f.write(texte.ljust(taille_entete, b" "))
+        for nom in ("pate", "levain", "equivalence"):
+            f.seek(entete["tableaux"][nom]["position"])
+            f.write(tableaux[nom].astype("<f8").tobytes())
+
+
+class Tables:
+    """Tables projetées en mémoire, consultées comme les fonctions de
+    formules.py
+    """
+
+    def __init__(self, chemin):
+        with open(chemin, "rb") as f:
+            if f.read(len(MAGIQUE)) != MAGIQUE:
+                raise ValueError("Fichier de tables incorrect : %s" % chemin)
+            taille, = struct.unpack("<I", f.read(4))
+            entete = json.loads(f.read(taille).decode("utf-8"))
+        if entete.get("version") != VERSION:
+            raise ValueError("Version du fichier de tables incorrecte : %s" % chemin)
+        self.axes = {nom: tuple(valeurs) for nom, valeurs in entete["axes"].items()}
+        self.tableaux = {
+            nom: np.memmap(
+                chemin, dtype="<f8", mode="r",
+                offset=description["position"], shape=tuple(description["forme"])
+            )
+            for nom, description in entete["tableaux"].items()
+        }
+
+    def position(self, nom, valeur):
+        """Renvoie (indice, fraction) de la valeur sur l'axe, None en dehors"""
+        debut, pas, n = self.axes[nom]
+        x = (valeur - debut) / pas
+        proche = round(x)
+        if abs(x - proche) < 1e-9:
+            x = proche
+        if x < 0 or x > n - 1:
+            return None
+        i = min(int(x), n - 2) if n > 1 else 0
+        return i, x - i
+
+    def interpoler(self, nom, *valeurs):
+        """Renvoie les coefficients interpolés (numérateurs et échelle
+        interpolés, puis divisés), None en dehors de la grille
+        """
+        positions = []
+        for a, v in zip(AXES[nom], valeurs):
+            p = self.position(a, v)
+            if p is None:
+                return None
+            positions.append(p)
+
+        indices = tuple(slice(i, i + 2) if f else slice(i, i + 1) for i, f in positions)
+        voisins = np.asarray(self.tableaux[nom][indices])
+        for i, f in positions:
+            # réduction du premier axe restant
+            voisins = voisins[0] * (1 - f) + voisins[1] * f if f else voisins[0]
+        *numerateurs, echelle = voisins.tolist()
+        if not echelle:
+            # tlf nul : pas de coefficient, la formule exacte est utilisée
+            return None
+        return [v / echelle for v in numerateurs]
+
+    def calcul_pate_imposee(self, ptp, thp, thl, tlf, parametres=None):
+        if parametres is None:
+            parametres = formules.parametres_defaut()
+        c = self.interpoler("pate", thp, thl, tlf)
+        if c is None or any(map(math.isnan, c)):
+            return formules.calcul_pate_imposee(ptp, thp, thl, tlf, parametres)
+        n = parametres.precision
+        return (
+            round(ptp * c[0], n), round(ptp * c[1], n), round(ptp * c[2], n),
+            round(ptp * c[3] * parametres.taux_sel, n)
+        )
+
+    def calcul_levain_impose(self, pl, thp, thl, tlf, parametres=None):
+        if parametres is None:
+            parametres = formules.parametres_defaut()
+        c = self.interpoler("levain", thp, thl, tlf)
+        if c is None or any(map(math.isnan, c)):
+            return formules.calcul_levain_impose(pl, thp, thl, tlf, parametres)
+        n = parametres.precision
+        return (
+            round(pl * c[0], n), round(pl * c[1], n), round(pl * c[2], n),
+            round(pl * c[3] * parametres.taux_sel, n)
+        )
+
+    def calcul_equivalence(self, ptf, pte, thl, tlf, parametres=None):
+        if parametres is None:
+            parametres = formules.parametres_defaut()
+        c = self.interpoler("equivalence", thl, tlf)
+        if c is None or any(map(math.isnan, c)):
+            return formules.calcul_equivalence(ptf, pte, thl, tlf, parametres)
+        n = parametres.precision
+        return (
+            round(ptf * c[0], n), round(pte - ptf * c[1], n), round(ptf * c[2], n),
+            round(ptf * parametres.taux_sel, n)
+        )
+
+
+def lire_axe(texte):
+    """Lit un axe donné en argument sous la forme début:fin:pas
+    >>> lire_axe("50:100:2.5")
+    (50.0, 100.0, 2.5)
+    >>> lire_axe("50:100")  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ...
+    argparse.ArgumentTypeError: axe attendu sous la forme début:fin:pas
+    >>> lire_axe("100:50:1")  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ...
+    argparse.ArgumentTypeError: Axe incorrect : 100.0:50.0:1.0
+    >>> lire_axe("0:100:0")  # doctest: +IGNORE_EXCEPTION_DETAIL
+    Traceback (most recent call last):
+    ...
+    argparse.ArgumentTypeError: Axe incorrect : 0.0:100.0:0.0
+    """
+    valeurs = texte.split(":")
+    try:
+        if len(valeurs) != 3:
+            raise ValueError
+        valeurs = tuple(float(v) for v in valeurs)
+    except ValueError:
+        raise argparse.ArgumentTypeError("axe attendu sous la forme début:fin:pas")
+    try:
+        axe(*valeurs)
+    except (ValueError, OverflowError):
+        raise argparse.ArgumentTypeError("Axe incorrect : %s:%s:%s" % valeurs)
+    return valeurs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="tables précalculées des formules")
+    parser.add_argument('-t', "--test", action="store_true", help="passer les tests")
+    parser.add_argument("fichier", nargs='?', help="fichier des tables à générer")
+    parser.add_argument("--thp", type=lire_axe, default=(50, 100, 1), help="taux d'hydratation de la pâte, début:fin:pas (%%)")
+    parser.add_argument("--thl", type=lire_axe, default=(50, 150, 5), help="taux d'hydratation du levain, début:fin:pas (%%)")
+    parser.add_argument("--tlf", type=lire_axe, default=(1, 100, 1), help="taux levain farine, début:fin:pas (%%)")
+    args = parser.parse_args()
+
+    if args.test:
+        import doctest
+        doctest.testmod()
+    elif args.fichier:
+        generer(args.fichier, args.thp, args.thl, args.tlf)
+    else:
+        parser.print_usage()
+        sys.exit(1)
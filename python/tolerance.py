@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+# license : GPL 3.0
+# copyright : Franck Barbenoire (franck@barbenoi.re)
+
+"""
+Analyse de tolérance (Monte-Carlo) des recettes : effet des erreurs de pesée
+et de l'hydratation réelle du levain sur la pâte obtenue.
+
+Pour chaque recette, les poids de farine, d'eau et de levain sont
+calculés avec formules.calcul_pate_imposee, puis « pesés » de nombreuses fois
+avec une erreur tirée uniformément dans la tolérance de la balance (± g),
+avec un levain dont l'hydratation s'écarte de la valeur prévue (± points de
+pourcentage). Chaque tirage donne une pâte réelle, dont on calcule :
+- thp : le taux d'hydratation (%) ;
+- tlf : le taux levain farine (%) ;
+- ptp : le poids de la pâte, sans le sel, comme dans formules.py ;
+- farine, eau : les poids totaux de farine et d'eau, levain compris.
+
+Les percentiles de ces grandeurs sont donnés pour chaque recette. Les tirages
+sont vectorisés (NumPy). Chaque recette a son propre générateur, dérivé de la
+graine : les résultats ne dépendent ni de l'ordre des recettes, ni du nombre
+de processus utilisés.
+
+Les recettes sont celles du catalogue (voir catalogue.py), taux en
+pourcentage.
+
+>>> import catalogue
+>>> campagne = catalogue.Recette("campagne", "pain", 60.0, 100.0, 30.0, 2.0, 920.0)
+>>> p = formules.Parametres(taux_sel=0.018)
+>>> for ligne in analyser_recette(campagne, 100000, Tolerances(0, 0), 1, p):
+...     print(ligne["grandeur"], ligne["nominal"], ligne["p1"], ligne["p99"])
+thp 60.0 60.0 60.0
+tlf 30.0 30.0 30.0
+ptp 920.0 920.0 920.0
+farine 575.0 575.0 575.0
+eau 345.0 345.0 345.0
+>>> lignes = analyser_recette(campagne, 100000, Tolerances(2, 5), 1, p)
+>>> [(l["grandeur"], l["p1"], l["p50"], l["p99"]) for l in lignes[:2]]
+[('thp', 58.8, 60.0, 61.2), ('tlf', 29.1, 30.0, 30.9)]
+>>> seigle = catalogue.Recette("seigle", "pain", 80.0, 100.0, 25.0, None, 1000.0)
+>>> a = list(analyser([campagne, seigle], 10000, Tolerances(2, 5), graine=3))
+>>> b = list(analyser([campagne, seigle], 10000, Tolerances(2, 5), graine=3, travailleurs=2))
+>>> a == b, len(a)
+(True, 10)
+"""
+
+import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import sys
+
+import numpy as np
+
+import formules
+import lot
+
+# tolérance de la balance (g) et écart d'hydratation du levain (points de %)
+Tolerances = namedtuple("Tolerances", ["balance", "levain"])
+
+GRANDEURS = ("thp", "tlf", "ptp", "farine", "eau")
+QUANTILES = (1, 5, 50, 95, 99)
+CHAMPS = ("recette", "grandeur", "nominal") + tuple("p%d" % q for q in QUANTILES)
+
+# nombre de tirages calculés ensemble : borne la mémoire des intermédiaires
+TAILLE_BLOC = 1 << 20
+
+
+def pate_reelle(pf, pe, pl, thl, rng, n, tolerances):
+    """Tire n pâtes réelles pour les poids prévus, renvoie les grandeurs
+    (dictionnaire de tableaux)
+    """
+    def bruit(tolerance):
+        return rng.uniform(-tolerance, tolerance, n) if tolerance else np.zeros(n)
+
+    farine = pf + bruit(tolerances.balance)
+    eau = pe + bruit(tolerances.balance)
+    levain = pl + bruit(tolerances.balance)
+    hydratation = thl / 100.0 + bruit(tolerances.levain / 100.0)
+
+    farine_levain = levain / (1 + hydratation)
+    farine_totale = farine + farine_levain
+    eau_totale = eau + (levain - farine_levain)
+    return {
+        "thp": eau_totale / farine_totale * 100,
+        "tlf": farine_levain / farine * 100,
+        "ptp": farine + eau + levain,
+        "farine": farine_totale,
+        "eau": eau_totale,
+    }
+
+
+def analyser_recette(recette, n, tolerances, graine, parametres=None, ptp=None, precision=1):
+    """Renvoie les lignes (dictionnaires) de l'analyse d'une recette : les
+    valeurs nominales et les percentiles de chaque grandeur. Une recette
+    infaisable donne une seule ligne, avec un champ "erreur".
+    """
+    if parametres is None:
+        parametres = formules.parametres_defaut()
+    poids = recette.ptp if ptp is None else ptp
+    if poids is None:
+        return [{"recette": recette.nom, lot.ERREUR: "poids de la pâte manquant"}]
+    pf, pe, pl, _ = formules.calcul_pate_imposee(
+        poids, recette.thp / 100.0, recette.thl / 100.0, recette.tlf / 100.0, parametres
+    )
+    if pe < 0:
+        return [{"recette": recette.nom, lot.ERREUR: "Incompatibilité des taux d'hydratation"}]
+
+    rng = np.random.default_rng(graine)
+    tirages = {g: np.empty(n) for g in GRANDEURS}
+    for debut in range(0, n, TAILLE_BLOC):
+        taille = min(TAILLE_BLOC, n - debut)
+        bloc = pate_reelle(pf, pe, pl, recette.thl, rng, taille, tolerances)
+        for g in GRANDEURS:
+            tirages[g][debut:debut + taille] = bloc[g]
+
+    farine_levain = pl / (1 + recette.thl / 100.0)
+    nominal = {
+        "thp": (pe + pl - farine_levain) / (pf + farine_levain) * 100,
+        "tlf": farine_levain / pf * 100,
+        "ptp": pf + pe + pl,
+        "farine": pf + farine_levain,
+        "eau": pe + pl - farine_levain,
+    }
+    lignes = []
+    for g in GRANDEURS:
+        ligne = {
+            "recette": recette.nom, "grandeur": g,
+            "nominal": round(nominal[g], precision)
+        }
+        for q, v in zip(QUANTILES, np.percentile(tirages[g], QUANTILES).tolist()):
+            ligne["p%d" % q] = round(v, precision)
+        lignes.append(ligne)
+    return lignes
+
+
+def analyser(recettes, n, tolerances, graine=0, travailleurs=1, parametres=None, ptp=None):
+    """Génère les lignes de l'analyse des recettes, dans l'ordre des recettes.
+    Au-delà d'un travailleur, les recettes sont réparties sur plusieurs
+    processus.
+    """
+    if parametres is None:
+        parametres = formules.parametres_defaut()
+    recettes = list(recettes)
+    graines = np.random.SeedSequence(graine).spawn(len(recettes))
+    arguments = [
+        (r, n, tolerances, g, parametres, ptp, parametres.precision)
+        for r, g in zip(recettes, graines)
+    ]
+    if travailleurs > 1:
+        with ProcessPoolExecutor(travailleurs) as executeur:
+            for lignes in executeur.map(analyser_recette, *zip(*arguments)):
+                yield from lignes
+    else:
+        for a in arguments:
+            yield from analyser_recette(*a)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="analyse de tolérance des recettes (Monte-Carlo)")
+    parser.add_argument('-t', "--test", action="store_true", help="passer les tests")
+    parser.add_argument("recettes", nargs='?', help="fichier des recettes (champs du catalogue) ou base SQLite (.sqlite)")
+    parser.add_argument('-n', "--tirages", type=int, default=1000000, help="nombre de tirages par recette")
+    parser.add_argument('-b', "--balance", type=float, default=2.0, help="tolérance de la balance (± g)")
+    parser.add_argument('-l', "--levain", type=float, default=5.0, help="écart d'hydratation du levain (± points de %%)")
+    parser.add_argument('-p', "--ptp", type=float, help="poids de la pâte, pour toutes les recettes")
+    parser.add_argument('-c', "--categorie", help="recettes de la catégorie (base SQLite)")
+    parser.add_argument('-g', "--graine", type=int, default=0, help="graine du générateur aléatoire")
+    parser.add_argument('-w', "--workers", type=int, default=1, metavar="N", help="nombre de processus")
+    parser.add_argument('-f', "--format", choices=lot.FORMATS, default="csv", help="format des recettes et des résultats")
+    args = parser.parse_args()
+
+    if args.test:
+        import doctest
+        doctest.testmod()
+        sys.exit(0)
+    if not args.recettes:
+        parser.print_usage()
+        sys.exit(1)
+    if args.tirages <= 0:
+        parser.error("le nombre de tirages doit être positif")
+    if args.workers <= 0:
+        parser.error("le nombre de processus doit être positif")
+
+    import catalogue
+
+    formules.lire_taux_sel()
+    try:
+        if args.recettes.endswith((".sqlite", ".db")):
+            base = catalogue.Catalogue(args.recettes)
+            recettes = base.recettes(args.categorie)
+            base.fermer()
+        else:
+            with open(args.recettes, encoding="utf-8", newline="") as f:
+                recettes = [catalogue.recette(e) for e in lot.lire(f, args.format)]
+    except lot.ErreurEnregistrement as e:
+        sys.stderr.write("%s\n" % e)
+        sys.exit(1)
+
+    ecrivain = lot.Ecrivain(sys.stdout, args.format, CHAMPS, (lot.ERREUR,))
+    for ligne in analyser(
+        recettes, args.tirages, Tolerances(args.balance, args.levain),
+        args.graine, args.workers, ptp=args.ptp
+    ):
+        ecrivain.ecrire(ligne)
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+# license : GPL 3.0
+# copyright : Franck Barbenoire (franck@barbenoi.re)
+
+"""
+Versions vectorisées (NumPy) des formules de formules.py.
+
+Les fonctions acceptent indifféremment des scalaires ou des tableaux NumPy
+(les scalaires sont diffusés) et renvoient des colonnes : un tableau par poids
+calculé, suivi d'un masque booléen de faisabilité qui remplace le test
+`pe < 0` effectué après chaque appel des fonctions scalaires. Le taux de sel
+peut varier d'une ligne à l'autre : l'argument taux_sel (scalaire ou
+tableau), s'il est donné, remplace celui des paramètres.
+
+Les arrondis sont identiques à ceux de la fonction round() de Python,
+utilisée par les fonctions scalaires :
+
+>>> import formules
+>>> ptp = np.array([920, 1000, 1500.5])
+>>> pf, pe, pl, ps, ok = calcul_pate_imposee(ptp, 0.6, 1.0, 0.3)
+>>> [tuple(float(c[i]) for c in (pf, pe, pl, ps)) for i in range(3)] == [
+...     formules.calcul_pate_imposee(p, 0.6, 1.0, 0.3) for p in ptp.tolist()]
+True
+>>> ok
+array([ True,  True,  True])
+"""
+
+import numpy as np
+
+import formules
+
+
+def arrondi(x, ndigits=1):
+    """Arrondit chaque élément de x exactement comme round(x, ndigits).
+
+    np.round() multiplie par 10 ** ndigits avant d'arrondir, ce qui introduit
+    une erreur qui peut faire basculer les cas situés à la limite. Ici, le
+    produit est calculé exactement (partie haute + erreur) et l'erreur départage
+    les cas où la partie haute tombe juste au milieu de deux entiers.
+
+    >>> arrondi(np.array([0.25, 0.35, 2.675, -0.05, 1e-17]), 1).tolist()
+    [0.2, 0.3, 2.7, -0.1, 0.0]
+    >>> [round(v, 1) for v in (0.25, 0.35, 2.675, -0.05, 1e-17)]
+    [0.2, 0.3, 2.7, -0.1, 0.0]
+    >>> float(arrondi(2.675, 2)), round(2.675, 2)
+    (2.67, 2.67)
+    """
+    if not 0 <= ndigits <= 22:
+        raise ValueError("Nombre de décimales non supporté : %r" % ndigits)
+    x = np.asarray(x, dtype=np.float64)
+    echelle = 10.0 ** ndigits
+
+    # produit exact x * echelle = haut + bas (algorithme de Dekker)
+    haut = x * echelle
+    xh, xb = _decoupe(x)
+    eh, eb = _decoupe(echelle)
+    bas = ((xh * eh - haut) + xh * eb + xb * eh) + xb * eb
+
+    plancher = np.floor(haut)
+    milieu = (haut - plancher) == 0.5
+    entier = np.rint(haut)
+    entier = np.where(milieu & (bas > 0), plancher + 1, entier)
+    entier = np.where(milieu & (bas < 0), plancher, entier)
+    resultat = np.copysign(entier, x) / echelle
+    return resultat if resultat.ndim else resultat[()]
+
+
+def _decoupe(a):
+    """Découpe de Veltkamp : a = haut + bas, chacun sur 26 bits."""
+    c = 134217729.0 * a  # 2 ** 27 + 1
+    haut = c - (c - a)
+    return haut, a - haut
+
+
+def _faisable(pe):
+    return np.asarray(pe >= 0)
+
+
+def calcul_eau_farine_sel(thp, thl, tlf, pfl, parametres=None, taux_sel=None):
+    """Version vectorisée de formules.calcul_eau_farine_sel (sans arrondi)
+    >>> pf, pe, ps = calcul_eau_farine_sel(0.6, 1.0, np.array([0.25, 0.5]), 100.0)
+    >>> pf.tolist(), arrondi(pe).tolist()
+    ([400.0, 200.0], [200.0, 80.0])
+    """
+    if parametres is None:
+        parametres = formules.parametres_defaut()
+    thp, thl, tlf, pfl = np.broadcast_arrays(
+        *(np.asarray(v, dtype=np.float64) for v in (thp, thl, tlf, pfl))
+    )
+    pf = pfl / tlf
+    pe = ((1 / tlf + 1) * thp - thl) * pfl
+    if taux_sel is None:
+        taux_sel = parametres.taux_sel
+    ps = (pf + pfl) * taux_sel
+    return pf, pe, ps
+
+
+def calcul_pate_imposee(ptp, thp, thl, tlf, parametres=None, taux_sel=None):
+    """Calcule les poids de la farine, de l'eau, du levain et du sel
+    >>> pf, pe, pl, ps, ok = calcul_pate_imposee(920, 0.6, np.array([1.0, 4.0]), 0.3)
+    >>> pf.tolist(), pe.tolist(), ok.tolist()
+    ([442.3, 442.3], [212.3, -185.8], [True, False])
+    >>> calcul_pate_imposee(920, 0.6, 1.0, 0.3, taux_sel=np.array([0.02, 0.01]))[3].tolist()
+    [11.5, 5.8]
+    """
+    if parametres is None:
+        parametres = formules.parametres_defaut()
+    ptp, thp, thl, tlf = np.broadcast_arrays(
+        *(np.asarray(v, dtype=np.float64) for v in (ptp, thp, thl, tlf))
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pfl = (ptp * tlf) / (1 + tlf) / (1 + thp)
+        pf, pe, ps = calcul_eau_farine_sel(thp, thl, tlf, pfl, parametres, taux_sel)
+        pl = (1 + thl) * pfl
+    n = parametres.precision
+    pe = arrondi(pe, n)
+    return arrondi(pf, n), pe, arrondi(pl, n), arrondi(ps, n), _faisable(pe)
+
+
+def calcul_levain_impose(pl, thp, thl, tlf, parametres=None, taux_sel=None):
+    """Calcule les poids de la farine, de l'eau, de la pâte et du sel
+    >>> pf, pe, ptp, ps, ok = calcul_levain_impose(np.array([200, 300]), 0.6, 1.0, 0.25)
+    >>> pf.tolist(), pe.tolist(), ptp.tolist(), ok.tolist()
+    ([400.0, 600.0], [200.0, 300.0], [800.0, 1200.0], [True, True])
+    """
+    if parametres is None:
+        parametres = formules.parametres_defaut()
+    pl, thp, thl, tlf = np.broadcast_arrays(
+        *(np.asarray(v, dtype=np.float64) for v in (pl, thp, thl, tlf))
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pfl = pl / (1 + thl)
+        pf, pe, ps = calcul_eau_farine_sel(thp, thl, tlf, pfl, parametres, taux_sel)
+        ptp = pl + pf + pe
+    n = parametres.precision
+    pe = arrondi(pe, n)
+    return arrondi(pf, n), pe, arrondi(ptp, n), arrondi(ps, n), _faisable(pe)
+
+
+def calcul_equivalence(ptf, pte, thl, tlf, parametres=None, taux_sel=None):
+    """Calcule les poids de la farine, de l'eau, du levain et du sel
+    >>> pf, pe, pl, ps, ok = calcul_equivalence(500, np.array([300, 100]), 0.7, 0.4)
+    >>> pf.tolist(), pe.tolist(), pl.tolist(), ok.tolist()
+    ([429.3, 429.3], [199.0, -1.0], [171.7, 171.7], [True, False])
+    """
+    if parametres is None:
+        parametres = formules.parametres_defaut()
+    ptf, pte, thl, tlf = np.broadcast_arrays(
+        *(np.asarray(v, dtype=np.float64) for v in (ptf, pte, thl, tlf))
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pf = ptf / (1 + tlf / (1 + 1 / thl))
+        pe = pte - ptf * tlf / (1 + (1 + tlf) * thl)
+        pl = pf * tlf
+
+        if taux_sel is None:
+            taux_sel = parametres.taux_sel
+        ps = ptf * taux_sel
+    n = parametres.precision
+    pe = arrondi(pe, n)
+    return arrondi(pf, n), pe, arrondi(pl, n), arrondi(ps, n), _faisable(pe)
+
+
+if __name__ == "__main__":
+    import doctest
+    doctest.testmod()